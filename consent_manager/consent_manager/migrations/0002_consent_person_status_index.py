@@ -0,0 +1,17 @@
+# Generated by Django 2.2.5 on 2026-10-19 18:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('consent_manager', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='consent',
+            index=models.Index(fields=['person_id', 'status'], name='consent_person_status_idx'),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 2.2.5 on 2026-10-19 21:40
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('consent_manager', '0002_consent_person_status_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='consent',
+            name='updated',
+            field=models.DateTimeField(auto_now=True, db_index=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+    ]
@@ -56,10 +56,18 @@ class Consent(models.Model):
     confirmed = models.DateTimeField(null=True)
     start_validity = models.DateTimeField(null=True)
     expire_validity = models.DateTimeField(null=True)
+    # used to get the consents changed since a time
+    updated = models.DateTimeField(auto_now=True, db_index=True)
 
     def __str__(self):
         return 'Consent ID: {} - Person: {} - Status {}'.format(self.consent_id, self.person_id, self.status)
 
+    class Meta:
+        indexes = [
+            # used to get the consents of a person, optionally filtered by status
+            models.Index(fields=['person_id', 'status'], name='consent_person_status_idx'),
+        ]
+
 
 # class ConsentHistory(models.Model):
 #     """
@@ -16,9 +16,11 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 
 
+from django.db import transaction
 from django.db.models import Q
 from rest_framework import serializers
 from rest_framework.exceptions import ValidationError
+from rest_framework.settings import api_settings
 
 from consent_manager.models import Consent, Endpoint
 from hgw_common.models import Profile
@@ -36,15 +38,22 @@ class EnpointDuplicateValidator(object):
         try:
             e = Endpoint.objects.get(Q(id=attrs['id']) | Q(name=attrs['name']))
             if e:
-                if e.name != attrs['name']:
-                    raise ValidationError(self.message.format(equal_field='id', different_field='name'),
-                                          code='duplicate')
-                if e.id != attrs['id']:
-                    raise ValidationError(self.message.format(equal_field='name', different_field='id'),
-                                          code='duplicate')
+                self.check(e, attrs)
         except Endpoint.DoesNotExist:
             return attrs
 
+    def check(self, endpoint, attrs):
+        """
+        Raises a ValidationError if the existing :param:`endpoint` has the same id or name of :param:`attrs`
+        but not both
+        """
+        if endpoint.name != attrs['name']:
+            raise ValidationError(self.message.format(equal_field='id', different_field='name'),
+                                  code='duplicate')
+        if endpoint.id != attrs['id']:
+            raise ValidationError(self.message.format(equal_field='name', different_field='id'),
+                                  code='duplicate')
+
 
 class EndpointSerializer(serializers.ModelSerializer):
     id = serializers.CharField(max_length=32, allow_null=False, allow_blank=False)
@@ -58,6 +67,16 @@ class EndpointSerializer(serializers.ModelSerializer):
         fields = ('id', 'name')
 
 
+class BulkEndpointSerializer(EndpointSerializer):
+    """
+    Endpoint serializer used by the bulk creation of consents. The check against the
+    existing endpoints is performed for all the consents at once by :func:`create_consents`
+    """
+
+    def get_validators(self):
+        return super(EndpointSerializer, self).get_validators()
+
+
 class ConsentSerializerDuplicateValidator(object):
     message = 'Consent already present'
 
@@ -137,6 +156,13 @@ class ConsentSerializer(serializers.ModelSerializer):
                     c.save()
             return attrs
 
+    @staticmethod
+    def setup_eager_loading(queryset):
+        """
+        Returns the :param:`queryset` with the related objects needed by the serializer, loaded in the same query
+        """
+        return queryset.select_related('source', 'destination', 'profile')
+
     # def get_validators(self):
     #     return super(ConsentSerializer, self).get_validators() + [ConsentSerializerDuplicateValidator()]
 
@@ -154,3 +180,139 @@ class ConsentSerializer(serializers.ModelSerializer):
                     'invalid': 'invalid_date_format'}
             }
         }
+
+
+class ConsentStatusSerializer(serializers.ModelSerializer):
+    """
+    Read only serializer with the status of the consents, returned to the clients that are not super clients
+    """
+    source = EndpointSerializer(many=False, read_only=True)
+
+    @staticmethod
+    def setup_eager_loading(queryset):
+        return queryset.select_related('source')
+
+    class Meta:
+        model = Consent
+        fields = ('consent_id', 'source', 'status', 'start_validity', 'expire_validity')
+
+
+class BulkConsentSerializer(ConsentSerializer):
+    """
+    Consent serializer that performs only the validation of the fields. The validation against the
+    database is performed for all the consents at once by :func:`create_consents`
+    """
+    source = BulkEndpointSerializer(many=False, allow_null=False)
+    destination = BulkEndpointSerializer(many=False, allow_null=False)
+
+    def validate(self, attrs):
+        return attrs
+
+
+def _check_endpoints(items, results):
+    """
+    Checks the source and destination of the valid items against the existing endpoints, using a single query.
+    It returns a dictionary with the endpoints, by id, to be used for the consents and the list of the missing
+    endpoints. The missing endpoints are not saved, since the items that use them can still be invalid
+    """
+    endpoints_data = [item[field] for item in items.values() for field in ('source', 'destination')]
+    endpoints = Endpoint.objects.filter(Q(id__in={e['id'] for e in endpoints_data}) |
+                                        Q(name__in={e['name'] for e in endpoints_data}))
+    by_id = {e.id: e for e in endpoints}
+    by_name = {e.name: e for e in endpoints}
+    new_endpoints = []
+    validator = EnpointDuplicateValidator()
+    for index, item in list(items.items()):
+        errors = {}
+        for field in ('source', 'destination'):
+            attrs = item[field]
+            endpoint = by_id.get(attrs['id']) or by_name.get(attrs['name'])
+            if endpoint is None:
+                # it is added also to the dictionaries so that the next items are checked against it
+                endpoint = Endpoint(**attrs)
+                by_id[endpoint.id] = by_name[endpoint.name] = endpoint
+                new_endpoints.append(endpoint)
+            try:
+                validator.check(endpoint, attrs)
+            except ValidationError as ex:
+                errors[field] = {api_settings.NON_FIELD_ERRORS_KEY: ex.detail}
+        if errors:
+            results[index] = errors
+            del items[index]
+    return by_id, new_endpoints
+
+
+def _get_profiles(items):
+    """
+    Returns a dictionary with the profiles of the items by (code, version, payload). The missing ones are created
+    """
+    profiles = {(p.code, p.version, p.payload): p for p in
+                Profile.objects.filter(code__in={item['profile']['code'] for item in items.values()})}
+    for item in items.values():
+        key = (item['profile']['code'], item['profile']['version'], item['profile']['payload'])
+        if key not in profiles:
+            profiles[key], _ = Profile.objects.get_or_create(**item['profile'])
+    return profiles
+
+
+def create_consents(data):
+    """
+    Validates and creates a list of consents in a single transaction. It performs the same validation of
+    :class:`ConsentSerializer` but it queries the database once for all the consents instead of once per consent.
+    Invalid consents are skipped and don't prevent the creation of the valid ones.
+
+    :param data: a list of consents' data
+    :return: a list with, for every item of :param:`data`, the created :class:`Consent` or the validation errors
+    """
+    results = [None] * len(data)
+    items = {}
+    for index, item_data in enumerate(data):
+        serializer = BulkConsentSerializer(data=item_data)
+        if serializer.is_valid():
+            items[index] = serializer.validated_data
+        else:
+            results[index] = serializer.errors
+
+    with transaction.atomic():
+        endpoints, new_endpoints = _check_endpoints(items, results)
+        profiles = _get_profiles(items)
+
+        consents = {}
+        for index, item in items.items():
+            profile = item['profile']
+            consents[index] = Consent(**dict(item, source=endpoints[item['source']['id']],
+                                             destination=endpoints[item['destination']['id']],
+                                             profile=profiles[profile['code'], profile['version'],
+                                                              profile['payload']]))
+
+        def _key(consent):
+            return consent.source_id, consent.destination_id, consent.profile_id, consent.person_id
+
+        existing = {}
+        for consent in Consent.objects.filter(person_id__in={c.person_id for c in consents.values()},
+                                              source_id__in={c.source_id for c in consents.values()},
+                                              status__in=(Consent.ACTIVE, Consent.PENDING)):
+            existing.setdefault(_key(consent), []).append(consent)
+
+        to_invalidate = []
+        new_consents = {}
+        for index, consent in consents.items():
+            key = _key(consent)
+            if any(c.status == Consent.ACTIVE for c in existing.get(key, [])):
+                results[index] = {api_settings.NON_FIELD_ERRORS_KEY: [ERRORS.DUPLICATED]}
+                continue
+            to_invalidate.extend(c.pk for c in existing.pop(key, []))
+            if key in new_consents:
+                # the same consent is requested twice: the previous one is not valid anymore as it happens
+                # when they are created one by one
+                new_consents[key].status = Consent.NOT_VALID
+            new_consents[key] = results[index] = consent
+
+        if to_invalidate:
+            Consent.objects.filter(pk__in=to_invalidate).update(status=Consent.NOT_VALID)
+        created = [r for r in results if isinstance(r, Consent)]
+        # only the new endpoints of the created consents are saved
+        used_endpoints = {c.source_id for c in created} | {c.destination_id for c in created}
+        Endpoint.objects.bulk_create([e for e in new_endpoints if e.id in used_endpoints])
+        Consent.objects.bulk_create(created)
+    return results
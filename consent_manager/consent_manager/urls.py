@@ -39,6 +39,8 @@ urlpatterns = [
     path(r'{}/consents/confirm/'.format(VERSION_REGEX), views.ConsentView.as_view({'post': 'confirm'})),
     path(r'{}/consents/revoke/'.format(VERSION_REGEX), views.ConsentView.as_view({'post': 'revoke_list'}),
         name='consents_revoke'),
+    path(r'{}/consents/bulk/'.format(VERSION_REGEX), views.ConsentView.as_view({'post': 'bulk_create'}),
+        name='consents_bulk'),
     path(r'{}/consents/find/'.format(VERSION_REGEX), views.ConsentView.as_view({'get': 'find'}),
         name='consents_find'),
     path(r'{}/consents/'.format(VERSION_REGEX), views.ConsentView.as_view({'get': 'list', 'post': 'create'}),
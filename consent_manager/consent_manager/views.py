@@ -22,12 +22,17 @@ import logging
 from datetime import datetime
 
 from django.contrib.auth.decorators import login_required
+from django.db import transaction
+from django.db.models import Case, F, Value, When
 from django.http import Http404
 from django.shortcuts import render
+from django.utils import timezone
 from django.utils.crypto import get_random_string
+from django.utils.dateparse import parse_datetime
 from django.views.decorators.http import require_http_methods
 from rest_framework import status as http_status
 from rest_framework.generics import get_object_or_404
+from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
 from rest_framework.viewsets import ViewSet
 
@@ -35,10 +40,11 @@ from consent_manager import serializers
 from consent_manager.models import ConfirmationCode, Consent
 from consent_manager.serializers import ConsentSerializer
 from consent_manager.settings import KAFKA_NOTIFICATION_TOPIC, USER_ID_FIELD
-from hgw_common.messaging.sender import SendingError, create_sender
-from hgw_common.utils import ERRORS, create_broker_parameters_from_settings
+from hgw_common.utils import ERRORS
 from hgw_common.utils.authorization import \
     IsAuthenticatedOrTokenHasResourceDetailedScope
+from hgw_common.utils.outbox import enqueue, enqueue_many
+from hgw_common.utils.pagination import NDJSONRenderer, list_response
 
 logger = logging.getLogger('consent_manager.views')
 
@@ -48,12 +54,9 @@ class ConsentView(ViewSet):
     Viewset with REST function of /v1/consents API and some GUI views
     """
     permission_classes = (IsAuthenticatedOrTokenHasResourceDetailedScope,)
-    oauth_views = ['list', 'create', 'retrieve']
+    oauth_views = ['list', 'create', 'bulk_create', 'retrieve']
     required_scopes = ['consent']
-
-    def __init__(self, *args, **kwargs):
-        self._sender = None
-        super(ConsentView, self).__init__(*args, **kwargs)
+    renderer_classes = (JSONRenderer, NDJSONRenderer)
 
     @staticmethod
     def _get_consent(consent_id):
@@ -66,43 +69,72 @@ class ConsentView(ViewSet):
     def _get_person_id(request):
         return getattr(request.user, USER_ID_FIELD)
 
-    def _send_changes(self, consent):
+    @staticmethod
+    def _send_changes(consent):
         """
-        Method to send consent changes. If the sender is None it gets one
+        Method to send consent changes. The notification is saved in the outbox, so it must be called in the
+        transaction that saves the consent. The consent_id is used as key, so that the notifications of a consent
+        are published in order
         """
-        if self._sender is None:
-            self._sender = create_sender(create_broker_parameters_from_settings())
         consent_serializer = ConsentSerializer(consent)
-        if self._sender.send(KAFKA_NOTIFICATION_TOPIC, consent_serializer.data):
-            logger.info('Action on consent notified correctly')
+        enqueue(KAFKA_NOTIFICATION_TOPIC, consent_serializer.data, key=consent.consent_id)
+        logger.info('Action on consent queued for notification')
+
+    @staticmethod
+    def _send_changes_many(consents):
+        """
+        Method to send the changes of many consents as a single batch of notifications
+        """
+        consents_serializer = ConsentSerializer(consents, many=True)
+        enqueue_many(KAFKA_NOTIFICATION_TOPIC, [(data['consent_id'], data) for data in consents_serializer.data])
+        logger.info('Actions on %s consents queued for notification', len(consents_serializer.data))
 
     def list(self, request):
         """
         Returns the list of the consents. If the request arrives from
         an authenticated user (i.e.. from the GUI) it returns only the
-        consents belonging to him. Otherwise all consents
+        consents belonging to him. Otherwise all consents.
+        The consents can be filtered by id specifying one or more consent_id query parameters, by status, source
+        and destination, specifying one or more status, source and destination query parameters, and by the time of
+        the last change, with the updated_since query parameter. The consents are paginated with the limit and after
+        query parameters (see :mod:`hgw_common.utils.pagination`)
         """
         if request.user is not None:
             person_id = self._get_person_id(request)
             consents = Consent.objects.filter(person_id=person_id,
                                               status__in=(Consent.ACTIVE, Consent.REVOKED))
-            logger.info('Found %s consents for user %s', len(consents), person_id)
+            logger.info('Listing consents for user %s', person_id)
         else:
             consents = Consent.objects.all()
-        serializer = serializers.ConsentSerializer(consents, many=True)
-        if request.user is not None or request.auth.application.is_super_client():
-            return Response(serializer.data)
 
-        res = []
-        for consent in serializer.data:
-            res.append({
-                'consent_id': consent['consent_id'],
-                'source': consent['source'],
-                'status': consent['status'],
-                'start_validity': consent['start_validity'],
-                'expire_validity': consent['expire_validity']
-            })
-        return Response(res)
+        consent_ids = request.query_params.getlist('consent_id')
+        if consent_ids:
+            consents = consents.filter(consent_id__in=consent_ids)
+        statuses = request.query_params.getlist('status')
+        if statuses:
+            if not set(statuses) <= set(dict(Consent.STATUS_CHOICES)):
+                return Response({'errors': [ERRORS.INVALID_PARAMETERS]}, http_status.HTTP_400_BAD_REQUEST)
+            consents = consents.filter(status__in=statuses)
+        for field in ('source', 'destination'):
+            endpoint_ids = request.query_params.getlist(field)
+            if endpoint_ids:
+                consents = consents.filter(**{'{}__id__in'.format(field): endpoint_ids})
+        if 'updated_since' in request.query_params:
+            try:
+                updated_since = parse_datetime(request.query_params['updated_since'])
+            except ValueError:
+                updated_since = None
+            if updated_since is None:
+                return Response({'errors': [ERRORS.INVALID_PARAMETERS]}, http_status.HTTP_400_BAD_REQUEST)
+            if timezone.is_naive(updated_since):
+                updated_since = timezone.make_aware(updated_since)
+            consents = consents.filter(updated__gte=updated_since)
+
+        if request.user is not None or request.auth.application.is_super_client():
+            serializer_class = serializers.ConsentSerializer
+        else:
+            serializer_class = serializers.ConsentStatusSerializer
+        return list_response(request, serializer_class.setup_eager_loading(consents), serializer_class)
 
     @staticmethod
     def create(request):
@@ -125,6 +157,37 @@ class ConsentView(ViewSet):
             return Response(res, status=http_status.HTTP_201_CREATED)
         return Response(serializer.errors, status=http_status.HTTP_400_BAD_REQUEST)
 
+    @staticmethod
+    def bulk_create(request):
+        """
+        REST API to create a list of consents in a single transaction. It returns, for every consent in input
+        and in the same order, the confirm_id and consent_id or the validation errors. The status code is 201 if
+        at least one consent has been created, 400 otherwise
+        """
+        if not isinstance(request.data, list) or not request.data or \
+                not all(isinstance(item, dict) for item in request.data):
+            return Response({'errors': [ERRORS.INVALID_PARAMETERS]}, status=http_status.HTTP_400_BAD_REQUEST)
+
+        data = [dict(item, consent_id=get_random_string(32), status=Consent.PENDING) for item in request.data]
+        with transaction.atomic():
+            results = serializers.create_consents(data)
+            # the consents are fetched again since bulk_create doesn't set the primary keys with every db backend
+            consents = Consent.objects.filter(consent_id__in=[r.consent_id for r in results
+                                                              if isinstance(r, Consent)])
+            confirmation_codes = {consent.consent_id: ConfirmationCode(consent=consent) for consent in consents}
+            ConfirmationCode.objects.bulk_create(confirmation_codes.values())
+
+        res = []
+        for result in results:
+            if isinstance(result, Consent):
+                res.append({'confirm_id': confirmation_codes[result.consent_id].code,
+                            'consent_id': result.consent_id})
+            else:
+                res.append({'errors': result})
+        logger.info('Created %s consents out of %s', len(confirmation_codes), len(res))
+        status = http_status.HTTP_201_CREATED if confirmation_codes else http_status.HTTP_400_BAD_REQUEST
+        return Response(res, status=status)
+
     def update(self, request, consent_id):
         """
         REST function to update a consent
@@ -141,8 +204,9 @@ class ConsentView(ViewSet):
         logger.info('Update data: %s', request.data)
         serializer = serializers.ConsentSerializer(consent, data=request.data, partial=True)
         if serializer.is_valid():
-            serializer.save()
-            self._send_changes(consent)
+            with transaction.atomic():
+                serializer.save()
+                self._send_changes(consent)
         else:
             logger.info('Update data are not valid. Errors are: %s', serializer.errors)
             return Response({'errors': serializer.errors}, status=http_status.HTTP_400_BAD_REQUEST)
@@ -183,14 +247,17 @@ class ConsentView(ViewSet):
         else:
             logger.info('Consent revoked')
             consent.status = Consent.REVOKED
-            consent.save()
-            self._send_changes(consent)
+            with transaction.atomic():
+                consent.save()
+                self._send_changes(consent)
 
             return http_status.HTTP_200_OK, {}
 
     def revoke_list(self, request):
         """
-        Revokes a list of consents
+        Revokes a list of consents. The consents are read with a single query and revoked with a single update, in
+        one transaction. The consents are locked when they are read, so that their status cannot change before the
+        update
         """
         try:
             consents = request.data['consents']
@@ -198,17 +265,29 @@ class ConsentView(ViewSet):
             return Response({'errors': [ERRORS.MISSING_PARAMETERS]}, http_status.HTTP_400_BAD_REQUEST)
         logger.info('Received consents revoke request for consents %s', ', '.join(consents))
 
-        revoked = []
-        failed = []
         person_id = self._get_person_id(request)
-        for consent_id in consents:
-            logger.info('Revoking consent %s', consent_id)
-            status, _ = self._revoke_consent(consent_id, person_id)
-            if status == http_status.HTTP_200_OK:
-                revoked.append(consent_id)
-            else:
-                failed.append(consent_id)
-        return Response({'revoked': revoked, 'failed': failed}, status=http_status.HTTP_200_OK)
+        with transaction.atomic():
+            found = {consent.consent_id: consent for consent in
+                     Consent.objects.select_for_update(of=('self',)).filter(consent_id__in=consents)
+                     .select_related('source', 'destination', 'profile')}
+            to_revoke = {}
+            failed = []
+            for consent_id in consents:
+                consent = found.get(consent_id)
+                if consent is None or consent.status != Consent.ACTIVE or consent.person_id != person_id \
+                        or consent_id in to_revoke:
+                    failed.append(consent_id)
+                else:
+                    to_revoke[consent_id] = consent
+
+            if to_revoke:
+                Consent.objects.filter(pk__in=[c.pk for c in to_revoke.values()]) \
+                    .update(status=Consent.REVOKED, updated=timezone.now())
+                for consent in to_revoke.values():
+                    consent.status = Consent.REVOKED
+                self._send_changes_many(to_revoke.values())
+        logger.info('Revoked %s consents out of %s', len(to_revoke), len(consents))
+        return Response({'revoked': list(to_revoke.keys()), 'failed': failed}, status=http_status.HTTP_200_OK)
 
     def revoke(self, request, consent_id):
         """
@@ -249,7 +328,9 @@ class ConsentView(ViewSet):
 
     def confirm(self, request):
         """
-        View to confirm consents
+        View to confirm consents. The confirmation codes and the consents are read with a single query and the
+        consents are confirmed with a single update, in one transaction. The consents are locked when they are read,
+        so that their status cannot change before the update
         """
         logger.info('Received consent confirmation request from user')
         if 'consents' not in request.data:
@@ -259,46 +340,46 @@ class ConsentView(ViewSet):
         consents = request.data['consents']
         logger.info('Specified the following consents: %s', ', '.join(consents.keys()))
 
-        confirmed = []
-        failed = []
-        for confirm_id, consent_data in consents.items():
-            try:
-                confirmation_code = ConfirmationCode.objects.get(code=confirm_id)
-            except ConfirmationCode.DoesNotExist:
-                logger.info('Consent associated to confirm_id %s not found', confirm_id)
-                failed.append(confirm_id)
-            else:
-                if not confirmation_code.check_validity():
+        person_id = self._get_person_id(request)
+        with transaction.atomic():
+            confirmation_codes = {code.code: code for code in
+                                  ConfirmationCode.objects.select_for_update(of=('consent',))
+                                  .filter(code__in=list(consents.keys())).select_related('consent')}
+            to_confirm = {}
+            failed = []
+            for confirm_id in consents:
+                confirmation_code = confirmation_codes.get(confirm_id)
+                if confirmation_code is None:
+                    logger.info('Consent associated to confirm_id %s not found', confirm_id)
+                    failed.append(confirm_id)
+                elif not confirmation_code.check_validity():
                     logger.info('Confirmation expired')
                     failed.append(confirm_id)
+                elif confirmation_code.consent.status != Consent.PENDING:
+                    logger.info('consent not in PENDING http_status. Cannot confirm it')
+                    failed.append(confirm_id)
+                elif confirmation_code.consent.person_id != person_id:
+                    logger.info('consent found but it does not belong to the logged user. Cannot confirm it')
+                    failed.append(confirm_id)
                 else:
-                    consent = confirmation_code.consent
-                    logger.info('consent_id is %s', consent.consent_id)
-                    if consent.status != Consent.PENDING:
-                        logger.info('consent not in PENDING http_status. Cannot confirm it')
-                        failed.append(confirm_id)
-                    elif consent.person_id != self._get_person_id(request):
-                        logger.info('consent found but it does not belong to the logged user. Cannot confirm it')
-                        failed.append(confirm_id)
-                    else:
-                        consent.status = Consent.ACTIVE
-                        consent.confirmed = datetime.now()
-                        if 'start_validity' in consent_data:
-                            consent.start_validity = consent_data['start_validity']
-                        if 'expire_validity' in consent_data:
-                            consent.expire_validity = consent_data['expire_validity']
-                        consent.save()
-                        confirmed.append(confirm_id)
-                        logger.info('consent with id %s confirmed', consent)
-
-                        try:
-                            self._send_changes(consent)
-                            logger.info("Consent creation notified correctly")
-                        except SendingError:
-                            # TODO: we should retry to send the frontend
-                            logger.error("It was impossible to send the message to the HGW Frontend")
-
-        return Response({'confirmed': confirmed, 'failed': failed}, status=http_status.HTTP_200_OK)
+                    to_confirm[confirm_id] = confirmation_code.consent.pk
+
+            if to_confirm:
+                # the validity dates, when specified, can be different for every consent
+                validity = {}
+                for field in ('start_validity', 'expire_validity'):
+                    cases = [When(pk=consent_pk, then=Value(consents[confirm_id][field],
+                                                            output_field=Consent._meta.get_field(field)))
+                             for confirm_id, consent_pk in to_confirm.items() if field in consents[confirm_id]]
+                    if cases:
+                        validity[field] = Case(*cases, default=F(field))
+                Consent.objects.filter(pk__in=to_confirm.values()) \
+                    .update(status=Consent.ACTIVE, confirmed=datetime.now(), updated=timezone.now(), **validity)
+                confirmed = Consent.objects.filter(pk__in=to_confirm.values()) \
+                    .select_related('source', 'destination', 'profile').in_bulk()
+                self._send_changes_many([confirmed[consent_pk] for consent_pk in to_confirm.values()])
+        logger.info('Confirmed %s consents out of %s', len(to_confirm), len(consents))
+        return Response({'confirmed': list(to_confirm.keys()), 'failed': failed}, status=http_status.HTTP_200_OK)
 
 
 @require_http_methods(["GET", "POST"])
@@ -0,0 +1,50 @@
+# Copyright (c) 2017-2018 CRS4
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to use,
+# copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or
+# substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE
+# AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+from django.test import TestCase
+
+from consent_manager.models import Consent, Endpoint
+from hgw_common.models import Profile
+from hgw_common.utils.test_db import analyze_db, get_used_indexes
+
+
+class TestQueryPlans(TestCase):
+    """
+    Tests that the lookups of the consents use an index
+    """
+    fixtures = ['test_data.json']
+
+    @classmethod
+    def setUpTestData(cls):
+        source = Endpoint.objects.get(name='SOURCE_1')
+        destination = Endpoint.objects.get(name='DEST_MOCKUP')
+        profile = Profile.objects.first()
+        statuses = [status for status, _ in Consent.STATUS_CHOICES]
+        Consent.objects.bulk_create([
+            Consent(source=source, destination=destination, profile=profile,
+                    person_id='PERSON{:014d}'.format(index // 4), status=statuses[index % len(statuses)])
+            for index in range(4000)])
+        analyze_db()
+
+    def test_consents_by_person(self):
+        queryset = Consent.objects.filter(person_id='PERSON00000000000500')
+        self.assertIn('consent_person_status_idx', get_used_indexes(queryset, 'person_id'))
+
+    def test_consents_by_person_and_status(self):
+        queryset = Consent.objects.filter(person_id='PERSON00000000000500',
+                                          status__in=(Consent.ACTIVE, Consent.REVOKED))
+        self.assertIn('consent_person_status_idx', get_used_indexes(queryset, 'person_id'))
@@ -20,13 +20,16 @@ import os
 from datetime import datetime, timedelta
 
 from django.core.exceptions import ObjectDoesNotExist
-from django.db import DatabaseError
+from django.core.management import call_command
+from django.db import DatabaseError, connection
 from django.test import TestCase, client
+from django.test.utils import CaptureQueriesContext
 from mock import MagicMock, Mock, NonCallableMock, patch
 
 from consent_manager import settings
-from consent_manager.models import ConfirmationCode, Consent, RESTClient
+from consent_manager.models import ConfirmationCode, Consent, Endpoint, RESTClient
 from consent_manager.serializers import ConsentSerializer
+from hgw_common.models import OutboxMessage
 from hgw_common.utils import ERRORS
 from hgw_common.utils.mocks import get_free_port
 
@@ -144,6 +147,78 @@ class TestAPI(TestCase):
         self.assertEqual(res.status_code, 200)
         self.assertDictEqual(res.json(), expected)
 
+    def test_get_consents_by_id(self):
+        """
+        Tests that the consents can be filtered specifying a list of consent ids
+        """
+        consent_ids = [self._add_consent(json.dumps(data)).json()['consent_id']
+                       for data in self._get_bulk_consents_data(3)]
+
+        headers = self._get_oauth_header(client_index=2)
+        res = self.client.get('/v1/consents/?consent_id={}&consent_id={}&consent_id=unknown'.format(
+            consent_ids[0], consent_ids[2]), **headers)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual({consent['consent_id'] for consent in res.json()}, {consent_ids[0], consent_ids[2]})
+        self.assertEqual({consent['status'] for consent in res.json()}, {Consent.PENDING})
+
+    def test_get_consents_filters(self):
+        """
+        Tests that the consents can be filtered by status, source, destination and time of the last change
+        """
+        consent_ids = [self._add_consent(json.dumps(data), status=Consent.ACTIVE).json()['consent_id']
+                       for data in self._get_bulk_consents_data(3)]
+
+        headers = self._get_oauth_header(client_index=2)
+        res = self.client.get('/v1/consents/?status=AC', **headers)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual({consent['consent_id'] for consent in res.json()}, set(consent_ids))
+
+        res = self.client.get('/v1/consents/?status=PE&source=BULK_SOURCE_1', **headers)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.json(), [])
+
+        res = self.client.get('/v1/consents/?source=BULK_SOURCE_0&source=BULK_SOURCE_2', **headers)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual({consent['consent_id'] for consent in res.json()}, {consent_ids[0], consent_ids[2]})
+
+        res = self.client.get('/v1/consents/?destination=vnTuqCY3muHipTSan6Xdctj2Y0vUOVkj', **headers)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(len(res.json()), 4)
+
+        # the consent in the fixtures has not been changed since then
+        res = self.client.get('/v1/consents/?updated_since=2019-01-01T00:00:00%2B01:00', **headers)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual({consent['consent_id'] for consent in res.json()}, set(consent_ids))
+
+        for query in ('status=WRONG', 'updated_since=wrong', 'updated_since=2019-13-01T00:00:00'):
+            res = self.client.get('/v1/consents/?{}'.format(query), **headers)
+            self.assertEqual(res.status_code, 400)
+            self.assertEqual(res.json(), {'errors': [ERRORS.INVALID_PARAMETERS]})
+
+    def test_get_consents_paginated(self):
+        """
+        Tests that the consents are paginated using the limit and after parameters
+        """
+        consent_ids = [self._add_consent(json.dumps(data)).json()['consent_id']
+                       for data in self._get_bulk_consents_data(3)]
+        all_ids = ['q18r2rpd1wUqQjAZPhh24zcN9KCePRyr'] + consent_ids
+
+        headers = self._get_oauth_header(client_index=2)
+        res = self.client.get('/v1/consents/', **headers)
+        self.assertEqual(res['X-Total-Count'], '4')
+
+        pages = []
+        query = 'limit=3'
+        while query is not None:
+            res = self.client.get('/v1/consents/?{}'.format(query), **headers)
+            self.assertEqual(res.status_code, 200)
+            pages.append([consent['consent_id'] for consent in res.json()])
+            query = 'limit=3&after={}'.format(res['X-Next-After']) if res.has_header('X-Next-After') else None
+        self.assertEqual(pages, [all_ids[:3], all_ids[3:]])
+
+        res = self.client.get('/v1/consents/?limit=wrong', **headers)
+        self.assertEqual(res.status_code, 400)
+
     def test_get_consents_db_error(self):
         """
         Tests get functionality with not all details
@@ -473,6 +548,132 @@ class TestAPI(TestCase):
         self.assertEqual(res.status_code, 400)
         self.assertDictEqual(res.json(), expected)
 
+    def _bulk_add_consents(self, data, client_index=0):
+        headers = self._get_oauth_header(client_index)
+        return self.client.post('/v1/consents/bulk/', data=json.dumps(data),
+                                content_type='application/json', **headers)
+
+    def _get_bulk_consents_data(self, sources_num):
+        data = []
+        for index in range(sources_num):
+            consent_data = self.consent_data.copy()
+            consent_data['source'] = {'id': 'BULK_SOURCE_{}'.format(index), 'name': 'Bulk Source {}'.format(index)}
+            data.append(consent_data)
+        return data
+
+    def test_bulk_add(self):
+        """
+        Tests the creation of a list of consents. The response has the confirm_id and consent_id of every consent
+        in the same order of the input data
+        """
+        data = self._get_bulk_consents_data(3)
+        res = self._bulk_add_consents(data)
+        self.assertEqual(res.status_code, 201)
+        self.assertEqual(len(res.json()), 3)
+        for consent_data, item in zip(data, res.json()):
+            self.assertEqual(set(item.keys()), {'consent_id', 'confirm_id'})
+            consent = Consent.objects.get(consent_id=item['consent_id'])
+            self.assertEqual(ConfirmationCode.objects.get(code=item['confirm_id']).consent, consent)
+
+            expected = consent_data.copy()
+            expected.update({
+                'status': Consent.PENDING,
+                'consent_id': item['consent_id']
+            })
+            self.assertDictEqual(ConsentSerializer(consent).data, expected)
+
+    def test_bulk_add_num_queries(self):
+        """
+        Tests that the number of queries performed by the bulk creation doesn't depend on the number of consents
+        """
+        headers = self._get_oauth_header()
+        for sources_num in (2, 10):
+            data = self._get_bulk_consents_data(sources_num)
+            for item in data:
+                item['person_id'] = 'PERSON_{}'.format(sources_num)
+            # token, 2 savepoints and their releases, select of the endpoints, select of the profiles, select of the
+            # consents, insert of the endpoints, insert and select again of the consents, insert of the confirmation
+            # codes
+            with self.assertNumQueries(12):
+                res = self.client.post('/v1/consents/bulk/', data=json.dumps(data),
+                                       content_type='application/json', **headers)
+            self.assertEqual(res.status_code, 201)
+
+    def test_bulk_add_partially_invalid(self):
+        """
+        Tests that invalid consents don't prevent the creation of the valid ones and that the errors are
+        returned in the position of the invalid consent. The pending duplicated consents are set to NOT_VALID
+        """
+        self._add_consent(self.json_consent_data, status=Consent.ACTIVE)
+        pending_consent_id = self._add_consent(json.dumps(self._get_bulk_consents_data(1)[0])).json()['consent_id']
+
+        wrong_endpoint = self.consent_data.copy()
+        wrong_endpoint['source'] = {'id': 'iWWjKVje7Ss3M45oTNUpRV59ovVpl3xT', 'name': 'WRONG_NAME'}
+        missing_fields = {'person_id': PERSON1_ID}
+        data = [self.consent_data, wrong_endpoint, missing_fields] + self._get_bulk_consents_data(1)
+        res = self._bulk_add_consents(data)
+
+        self.assertEqual(res.status_code, 201)
+        self.assertEqual(len(res.json()), 4)
+        self.assertEqual(res.json()[0], {'errors': {'generic_errors': [ERRORS.DUPLICATED]}})
+        self.assertEqual(res.json()[1], {'errors': {'source': {'generic_errors': [
+            'An instance with the same id and different name already exists']}}})
+        self.assertEqual(set(res.json()[2]['errors'].keys()), {'source', 'destination', 'profile'})
+        self.assertEqual(set(res.json()[3].keys()), {'consent_id', 'confirm_id'})
+        self.assertEqual(Consent.objects.get(consent_id=pending_consent_id).status, Consent.NOT_VALID)
+        self.assertEqual(Consent.objects.get(consent_id=res.json()[3]['consent_id']).status, Consent.PENDING)
+
+    def test_bulk_add_invalid_new_endpoints(self):
+        """
+        Tests that the new endpoints of the invalid consents are not created
+        """
+        wrong_destination = self._get_bulk_consents_data(1)[0]
+        wrong_destination['destination'] = {'id': 'vnTuqCY3muHipTSan6Xdctj2Y0vUOVkj', 'name': 'WRONG_NAME'}
+        res = self._bulk_add_consents([wrong_destination])
+        self.assertEqual(res.status_code, 400)
+        self.assertFalse(Endpoint.objects.filter(id='BULK_SOURCE_0').exists())
+
+        # the new endpoint is created if at least one valid consent uses it
+        res = self._bulk_add_consents([wrong_destination] + self._get_bulk_consents_data(1))
+        self.assertEqual(res.status_code, 201)
+        self.assertIn('errors', res.json()[0])
+        self.assertEqual(Endpoint.objects.get(id='BULK_SOURCE_0').name, 'Bulk Source 0')
+
+    def test_bulk_add_all_invalid(self):
+        """
+        Tests that when no consent is created the status code is 400
+        """
+        self._add_consent(self.json_consent_data, status=Consent.ACTIVE)
+        res = self._bulk_add_consents([self.consent_data])
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(res.json(), [{'errors': {'generic_errors': [ERRORS.DUPLICATED]}}])
+
+    def test_bulk_add_wrong_parameters(self):
+        """
+        Tests that the input must be a not empty list of objects
+        """
+        for data in ([], self.consent_data, ['consent']):
+            res = self._bulk_add_consents(data)
+            self.assertEqual(res.status_code, 400)
+            self.assertEqual(res.json(), {'errors': [ERRORS.INVALID_PARAMETERS]})
+
+    def test_bulk_add_forbidden(self):
+        """
+        Test bulk add is forbidden when it is missing the correct scopes
+        """
+        res = self._bulk_add_consents([self.consent_data], client_index=2)
+        self.assertEqual(res.status_code, 403)
+
+    def test_bulk_add_db_error(self):
+        """
+        Test bulk add in case of db error
+        """
+        mock = self._get_db_error_mock()
+        with patch('consent_manager.serializers.Endpoint', mock):
+            res = self._bulk_add_consents([self.consent_data])
+            self.assertEqual(res.status_code, 500)
+            self.assertEqual(res.json(), {'errors': [ERRORS.DB_ERROR]})
+
     @patch('hgw_common.messaging.sender.KafkaProducer')
     def test_modify(self, mocked_kafka_producer):
         """
@@ -495,6 +696,11 @@ class TestAPI(TestCase):
         consent_serializer = ConsentSerializer(consent)
         self.assertEqual(consent_serializer.data['start_validity'], updated_data['start_validity'])
         self.assertEqual(consent_serializer.data['expire_validity'], updated_data['expire_validity'])
+        # the notification is saved in the outbox and sent by the relay
+        mocked_kafka_producer().send.assert_not_called()
+        self.assertEqual(OutboxMessage.objects.count(), 1)
+        call_command('relay_outbox', '--once')
+        self.assertEqual(OutboxMessage.objects.count(), 0)
         self.assertEqual(mocked_kafka_producer().send.call_args_list[0][0][0], settings.KAFKA_NOTIFICATION_TOPIC)
         self.assertDictEqual(json.loads(mocked_kafka_producer().send.call_args_list[0][1]['value'].decode('utf-8')),
                              consent_serializer.data)
@@ -671,6 +877,7 @@ class TestAPI(TestCase):
         consent_serializer = ConsentSerializer(consent)
 
         self.assertEqual(consent.status, Consent.REVOKED)
+        call_command('relay_outbox', '--once')
         self.assertEqual(mocked_kafka_producer().send.call_args_list[0][0][0], settings.KAFKA_NOTIFICATION_TOPIC)
         self.assertDictEqual(json.loads(mocked_kafka_producer().send.call_args_list[0][1]['value'].decode('utf-8')),
                              consent_serializer.data)
@@ -788,6 +995,7 @@ class TestAPI(TestCase):
         self.assertEqual(res.status_code, 200)
         self.assertEqual(res.json()['revoked'], consents)
         self.assertEqual(len(res.json()['failed']), 0)
+        call_command('relay_outbox', '--once')
         for index, consent in enumerate(consents):
             consent = Consent.objects.get(consent_id=consent)
             consent_serializer = ConsentSerializer(consent)
@@ -838,6 +1046,34 @@ class TestAPI(TestCase):
             c = Consent.objects.get(consent_id=c)
             self.assertEqual(c.status, statuses[i])
 
+    def test_revoke_list_constant_queries(self):
+        """
+        Tests that the number of queries to revoke a list of consents doesn't depend on the number of consents and
+        that the notifications are queued in one batch
+        """
+        consents = []
+        for i in range(6):
+            data = self.consent_data.copy()
+            data['source'] = {
+                'id': 'source_{}_id'.format(i),
+                'name': 'source_{}_name'.format(i)
+            }
+            res = self._add_consent(data=json.dumps(data), status=Consent.ACTIVE)
+            consents.append(res.json()['consent_id'])
+
+        self.client.login(username='duck', password='duck')
+        queries = []
+        for revoke_consents in (consents[:1], consents[1:] + ['unknown']):
+            with CaptureQueriesContext(connection) as context:
+                res = self.client.post('/v1/consents/revoke/', data=json.dumps({'consents': revoke_consents}),
+                                       content_type='application/json')
+            self.assertEqual(res.status_code, 200)
+            queries.append(len(context.captured_queries))
+        self.assertEqual(queries[0], queries[1])
+        self.assertEqual(res.json(), {'revoked': consents[1:], 'failed': ['unknown']})
+        self.assertEqual(Consent.objects.filter(status=Consent.REVOKED).count(), 6)
+        self.assertEqual(OutboxMessage.objects.count(), 6)
+
     def test_revoke_list_wrong_user(self):
         """
         Tests that when the logged user is not the owner of the consent to be revoked, the consent is not revoked
@@ -996,6 +1232,7 @@ class TestAPI(TestCase):
         self.assertEqual(res.status_code, 200)
         self.assertEqual(len(res.json()['confirmed']), 4)
         self.assertEqual(len(res.json()['failed']), 0)
+        call_command('relay_outbox', '--once')
         for index, (confirm_id, consent_data) in enumerate(consents.items()):
             consent_obj = ConfirmationCode.objects.get(code=confirm_id).consent
             self.assertEqual(consent_obj.status, Consent.ACTIVE)
@@ -1016,6 +1253,7 @@ class TestAPI(TestCase):
         self.assertEqual(res.status_code, 200)
         self.assertEqual(len(res.json()['confirmed']), 4)
         self.assertEqual(len(res.json()['failed']), 0)
+        call_command('relay_outbox', '--once')
         for index, (confirm_id, consent_data) in enumerate(consents.items()):
             consent_obj = ConfirmationCode.objects.get(code=confirm_id).consent
             self.assertEqual(consent_obj.status, Consent.ACTIVE)
@@ -1079,6 +1317,45 @@ class TestAPI(TestCase):
         self.assertEqual(res.status_code, 400)
         self.assertEqual(res.json(), {'errors': [ERRORS.MISSING_PARAMETERS]})
 
+    def test_confirm_constant_queries(self):
+        """
+        Tests that the number of queries to confirm the consents doesn't depend on the number of consents and that
+        the validity dates are set only when specified
+        """
+        confirm_ids = []
+        for i in range(4):
+            data = self.consent_data.copy()
+            data['source'] = {
+                'id': 'source_{}_id'.format(i),
+                'name': 'source_{}_name'.format(i)
+            }
+            res = self._add_consent(data=json.dumps(data))
+            confirm_ids.append(res.json()['confirm_id'])
+
+        self.client.login(username='duck', password='duck')
+        queries = []
+        for consents in ({confirm_ids[0]: {}},
+                         {confirm_ids[1]: {'start_validity': '2018-10-01T10:05:05.123000+02:00'},
+                          confirm_ids[2]: {'expire_validity': None},
+                          confirm_ids[3]: {}}):
+            with CaptureQueriesContext(connection) as context:
+                res = self.client.post('/v1/consents/confirm/', data=json.dumps({'consents': consents}),
+                                       content_type='application/json')
+            self.assertEqual(res.status_code, 200)
+            self.assertEqual(res.json(), {'confirmed': list(consents.keys()), 'failed': []})
+            queries.append(len(context.captured_queries))
+        self.assertEqual(queries[0], queries[1])
+
+        confirmed = [ConsentSerializer(ConfirmationCode.objects.get(code=confirm_id).consent).data
+                     for confirm_id in confirm_ids]
+        self.assertTrue(all(consent['status'] == Consent.ACTIVE for consent in confirmed))
+        self.assertEqual(confirmed[1]['start_validity'], '2018-10-01T10:05:05.123000+02:00')
+        self.assertEqual(confirmed[1]['expire_validity'], self.consent_data['expire_validity'])
+        self.assertEqual(confirmed[2]['start_validity'], self.consent_data['start_validity'])
+        self.assertIsNone(confirmed[2]['expire_validity'])
+        self.assertEqual(confirmed[3]['start_validity'], self.consent_data['start_validity'])
+        self.assertEqual([json.loads(m.message) for m in OutboxMessage.objects.order_by('pk')], confirmed)
+
     def test_confirm_wrong_consent_status(self):
         """
         Tests that if the consent was not in PENDING status it is not activated. It does so by trying to revoke
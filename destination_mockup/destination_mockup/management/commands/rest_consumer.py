@@ -77,24 +77,31 @@ class Command(BaseCommand):
                 pass
         current_id = first_id
         while True:
-            msg = requests.get('{}/v1/messages/{}/'.format(settings.HGW_FRONTEND_URI, current_id), headers=header)
-            if msg.status_code == 200:
+            try:
+                stream = requests.get('{}/v1/messages/stream/'.format(settings.HGW_FRONTEND_URI),
+                                      params={'start': current_id}, headers=header, stream=True)
+            except requests.exceptions.ConnectionError:
+                logger.info("Connection error. Retrying in 6 seconds")
+                time.sleep(6)
+                continue
+            if stream.status_code != 200:
+                logger.info("Error: {}".format(stream.content))
+                time.sleep(6)
+                continue
+            for line in stream.iter_lines():
+                if not line:
+                    # keep-alive
+                    continue
                 try:
-                    res = msg.json()
-                    logger.info("Received message with process_id %s, channel_id %s, source_id %s, and id %s",
-                        res['process_id'], res['channel_id'], res['source_id'], res['message_id'])
-                    message = base64.b64decode(res['data'])
-                    current_id += 1
-                    time.sleep(2)
-                    if self.cipher.is_encrypted(message):
-                        self._handle_payload(self.cipher.decrypt(message), *args, **options)
-                    else:
-                        self._handle_payload(message, *args, **options)
+                    res = json.loads(line.decode('utf-8'))
                 except ValueError as e:
-                    print(e)
-                    logger.info("Error")
-            elif msg.status_code == 404:
-                logger.info("No message. Retrying in 6 seconds")
-                time.sleep(6)
-            else:
-                logger.info("Error: {}".format(msg.content))
+                    logger.info("Error: %s", e)
+                    continue
+                logger.info("Received message with process_id %s, channel_id %s, source_id %s, and id %s",
+                            res['process_id'], res['channel_id'], res['source_id'], res['message_id'])
+                message = base64.b64decode(res['data'])
+                current_id = res['message_id'] + 1
+                if self.cipher.is_encrypted(message):
+                    self._handle_payload(self.cipher.decrypt(message), *args, **options)
+                else:
+                    self._handle_payload(message, *args, **options)
@@ -64,6 +64,10 @@ elif [ "$1" == "cleartokens" ]; then
 else 
     echo "Starting create connector consumer"
     /launch-kafka.sh &
+    echo "Starting failed connectors retry scheduler"
+    python manage.py retry_failed_connectors &
+    echo "Starting outbox relay"
+    python manage.py relay_outbox &
     if [ -d ${GUNICORN} ] || [ "${GUNICORN}" == "false" ] ; then
         envsubst '${HTTP_PORT} ${BASE_SERVICE_DIR}' < /etc/nginx/conf.d/nginx_https.template > /etc/nginx/conf.d/https.conf
         nginx
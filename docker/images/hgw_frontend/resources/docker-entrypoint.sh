@@ -66,6 +66,8 @@ else
     /launch-connector-notification-consumer.sh &
     /launch-source-notification-consumer.sh &
     /launch-consent-notification-consumer.sh &
+    echo "Starting failed messages replayer"
+    python3 manage.py replay_failed_messages &
     if [ -d ${GUNICORN} ] || [ "${GUNICORN}" == "false" ] ; then
         envsubst '${HTTP_PORT} ${BASE_SERVICE_DIR}' < /etc/nginx/conf.d/nginx_https.template > /etc/nginx/conf.d/https.conf
         nginx
@@ -61,10 +61,16 @@ if [ "$1" == "test" ]; then
     python manage.py test test
 elif [ "$1" == "cleartokens" ]; then
     python manage.py cleartokens
-elif [ -d ${GUNICORN} ] || [ "${GUNICORN}" == "false" ] ; then
-    envsubst '${HTTP_PORT} ${BASE_SERVICE_DIR}' < /etc/nginx/conf.d/nginx_https.template > /etc/nginx/conf.d/https.conf
-    nginx
-    gunicorn_start.sh sockfile $USER
 else
-    gunicorn_start.sh http $USER
+    if [ "${OUTBOX_RELAY}" == "true" ]; then
+        echo "Starting outbox relay"
+        python manage.py relay_outbox &
+    fi
+    if [ -d ${GUNICORN} ] || [ "${GUNICORN}" == "false" ] ; then
+        envsubst '${HTTP_PORT} ${BASE_SERVICE_DIR}' < /etc/nginx/conf.d/nginx_https.template > /etc/nginx/conf.d/https.conf
+        nginx
+        gunicorn_start.sh sockfile $USER
+    else
+        gunicorn_start.sh http $USER
+    fi
 fi
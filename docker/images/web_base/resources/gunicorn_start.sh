@@ -27,6 +27,9 @@ fi
 USER=root  # the user to run as
 GROUP=($(id -g -n ${USER}))  # the group to run as
 NUM_WORKERS=3  # how many worker processes should Gunicorn spawn
+# how many threads every worker uses to serve the requests: long requests, like the messages streams of the
+# hgw_frontend, hold a thread and not the whole worker
+NUM_THREADS=${GUNICORN_THREADS:-8}
 DJANGO_SETTINGS_MODULE=${DJANGO_APP_NAME}.settings  # which settings file should Django use
 DJANGO_WSGI_MODULE=${DJANGO_APP_NAME}.wsgi  # WSGI module name
 
@@ -41,6 +44,8 @@ test -d ${RUNDIR} || mkdir -p ${RUNDIR}
 exec gunicorn ${DJANGO_WSGI_MODULE}:application \
   --name ${DJANGO_APP_NAME} \
   --workers ${NUM_WORKERS} \
+  --worker-class gthread \
+  --threads ${NUM_THREADS} \
   --user=${USER} --group=${GROUP} \
   --bind=${BIND} \
   --log-level=debug \
@@ -19,15 +19,15 @@
 import json
 import django
 import os
-from Cryptodome.PublicKey import RSA
 
 os.environ['DJANGO_SETTINGS_MODULE'] = 'source_endpoint.settings'
 django.setup()
 
 import source_endpoint.settings as settings
 from source_endpoint.models import Connector
-from kafka import KafkaProducer
-from hgw_common.cipher import Cipher
+from hgw_common.cipher import COMPRESSION_CODES, encrypt_many
+from hgw_common.messaging.sender import KafkaSender
+from hgw_common.messaging.serializer import RawSerializer
 
 
 class UnsupportedResource(Exception):
@@ -44,25 +44,27 @@ class BasePublisher(object):
                  ssl_certfile=settings.KAFKA_CLIENT_CERT,
                  ssl_keyfile=settings.KAFKA_CLIENT_KEY):
 
-        self.producer = KafkaProducer(bootstrap_servers=bootstrap_servers,
-                                      security_protocol=security_protocol,
-                                      ssl_check_hostname=ssl_check_hostname,
-                                      ssl_cafile=ssl_cafile,
-                                      ssl_certfile=ssl_certfile,
-                                      ssl_keyfile=ssl_keyfile)
-
-        self.ciphers = {}
+        self.sender = KafkaSender({'bootstrap_servers': bootstrap_servers,
+                                   'security_protocol': security_protocol,
+                                   'ssl_check_hostname': ssl_check_hostname,
+                                   'ssl_cafile': ssl_cafile,
+                                   'ssl_certfile': ssl_certfile,
+                                   'ssl_keyfile': ssl_keyfile}, RawSerializer)
 
     def publish(self, data):
         raise NotImplementedError()
 
+    def close(self):
+        if self.sender.producer is not None:
+            self.sender.producer.close()
+
 
 class NoConnectorAvailable(Exception):
     pass
 
 
 class FHIRBasePublisher(BasePublisher):
-    def publish(self, data, cipher=None):
+    def publish(self, data, cipher=None, compression=None):
         resource_type = data['resourceType']
         if resource_type != 'Observation':
             raise UnsupportedResource('{} is not supported'.format(resource_type))
@@ -72,21 +74,28 @@ class FHIRBasePublisher(BasePublisher):
             raise NoConnectorAvailable('No connector found')
         print("Connector.objects.all().count()", Connector.objects.all().count())
 
+        # the document is serialized only once for every person
+        reference = data['subject']['reference']
+        documents = {}
+        values = []
         for connector in connectors:
             person_id = connector.person_identifier
-            data['subject']['reference'] = data['subject']['reference'].format(person_id=person_id)
-            value = json.dumps(data)
-            if cipher:
-                if connector.channel_id not in self.ciphers:
-                    self.ciphers[connector.channel_id] = Cipher(
-                        public_key=RSA.importKey(connector.dest_public_key)
-                    )
-                value = self.ciphers[connector.channel_id].encrypt(value)
-            else:
-                value = value.encode()
-            print('sending data to ', settings.SOURCE_ID)
-            print(len(value))
-            self.producer.send(settings.SOURCE_ID, key=connector.channel_id.encode(), value=value)
+            if person_id not in documents:
+                data['subject']['reference'] = reference.format(person_id=person_id)
+                documents[person_id] = json.dumps(data)
+            values.append(documents[person_id])
+        data['subject']['reference'] = reference
+
+        if cipher:
+            values = encrypt_many(values, [connector.dest_public_key for connector in connectors],
+                                  [connector.channel_id for connector in connectors], compression=compression)
+        else:
+            values = [value.encode() for value in values]
+
+        print('sending data to ', settings.SOURCE_ID)
+        results = self.sender.send_many(settings.SOURCE_ID, [(connector.channel_id, value)
+                                                             for connector, value in zip(connectors, values)])
+        print('sent {} of {} messages'.format(results.count(True), len(results)))
 
 
 if __name__ == '__main__':
@@ -96,6 +105,8 @@ if __name__ == '__main__':
         description="Tool for publishing data. Supported formats by now: fhir-json")
     parser.add_argument('input', help='Data to input: can be a single file or a directory')
     parser.add_argument('-c', dest='cipher', action='store_true', help='Enable encrypting')
+    parser.add_argument('-z', dest='compression', choices=list(COMPRESSION_CODES), default=None,
+                        help='Compress the data before encrypting')
 
     args = parser.parse_args()
     publisher = FHIRBasePublisher()
@@ -104,9 +115,9 @@ if __name__ == '__main__':
         for f in os.listdir(args.input):
             file_path = os.path.join(args.input, f)
             if os.path.isfile(file_path):
-                publisher.publish(json.load(open(file_path)), args.cipher)
+                publisher.publish(json.load(open(file_path)), args.cipher, args.compression)
     else:
-        publisher.publish(json.load(open(args.input)), args.cipher)
+        publisher.publish(json.load(open(args.input)), args.cipher, args.compression)
 
-    publisher.producer.close()
+    publisher.close()
     print('DONE')
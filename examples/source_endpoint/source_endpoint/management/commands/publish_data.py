@@ -25,7 +25,7 @@ from django.core.management.base import BaseCommand
 from oauthlib.oauth2 import BackendApplicationClient
 from requests_oauthlib import OAuth2Session
 
-from hgw_common.cipher import Cipher, MAGIC_BYTES
+from hgw_common.cipher import COMPRESSION_CODES, MAGIC_BYTES, Cipher
 from source_endpoint.models import Connector
 from source_endpoint.settings import HGW_BACKEND_URI, HGW_BACKEND_CLIENT_ID, HGW_BACKEND_CLIENT_SECRET
 
@@ -49,6 +49,8 @@ class Command(BaseCommand):
     def add_arguments(self, parser):
         parser.add_argument('input', help='Data to input: can be a single file or a directory')
         parser.add_argument('-c', dest='cipher', action='store_true', help='Enable encrypting')
+        parser.add_argument('-z', dest='compression', choices=list(COMPRESSION_CODES), default=None,
+                            help='Compress the data before encrypting')
 
     def _load_data(self, data):
         if os.path.isdir(data):
@@ -73,6 +75,7 @@ class Command(BaseCommand):
     def handle(self, *args, **options):
         data = self._load_data(options['input'])
         cipher = options['cipher']
+        compression = options['compression']
 
         resource_type = data['resourceType']
         if resource_type != 'Observation':
@@ -93,7 +96,8 @@ class Command(BaseCommand):
             if cipher:
                 if connector.channel_id not in self.ciphers:
                     self.ciphers[connector.channel_id] = Cipher(
-                        public_key=RSA.importKey(connector.dest_public_key)
+                        public_key=RSA.importKey(connector.dest_public_key),
+                        compression=compression
                     )
                 value = self.ciphers[connector.channel_id].encrypt(value)
             else:
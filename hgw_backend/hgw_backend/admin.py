@@ -19,10 +19,26 @@
 from django.contrib import admin
 
 from hgw_backend.models import (CertificatesAuthentication, FailedConnector,
-                                OAuth2Authentication, Source, AccessToken)
+                                OAuth2Authentication, Source, SourceUsage,
+                                AccessToken)
 from hgw_common.models import Profile
 
-admin.site.register(Source)
+
+class SourceAdmin(admin.ModelAdmin):
+    list_display = ('name', 'source_id', 'max_messages_per_second', 'max_bytes_per_second')
+
+
+class SourceUsageAdmin(admin.ModelAdmin):
+    list_display = ('source', 'messages', 'bytes', 'rejected_messages')
+    readonly_fields = ('source', 'messages', 'bytes', 'rejected_messages', 'message_tokens', 'byte_tokens',
+                       'last_refill')
+
+    def has_add_permission(self, request):
+        return False
+
+
+admin.site.register(Source, SourceAdmin)
+admin.site.register(SourceUsage, SourceUsageAdmin)
 admin.site.register(Profile)
 admin.site.register(CertificatesAuthentication)
 admin.site.register(OAuth2Authentication)
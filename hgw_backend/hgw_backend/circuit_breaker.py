@@ -0,0 +1,127 @@
+# Copyright (c) 2017-2018 CRS4
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to use,
+# copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or
+# substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE
+# AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+"""
+Circuit breakers for the connector operations performed on the Sources.
+
+Every Source has its own breaker. The breaker is CLOSED while the Source works correctly and it OPENs after
+`failure_threshold` consecutive failures: while it is open the operations are not performed and the messages are
+parked for a deferred retry, so that an unreachable Source doesn't slow down the others. After `recovery_timeout`
+seconds the breaker becomes HALF_OPEN and lets one operation through to probe the Source: if it succeeds the breaker
+is closed again, otherwise it is opened for another `recovery_timeout` seconds.
+"""
+
+import logging
+import threading
+import time
+
+from hgw_backend.settings import (CIRCUIT_BREAKER_FAILURE_THRESHOLD,
+                                  CIRCUIT_BREAKER_RECOVERY_TIMEOUT)
+
+logger = logging.getLogger('hgw_backend.circuit_breaker')
+
+
+class CircuitBreaker(object):
+    """
+    Thread-safe circuit breaker
+    """
+    CLOSED = 'CLOSED'
+    OPEN = 'OPEN'
+    HALF_OPEN = 'HALF_OPEN'
+
+    def __init__(self, name, failure_threshold=CIRCUIT_BREAKER_FAILURE_THRESHOLD,
+                 recovery_timeout=CIRCUIT_BREAKER_RECOVERY_TIMEOUT):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._probing = False
+
+    def _get_state(self):
+        if self._opened_at is None:
+            return self.CLOSED
+        if time.monotonic() - self._opened_at >= self.recovery_timeout:
+            return self.HALF_OPEN
+        return self.OPEN
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._get_state()
+
+    def allow_request(self):
+        """
+        Returns True if the operation can be performed. When the breaker is half open, only one operation at a time
+        is allowed, to probe the Source
+        """
+        with self._lock:
+            state = self._get_state()
+            if state == self.CLOSED:
+                return True
+            if state == self.HALF_OPEN and not self._probing:
+                logger.info('Probing %s', self.name)
+                self._probing = True
+                return True
+            return False
+
+    def cancel_probe(self):
+        """
+        Lets another operation probe the Source, when the probing operation has not been performed
+        """
+        with self._lock:
+            self._probing = False
+
+    def record_success(self):
+        with self._lock:
+            if self._opened_at is not None:
+                logger.info('Circuit for %s closed', self.name)
+            self._failures = 0
+            self._opened_at = None
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._probing or self._failures >= self.failure_threshold:
+                if self._opened_at is None or self._probing:
+                    logger.warning('Circuit for %s opened after %s failures', self.name, self._failures)
+                self._opened_at = time.monotonic()
+            self._probing = False
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_circuit_breaker(source_id):
+    """
+    Returns the circuit breaker of the Source with id :param:`source_id`
+    """
+    with _breakers_lock:
+        if source_id not in _breakers:
+            _breakers[source_id] = CircuitBreaker('source {}'.format(source_id))
+        return _breakers[source_id]
+
+
+def reset_circuit_breakers():
+    """
+    Removes all the circuit breakers, closing them
+    """
+    with _breakers_lock:
+        _breakers.clear()
@@ -0,0 +1,364 @@
+# Copyright (c) 2017-2018 CRS4
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to use,
+# copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or
+# substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE
+# AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+Admission control for the messages sent by the Sources.
+
+The messages are produced with a producer shared by all the requests of the process. Before sending, the requests
+are admitted only if the broker is healthy and the number of messages being sent, the usage of the producer buffer and
+the rate of the Source (if configured) are below their limits. Otherwise they are rejected with the number of seconds
+after which the client should retry, so that a slow broker doesn't tie up all the workers waiting for the acks.
+The health of the broker is tracked by a circuit breaker, that opens after some consecutive requests whose messages
+were not acked or were acked too slowly: while it is open the requests are rejected without waiting for the broker.
+The limits are enforced per process. Moreover, every Source can have its own quotas of messages and bytes per
+second, configured in the admin: they are enforced with token buckets stored in the db, so that they are shared by
+all the processes, together with the counters of the messages and bytes sent by the Source.
+
+The messages sent for channels that are not active anymore are rejected before being produced, since the dispatcher
+would drop them. The status of the channels is stored by the channel_consumer and cached by every process.
+"""
+
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import DatabaseError, IntegrityError, transaction
+from django.db.models import F
+
+from hgw_common.messaging.sender import create_sender
+from hgw_common.messaging.serializer import RawSerializer
+from hgw_common.utils import create_broker_parameters_from_settings
+
+from .circuit_breaker import CircuitBreaker
+from .models import Channel, SourceUsage
+
+logger = logging.getLogger('hgw_backend.ingestion')
+
+
+class TokenBucket(object):
+    """
+    Token bucket that is refilled with :param:`rate` tokens per second, up to :param:`capacity` tokens.
+    The state of the bucket can be restored with :param:`tokens` and :param:`last`, the time of the last refill
+    measured with :param:`clock`
+    """
+
+    def __init__(self, rate, capacity, tokens=None, last=None, clock=time.monotonic):
+        self.rate = rate
+        self.capacity = capacity
+        self.clock = clock
+        self.tokens = capacity if tokens is None else tokens
+        self.last = clock() if last is None else last
+
+    def refill(self):
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + max(now - self.last, 0) * self.rate)
+        self.last = now
+
+    def get_wait(self, amount=1):
+        """
+        Returns 0 if :param:`amount` tokens can be consumed, otherwise the seconds to wait for them. An amount
+        greater than the capacity is allowed when the bucket is full, and the bucket goes in debt
+        """
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0
+        return (amount - self.tokens) / self.rate
+
+    def take(self, amount=1):
+        self.tokens -= amount
+
+    def consume(self, amount=1):
+        """
+        Consumes the tokens. It returns 0 if the tokens are available, otherwise the seconds to wait for them,
+        without consuming them
+        """
+        self.refill()
+        wait = self.get_wait(amount)
+        if wait == 0:
+            self.take(amount)
+        return wait
+
+
+class AdmissionController(object):
+    """
+    Decides whether to accept the messages of a Source.
+
+    :param max_in_flight: maximum number of messages being sent at the same time
+    :param max_buffer_usage: maximum fraction of the producer buffer in use
+    :param source_rate: messages per second allowed to every Source. None means no limit
+    :param source_burst: maximum number of messages a Source can send at once
+    :param retry_after: seconds after which the client should retry when the broker is overloaded
+    :param max_latency: seconds within which the messages of a request must be acked by the broker.
+        Slower requests count as failures of the broker
+    :param failure_threshold: consecutive failures of the broker after which the messages are rejected
+    :param recovery_timeout: seconds after which a request is let through to probe a failing broker
+    """
+
+    def __init__(self, max_in_flight, max_buffer_usage, source_rate, source_burst, retry_after,
+                 max_latency, failure_threshold, recovery_timeout):
+        self.max_in_flight = max_in_flight
+        self.max_buffer_usage = max_buffer_usage
+        self.source_rate = source_rate
+        self.source_burst = source_burst
+        self.retry_after = retry_after
+        self.max_latency = max_latency
+        self.broker_breaker = CircuitBreaker('broker', failure_threshold, recovery_timeout)
+        self.in_flight = 0
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, source_id, sender, count=1):
+        """
+        Tries to admit :param:`count` messages of the Source. It returns None if they are admitted, otherwise the
+        seconds after which the client should retry. The admitted messages must be released with :meth:`release`
+        after they have been sent
+        """
+        buffer_usage = sender.get_buffer_usage()
+        if buffer_usage is not None and buffer_usage >= self.max_buffer_usage:
+            logger.warning('Producer buffer usage at %.0f%%. Rejecting messages', buffer_usage * 100)
+            return self.retry_after
+
+        with self._lock:
+            if self.in_flight + count > self.max_in_flight and self.in_flight > 0:
+                logger.warning('%s messages being sent. Rejecting messages', self.in_flight)
+                return self.retry_after
+            if self.source_rate is not None:
+                if source_id not in self._buckets:
+                    self._buckets[source_id] = TokenBucket(self.source_rate, self.source_burst)
+                bucket = self._buckets[source_id]
+                wait = bucket.consume(count)
+                if wait > 0:
+                    logger.info('Source %s exceeded the rate limit', source_id)
+                    return wait
+            if not self.broker_breaker.allow_request():
+                logger.warning('The broker is failing. Rejecting messages')
+                if self.source_rate is not None:
+                    bucket.take(-count)
+                return self.retry_after
+            self.in_flight += count
+        return None
+
+    def release(self, count=1, sent=None, elapsed=None):
+        """
+        Releases :param:`count` admitted messages. :param:`sent` tells whether the broker acked all the messages,
+        in :param:`elapsed` seconds, and it is None if they were not sent
+        """
+        with self._lock:
+            self.in_flight -= count
+        if sent is None:
+            self.broker_breaker.cancel_probe()
+        elif sent and elapsed <= self.max_latency:
+            self.broker_breaker.record_success()
+        else:
+            if sent:
+                logger.warning('The broker acked %s messages in %.1f seconds', count, elapsed)
+            self.broker_breaker.record_failure()
+
+
+def _get_usage_for_update(source):
+    try:
+        with transaction.atomic():
+            SourceUsage.objects.get_or_create(source=source)
+    except IntegrityError:
+        # created at the same time by another request
+        pass
+    return SourceUsage.objects.select_for_update().get(source=source)
+
+
+def acquire_source_quota(source, count=1, size=0):
+    """
+    Consumes :param:`count` messages and :param:`size` bytes from the quotas of the :param:`source`.
+    It returns None if the quotas are not exceeded, otherwise the seconds after which the Source should retry.
+    The buckets hold the tokens of :data:`settings.INGESTION_QUOTA_BURST_SECONDS` seconds
+    """
+    if not source.has_quota():
+        return None
+    burst = settings.INGESTION_QUOTA_BURST_SECONDS
+    with transaction.atomic():
+        usage = _get_usage_for_update(source)
+        buckets = []
+        if source.max_messages_per_second is not None:
+            buckets.append(('message_tokens', count, TokenBucket(
+                source.max_messages_per_second, max(source.max_messages_per_second * burst, 1),
+                usage.message_tokens, usage.last_refill, clock=time.time)))
+        if source.max_bytes_per_second is not None:
+            buckets.append(('byte_tokens', size, TokenBucket(
+                source.max_bytes_per_second, max(source.max_bytes_per_second * burst, 1),
+                usage.byte_tokens, usage.last_refill, clock=time.time)))
+
+        for _, _, bucket in buckets:
+            bucket.refill()
+        wait = max(bucket.get_wait(amount) for _, amount, bucket in buckets)
+        if wait == 0:
+            for _, amount, bucket in buckets:
+                bucket.take(amount)
+        else:
+            logger.info('Source %s exceeded its quota', source.source_id)
+            usage.rejected_messages += count
+
+        for field, _, bucket in buckets:
+            setattr(usage, field, bucket.tokens)
+            usage.last_refill = bucket.last
+        usage.save()
+    return wait or None
+
+
+def record_source_usage(source, count=1, size=0):
+    """
+    Adds the messages and bytes sent to the usage counters of the :param:`source`
+    """
+    updated = SourceUsage.objects.filter(source=source).update(messages=F('messages') + count,
+                                                               bytes=F('bytes') + size)
+    if not updated:
+        try:
+            with transaction.atomic():
+                SourceUsage.objects.create(source=source, messages=count, bytes=size)
+        except IntegrityError:
+            record_source_usage(source, count, size)
+
+
+def admit(source, sender, count=1, size=0):
+    """
+    Admits :param:`count` messages of :param:`size` bytes of the :param:`source`, checking both the limits of the
+    process and the quotas of the Source. It returns None if they are admitted, otherwise the seconds after which the
+    Source should retry. The admitted messages must be released with the :meth:`AdmissionController.release`.
+    The messages are admitted when the quotas of the Source cannot be read from the db
+    """
+    admission_controller = get_admission_controller()
+    retry_after = admission_controller.acquire(source.source_id, sender, count)
+    if retry_after is not None:
+        return retry_after
+    try:
+        retry_after = acquire_source_quota(source, count, size)
+    except DatabaseError:
+        logger.error('Error reading the quotas of Source %s from the db', source.source_id)
+        return None
+    except Exception:
+        admission_controller.release(count)
+        raise
+    if retry_after is not None:
+        admission_controller.release(count)
+    return retry_after
+
+
+class ChannelCache(object):
+    """
+    Process-level cache of the status of the channels, read from the :class:`Channel` table. The status of a channel
+    is kept for :param:`ttl` seconds and at most :param:`max_size` channels are cached.
+    The channels not found in the table are considered active, unless :param:`reject_unknown` is True
+    """
+
+    def __init__(self, ttl, max_size, reject_unknown=False):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.reject_unknown = reject_unknown
+        self._channels = {}
+        self._lock = threading.Lock()
+
+    def _load(self, source, channel_ids):
+        statuses = dict.fromkeys(channel_ids)
+        try:
+            statuses.update(Channel.objects.filter(source=source, channel_id__in=channel_ids)
+                            .values_list('channel_id', 'active'))
+        except DatabaseError:
+            # the messages are not rejected when the status of the channels is not available
+            logger.error('Error reading the channels from the db')
+            return {channel_id: True for channel_id in channel_ids}
+        return statuses
+
+    def get_inactive_channels(self, source, channel_ids):
+        """
+        Returns the set of the channels of the :param:`source` among :param:`channel_ids` that are not active
+        """
+        now = time.monotonic()
+        statuses = {}
+        with self._lock:
+            for channel_id in set(channel_ids):
+                cached = self._channels.get((source.pk, channel_id))
+                if cached is not None and cached[1] > now:
+                    statuses[channel_id] = cached[0]
+        missing = set(channel_ids) - set(statuses)
+        if missing:
+            loaded = self._load(source, missing)
+            statuses.update(loaded)
+            with self._lock:
+                if len(self._channels) + len(loaded) > self.max_size:
+                    self._channels.clear()
+                for channel_id, active in loaded.items():
+                    self._channels[(source.pk, channel_id)] = (active, now + self.ttl)
+
+        return {channel_id for channel_id, active in statuses.items()
+                if active is False or (active is None and self.reject_unknown)}
+
+
+_sender = None
+_admission_controller = None
+_channel_cache = None
+_lock = threading.Lock()
+
+
+def get_sender():
+    """
+    Returns the sender shared by the requests of the process
+    """
+    global _sender
+    with _lock:
+        if _sender is None:
+            _sender = create_sender(create_broker_parameters_from_settings(), serializer=RawSerializer)
+        return _sender
+
+
+def get_admission_controller():
+    """
+    Returns the admission controller of the process, configured from the settings
+    """
+    global _admission_controller
+    with _lock:
+        if _admission_controller is None:
+            _admission_controller = AdmissionController(settings.INGESTION_MAX_IN_FLIGHT,
+                                                        settings.INGESTION_MAX_BUFFER_USAGE,
+                                                        settings.INGESTION_SOURCE_RATE,
+                                                        settings.INGESTION_SOURCE_BURST,
+                                                        settings.INGESTION_RETRY_AFTER,
+                                                        settings.INGESTION_BROKER_MAX_LATENCY,
+                                                        settings.INGESTION_BROKER_FAILURE_THRESHOLD,
+                                                        settings.INGESTION_BROKER_RECOVERY_TIMEOUT)
+        return _admission_controller
+
+
+def get_channel_cache():
+    """
+    Returns the cache of the channels of the process, configured from the settings
+    """
+    global _channel_cache
+    with _lock:
+        if _channel_cache is None:
+            _channel_cache = ChannelCache(settings.INGESTION_CHANNEL_CACHE_TTL,
+                                          settings.INGESTION_CHANNEL_CACHE_SIZE,
+                                          settings.INGESTION_REJECT_UNKNOWN_CHANNELS)
+        return _channel_cache
+
+
+def reset():
+    """
+    Removes the shared sender, admission controller and channel cache. They are created again at the next request
+    """
+    global _sender, _admission_controller, _channel_cache
+    with _lock:
+        _sender = None
+        _admission_controller = None
+        _channel_cache = None
@@ -19,8 +19,10 @@ import logging
 
 from dateutil import parser
 from django.db import DatabaseError, transaction
+from django.utils import timezone
 
-from hgw_backend.models import FailedConnector, Source
+from hgw_backend.circuit_breaker import get_circuit_breaker
+from hgw_backend.models import Channel, FailedConnector, Source
 from hgw_backend.settings import KAFKA_CHANNEL_NOTIFICATION_TOPIC
 from hgw_common.utils.management import ConsumerCommand
 
@@ -40,14 +42,23 @@ class Command(ConsumerCommand):
         self.client_id = 'channel_consumer'
         self.group_id = 'channel_consumer'
         self.topics = [KAFKA_CHANNEL_NOTIFICATION_TOPIC]
-        self.retriable_failure_reason = (FailedConnector.DATABASE_ERROR, FailedConnector.SENDING_ERROR)
+        self.retriable_failure_reason = FailedConnector.RETRIABLE_REASONS
         super(Command, self).__init__(*args, **kwargs)
 
+    @staticmethod
+    def _get_channel_id(message):
+        if message['success'] and isinstance(message['data'], dict) and \
+                isinstance(message['data'].get('channel_id'), str):
+            return message['data']['channel_id']
+        return None
+
     def _store_failure(self, message, failure_reason):
         try:
             with transaction.atomic():
                 FailedConnector.objects.create(message=json.dumps(message['data']), 
-                    reason=failure_reason, retry=failure_reason in self.retriable_failure_reason)
+                    channel_id=self._get_channel_id(message),
+                    reason=failure_reason, retry=failure_reason in self.retriable_failure_reason,
+                    next_retry=timezone.now() + FailedConnector.get_retry_delay(0))
         except Exception as e:
             logger.error('Failure saving message into database', message['id'])
             logger.error(e)
@@ -72,7 +83,13 @@ class Command(ConsumerCommand):
                 return False
         return None
 
-    def _check_source(self, channel_data):
+    def _check_source(self, channel_data, sources=None):
+        if sources is not None:
+            # the Sources have been already read from the db
+            if channel_data['source_id'] not in sources:
+                logger.error('Source with id %s was not found in the db', channel_data['source_id'])
+                return None, FailedConnector.SOURCE_NOT_FOUND
+            return sources[channel_data['source_id']], None
         try:
             source = Source.objects.get(source_id=channel_data['source_id'])
         except DatabaseError:
@@ -86,34 +103,32 @@ class Command(ConsumerCommand):
     def _check_action(self, channel_data):
         return channel_data['action'] in (ACTION.CREATED, ACTION.UPDATED, ACTION.REVOKED)
         
-    def handle_message(self, message):
-        logger.info('Received message with id %s to create a connector', message['id'])
-
+    def prepare_operation(self, message, sources=None):
+        """
+        Validates the message and returns the operation to perform on the Source as a tuple
+        (source, method name, connector) and the failure reason, if the message is not valid.
+        :param sources: optional dict of Sources by source_id, to avoid reading them from the db
+        """
         if not message['success']:
             logger.error('Message was not json encoded', message['id'])
-            self._store_failure(message, FailedConnector.JSON_DECODING)
-            return
+            return None, FailedConnector.JSON_DECODING
 
         channel_data = message['data']
         if not self._check_action(channel_data):
-            self._store_failure(message, FailedConnector.WRONG_ACTION)
-            return
+            return None, FailedConnector.WRONG_ACTION
 
         if not self._check_message_structure(channel_data):
-            self._store_failure(message, FailedConnector.WRONG_MESSAGE_STRUCTURE)
-            return
+            return None, FailedConnector.WRONG_MESSAGE_STRUCTURE
 
         start_date = self._check_date(channel_data['start_validity'])
         expire_date = self._check_date(channel_data['expire_validity'])
         if start_date is False or expire_date is False:
-            self._store_failure(message, FailedConnector.WRONG_DATE_FORMAT)
-            return
+            return None, FailedConnector.WRONG_DATE_FORMAT
 
-        source, failure_reason = self._check_source(channel_data)
+        source, failure_reason = self._check_source(channel_data, sources)
         if failure_reason is not None:
-            self._store_failure(message, failure_reason)
-            return
-        
+            return None, failure_reason
+
         if channel_data['action'] == ACTION.CREATED:
             connector = {
                 'profile': channel_data['profile'],
@@ -137,7 +152,64 @@ class Command(ConsumerCommand):
                 'channel_id': channel_data['channel_id'],
             }
             met = 'delete_connector'
-        
-        if getattr(source, met)(connector) is None:
-            logger.error('Error contacting the Source Endpoint', message['id'])
-            self._store_failure(message, FailedConnector.SENDING_ERROR)
+        return (source, met, connector), None
+
+    def perform_operation(self, message_id, source, met, connector):
+        """
+        Performs the operation on the Source. It returns the failure reason or None if the operation succeeded
+        """
+        # When the Source is failing, the message is parked for a later retry without contacting it
+        circuit_breaker = get_circuit_breaker(source.source_id)
+        if not circuit_breaker.allow_request():
+            logger.warning('Source %s unavailable. Message with id %s parked', source.source_id, message_id)
+            return FailedConnector.SOURCE_UNAVAILABLE
+
+        try:
+            res = getattr(source, met)(connector)
+        except Exception:
+            # the outcome must be always recorded, otherwise a failed probe would leave the circuit open forever
+            circuit_breaker.record_failure()
+            raise
+        if res is None:
+            logger.error('Error contacting the Source Endpoint for message with id %s', message_id)
+            circuit_breaker.record_failure()
+            return FailedConnector.SENDING_ERROR
+        circuit_breaker.record_success()
+        return None
+
+    def update_channel(self, source, channel_data):
+        """
+        Stores the status of the channel, used by the REST API to reject the messages of the revoked channels
+        """
+        try:
+            Channel.objects.update_or_create(source=source, channel_id=channel_data['channel_id'],
+                                             defaults={'active': channel_data['action'] != ACTION.REVOKED})
+        except DatabaseError:
+            logger.error('Error saving the status of the channel %s', channel_data['channel_id'])
+
+    @staticmethod
+    def has_pending_operations(channel_id):
+        """
+        Returns True if some failed operations of the channel are waiting to be retried. The following operations of
+        the channel must wait for them, otherwise, for example, a connector could be created again after its
+        revocation
+        """
+        try:
+            return FailedConnector.objects.filter(channel_id=channel_id, retry=True).exists()
+        except DatabaseError:
+            logger.error('Error reading the failed operations of the channel %s', channel_id)
+            return False
+
+    def handle_message(self, message):
+        logger.info('Received message with id %s to create a connector', message['id'])
+
+        operation, failure_reason = self.prepare_operation(message)
+        if failure_reason is None:
+            self.update_channel(operation[0], message['data'])
+            if self.has_pending_operations(message['data']['channel_id']):
+                logger.info('Message with id %s parked after the pending operations of the channel', message['id'])
+                failure_reason = FailedConnector.PENDING_OPERATION
+            else:
+                failure_reason = self.perform_operation(message['id'], *operation)
+        if failure_reason is not None:
+            self._store_failure(message, failure_reason)
@@ -0,0 +1,190 @@
+# Copyright (c) 2017-2018 CRS4
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to use,
+# copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or
+# substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE
+# AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+import json
+import logging
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import DatabaseError, connections, transaction
+from django.db.models import Min
+
+from hgw_backend.management.commands.channel_consumer import \
+    Command as ChannelConsumerCommand
+from hgw_backend.models import FailedConnector, Source
+from hgw_backend.settings import (FAILED_CONNECTOR_RETRY_BATCH_SIZE,
+                                  FAILED_CONNECTOR_RETRY_LEASE,
+                                  FAILED_CONNECTOR_RETRY_WORKERS)
+from hgw_common.utils.batches import BatchWorker, claim_batch
+
+logger = logging.getLogger('hgw_backend.retry_failed_connectors')
+
+
+class FailedConnectorsRetrier(BatchWorker):
+    """
+    Retries the failed connector operations, using the same path of the channel consumer.
+    The operations of different Sources are performed concurrently by the :param:`executor`, while the ones of the
+    same Source are performed in order. The operations of a channel are retried in the order they were saved: an
+    operation is not retried while an earlier one of the same channel is waiting to be retried.
+
+    :param batch_size: number of operations claimed at once
+    :param lease: seconds a claimed operation is reserved to the retrier
+    """
+
+    def __init__(self, executor, batch_size=FAILED_CONNECTOR_RETRY_BATCH_SIZE, lease=FAILED_CONNECTOR_RETRY_LEASE):
+        super(FailedConnectorsRetrier, self).__init__(('retried', 'succeeded', 'failed'), 'retried')
+        self.channel_consumer = ChannelConsumerCommand()
+        self.executor = executor
+        self.batch_size = batch_size
+        self.lease = lease
+
+    @staticmethod
+    def _drop_blocked(failures):
+        """
+        Removes from the claimed :param:`failures` the ones preceded by an operation of the same channel that has not
+        been claimed (i.e., it is waiting for a retry or it is claimed by another retrier)
+        """
+        channel_ids = {failure.channel_id for failure in failures if failure.channel_id is not None}
+        if not channel_ids:
+            return failures
+        pending = FailedConnector.objects.filter(retry=True, channel_id__in=channel_ids) \
+            .exclude(pk__in=[failure.pk for failure in failures]).values('channel_id').annotate(first=Min('pk'))
+        first_pending = {p['channel_id']: p['first'] for p in pending}
+        return [failure for failure in failures
+                if failure.channel_id not in first_pending or failure.pk < first_pending[failure.channel_id]]
+
+    def claim_batch(self):
+        """
+        Claims the due operations, in the order they were saved, reserving them for the lease time
+        """
+        return claim_batch(FailedConnector.objects.filter(retry=True), self.batch_size, self.lease,
+                           field='next_retry', order_by=('pk',), select=self._drop_blocked)
+
+    @staticmethod
+    def _get_message(failure):
+        try:
+            return {'id': 'failed_connector_{}'.format(failure.pk), 'success': True,
+                    'data': json.loads(failure.message)}
+        except ValueError:
+            return {'id': 'failed_connector_{}'.format(failure.pk), 'success': False, 'data': failure.message}
+
+    def _perform_operations(self, operations):
+        """
+        Performs in order the operations of a Source. It returns the list of (failure, failure reason).
+        When an operation fails, the following ones of the same channel are not performed and they are not returned:
+        they are retried after it
+        """
+        results = []
+        failed_channels = set()
+        try:
+            for failure, message_id, operation in operations:
+                if failure.channel_id is not None and failure.channel_id in failed_channels:
+                    continue
+                failure_reason = self.channel_consumer.perform_operation(message_id, *operation)
+                if failure_reason is not None:
+                    failed_channels.add(failure.channel_id)
+                results.append((failure, failure_reason))
+            return results
+        finally:
+            # the connections opened by the worker thread are not reused
+            connections.close_all()
+
+    def process_batch(self):
+        """
+        Retries a batch of operations. It returns the number of operations claimed
+        """
+        start = time.monotonic()
+        try:
+            failures = self.claim_batch()
+        except DatabaseError:
+            logger.error('Error claiming the failed connector operations')
+            return 0
+        if not failures:
+            return 0
+
+        messages = [(failure, self._get_message(failure)) for failure in failures]
+        source_ids = {message['data'].get('source_id') for _, message in messages
+                      if message['success'] and isinstance(message['data'], dict)}
+        try:
+            sources = {source.source_id: source for source in
+                       Source.objects.filter(source_id__in=source_ids).prefetch_related('content_object')}
+        except DatabaseError:
+            logger.error('Error reading the Sources from db')
+            return len(failures)
+
+        results = []
+        operations = OrderedDict()
+        for failure, message in messages:
+            operation, failure_reason = self.channel_consumer.prepare_operation(message, sources)
+            if failure_reason is not None:
+                results.append((failure, failure_reason))
+            else:
+                operations.setdefault(operation[0].source_id, []).append((failure, message['id'], operation))
+
+        for source_results in self.executor.map(self._perform_operations, operations.values()):
+            results.extend(source_results)
+
+        succeeded = []
+        failed = []
+        for failure, failure_reason in results:
+            if failure_reason is None:
+                succeeded.append(failure.pk)
+            else:
+                # when the Source has not been contacted the attempt is not counted
+                failure.schedule_retry(failure_reason,
+                                       count_attempt=failure_reason != FailedConnector.SOURCE_UNAVAILABLE)
+                failed.append(failure)
+        try:
+            with transaction.atomic():
+                FailedConnector.objects.filter(pk__in=succeeded).delete()
+                FailedConnector.objects.bulk_update(failed, ['reason', 'retry', 'attempts', 'next_retry'])
+        except DatabaseError:
+            logger.error('Error saving the results of the retried operations')
+
+        self.update_metrics(time.monotonic() - start, retried=len(results), succeeded=len(succeeded),
+                            failed=len(failed))
+        logger.info('Retried %s failed connector operations: %s succeeded, %s failed',
+                    len(results), len(succeeded), len(failed))
+        return len(failures)
+
+
+class Command(BaseCommand):
+    """
+    Command that retries the failed connector operations marked to be retried (see :class:`FailedConnectorsRetrier`).
+    The due operations are claimed in batches (see :mod:`hgw_common.utils.batches`) and reserved for
+    FAILED_CONNECTOR_RETRY_LEASE seconds, so that more schedulers can run concurrently.
+    The operations that fail again are rescheduled with exponential backoff.
+    """
+    help = 'Retry the failed connector operations'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=FAILED_CONNECTOR_RETRY_BATCH_SIZE,
+                            help='Number of operations claimed at once')
+        parser.add_argument('--workers', type=int, default=FAILED_CONNECTOR_RETRY_WORKERS,
+                            help='Number of Sources contacted concurrently')
+        parser.add_argument('--interval', type=float, default=10,
+                            help='Seconds to wait when there are no operations to retry')
+        parser.add_argument('--once', action='store_true',
+                            help='Retry the operations currently due and exit')
+
+    def handle(self, *args, **options):
+        with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+            retrier = FailedConnectorsRetrier(executor, options['batch_size'])
+            metrics = retrier.run(options['once'], options['interval'])
+        logger.info('Retried %s failed connector operations in %s batches (%.1f operations/s)', metrics['retried'],
+                    metrics['batches'], metrics['throughput'])
@@ -0,0 +1,18 @@
+# Generated by Django 2.2.5 on 2026-10-19 18:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hgw_backend', '0003_failedconnectors'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='failedconnector',
+            name='reason',
+            field=models.CharField(choices=[('JS', 'JSON_DECODING'), ('DE', 'DECODING'), ('SN', 'SOURCE_NOT_FOUND'), ('WS', 'WRONG_MESSAGE_STRUCTURE'), ('WD', 'WRONG_DATE_FORMAT'), ('SE', 'SENDING_ERROR'), ('UE', 'UNKNOWN_ERROR'), ('DB', 'DATABASE_ERROR'), ('WA', 'WRONG_ACTION'), ('SU', 'SOURCE_UNAVAILABLE')], max_length=2),
+        ),
+    ]
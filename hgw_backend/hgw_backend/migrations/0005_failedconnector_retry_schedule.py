@@ -0,0 +1,24 @@
+# Generated by Django 2.2.5 on 2026-10-19 18:36
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hgw_backend', '0004_failedconnector_source_unavailable'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='failedconnector',
+            name='attempts',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='failedconnector',
+            name='next_retry',
+            field=models.DateTimeField(db_index=True, default=django.utils.timezone.now),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 2.2.5 on 2026-10-19 18:49
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hgw_backend', '0005_failedconnector_retry_schedule'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SourceUsage',
+            fields=[
+                ('source', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='usage', serialize=False, to='hgw_backend.Source')),
+                ('messages', models.BigIntegerField(default=0)),
+                ('bytes', models.BigIntegerField(default=0)),
+                ('rejected_messages', models.BigIntegerField(default=0)),
+                ('message_tokens', models.FloatField(blank=True, null=True)),
+                ('byte_tokens', models.FloatField(blank=True, null=True)),
+                ('last_refill', models.FloatField(blank=True, null=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='source',
+            name='max_bytes_per_second',
+            field=models.PositiveIntegerField(blank=True, help_text='Maximum number of bytes per second the Source can send. Leave empty for no limit', null=True),
+        ),
+        migrations.AddField(
+            model_name='source',
+            name='max_messages_per_second',
+            field=models.PositiveIntegerField(blank=True, help_text='Maximum number of messages per second the Source can send. Leave empty for no limit', null=True),
+        ),
+    ]
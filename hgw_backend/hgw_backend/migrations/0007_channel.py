@@ -0,0 +1,27 @@
+# Generated by Django 2.2.5 on 2026-10-19 18:52
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hgw_backend', '0006_source_quotas'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Channel',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('channel_id', models.CharField(max_length=32)),
+                ('active', models.BooleanField()),
+                ('updated', models.DateTimeField(auto_now=True)),
+                ('source', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='channels', to='hgw_backend.Source')),
+            ],
+            options={
+                'unique_together': {('source', 'channel_id')},
+            },
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 2.2.5 on 2026-10-19 19:28
+
+import json
+
+from django.db import migrations, models
+
+
+def set_channel_id(apps, schema_editor):
+    FailedConnector = apps.get_model('hgw_backend', 'FailedConnector')
+    for failure in FailedConnector.objects.filter(retry=True):
+        try:
+            channel_id = json.loads(failure.message).get('channel_id')
+        except (ValueError, AttributeError):
+            continue
+        if isinstance(channel_id, str):
+            failure.channel_id = channel_id[:32]
+            failure.save(update_fields=['channel_id'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hgw_backend', '0007_channel'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='failedconnector',
+            name='channel_id',
+            field=models.CharField(blank=True, db_index=True, max_length=32, null=True),
+        ),
+        migrations.AlterField(
+            model_name='failedconnector',
+            name='reason',
+            field=models.CharField(choices=[('JS', 'JSON_DECODING'), ('DE', 'DECODING'), ('SN', 'SOURCE_NOT_FOUND'), ('WS', 'WRONG_MESSAGE_STRUCTURE'), ('WD', 'WRONG_DATE_FORMAT'), ('SE', 'SENDING_ERROR'), ('UE', 'UNKNOWN_ERROR'), ('DB', 'DATABASE_ERROR'), ('WA', 'WRONG_ACTION'), ('SU', 'SOURCE_UNAVAILABLE'), ('PO', 'PENDING_OPERATION')], max_length=2),
+        ),
+        migrations.RunPython(set_channel_id, migrations.RunPython.noop),
+    ]
@@ -18,24 +18,26 @@
 import logging
 from datetime import datetime
 
-import requests
 from django.conf import settings
 from django.contrib.contenttypes.fields import (GenericForeignKey,
                                                 GenericRelation)
 from django.contrib.contenttypes.models import ContentType
 from django.db import models
 from django.db.models.signals import post_save
+from django.utils import timezone
 from django.utils.crypto import get_random_string
 from oauth2_provider.models import AbstractApplication
 from oauthlib.oauth2 import (BackendApplicationClient, InvalidClientError,
                              MissingTokenError, TokenExpiredError)
 from requests.auth import HTTPBasicAuth
-from requests.exceptions import ConnectionError
+from requests.exceptions import ConnectionError, Timeout
 from requests_oauthlib import OAuth2Session
 
 from hgw_backend.fields import HostnameURLField
 from hgw_backend.signals import (connector_created, connector_created_handler,
                                  source_saved_handler)
+from hgw_common.http_client import get_http_client
+from hgw_common.utils.batches import get_retry_delay
 
 logger = logging.getLogger('hgw_backend.models')
 
@@ -60,9 +62,20 @@ class Source(models.Model):
     object_id = models.PositiveIntegerField()
     content_object = GenericForeignKey()
 
+    # Ingestion quotas
+    max_messages_per_second = models.PositiveIntegerField(null=True, blank=True,
+                                                          help_text='Maximum number of messages per second the '
+                                                                    'Source can send. Leave empty for no limit')
+    max_bytes_per_second = models.PositiveIntegerField(null=True, blank=True,
+                                                       help_text='Maximum number of bytes per second the Source '
+                                                                 'can send. Leave empty for no limit')
+
     def __str__(self):
         return self.name
 
+    def has_quota(self):
+        return self.max_messages_per_second is not None or self.max_bytes_per_second is not None
+
     def create_connector(self, connector):
         res = self.content_object.create_connector(self, connector)
         if res is not None:
@@ -76,28 +89,77 @@ class Source(models.Model):
         return self.content_object.delete_connector(self, connector)
 
 
+class SourceUsage(models.Model):
+    """
+    Model that stores the number of messages and bytes sent by a Source and the state of the token buckets used to
+    enforce the Source quotas
+    """
+    source = models.OneToOneField('Source', primary_key=True, on_delete=models.CASCADE, related_name='usage')
+    messages = models.BigIntegerField(default=0)
+    bytes = models.BigIntegerField(default=0)
+    rejected_messages = models.BigIntegerField(default=0)
+    message_tokens = models.FloatField(null=True, blank=True)
+    byte_tokens = models.FloatField(null=True, blank=True)
+    # timestamp of the last refill of the buckets
+    last_refill = models.FloatField(null=True, blank=True)
+
+    def __str__(self):
+        return str(self.source)
+
+
+class Channel(models.Model):
+    """
+    Model that stores the status of the channels of a Source, notified by the hgw_frontend. It is used to reject the
+    messages sent for channels that are not active anymore
+    """
+    source = models.ForeignKey('Source', on_delete=models.CASCADE, related_name='channels')
+    channel_id = models.CharField(max_length=32, blank=False, null=False)
+    active = models.BooleanField()
+    updated = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('source', 'channel_id')
+
+    def __str__(self):
+        return self.channel_id
+
+
 class CertificatesAuthentication(models.Model):
     source = GenericRelation(Source)
     cert = models.FileField(blank=False, null=False)
     key = models.FileField(blank=False, null=False)
 
-    def call_source_endpoint(self, source, connector, action):
-        met = getattr(requests, action)
-        met(
-            source.url,
-            json=connector,
-            verify=True,
-            cert=(self.cert.file.name, self.key.file.name)
-        )
-    
+    def call_source_endpoint(self, source, connector, action, success_response_code):
+        """
+        Performs the connector operation on the Source, authenticating with the client certificate.
+        Like :meth:`OAuth2Authentication.call_source_endpoint`, it returns the response when the Source answers with
+        :param:`success_response_code` and None otherwise, so the creation of the connector is notified and the
+        failures are retried for both the authentication methods
+        """
+        try:
+            res = get_http_client().request(
+                action,
+                source.url,
+                json=connector,
+                verify=True,
+                cert=(self.cert.path, self.key.path)
+            )
+        except (ConnectionError, Timeout):
+            logger.debug("Connection error performing connector's operation")
+            return None
+        if res.status_code != success_response_code:
+            logger.debug("Error performing %s: %s with status code: %s", action, res.content, res.status_code)
+            return None
+        return res
+
     def create_connector(self, source, connector):
-        return self.call_source_endpoint(source, connector, 'post')
+        return self.call_source_endpoint(source, connector, 'post', 201)
 
     def update_connector(self, source, connector):
-        return self.call_source_endpoint(source, connector, 'put')
-    
+        return self.call_source_endpoint(source, connector, 'put', 200)
+
     def delete_connector(self, source, connector):
-        return self.call_source_endpoint(source, connector, 'delete')
+        return self.call_source_endpoint(source, connector, 'delete', 200)
 
     def __str__(self):
         try:
@@ -168,17 +230,17 @@ class OAuth2Authentication(models.Model):
         access_token = self._get_token()
 
         if access_token is None:
-            oauth_session = OAuth2Session(client=client)
+            oauth_session = get_http_client().mount(OAuth2Session(client=client))
             self._fetch_token(oauth_session)
         else:
-            oauth_session = OAuth2Session(client=client, token=access_token)
+            oauth_session = get_http_client().mount(OAuth2Session(client=client, token=access_token))
 
         return oauth_session
 
     def call_source_endpoint(self, source, connector, action, success_response_code, count=0):
         try:
             session = self._get_oauth2_session()
-        except (ConnectionError, InvalidClientError, MissingTokenError) as exc:
+        except (ConnectionError, Timeout, InvalidClientError, MissingTokenError) as exc:
             logger.debug("Error opening an oauth2 session with the source endpoint: %s", exc)
             res = None
         else:
@@ -197,7 +259,7 @@ class OAuth2Authentication(models.Model):
                     logger.debug("Token for the source expired. Getting a new one")
                     AccessToken.objects.get(oauth2_authentication=self).delete()
                     res = self.call_source_endpoint(source, connector, action, success_response_code, count=count+1)
-            except ConnectionError:
+            except (ConnectionError, Timeout):
                 logger.debug("Connection error performing connector's operation")
                 res = None
             except MissingTokenError:
@@ -246,6 +308,8 @@ class FailedConnector(models.Model):
     UNKNOWN_ERROR = 'UE'
     DATABASE_ERROR = 'DB'
     WRONG_ACTION = 'WA'
+    SOURCE_UNAVAILABLE = 'SU'
+    PENDING_OPERATION = 'PO'
 
     FAIL_REASON = ((JSON_DECODING, 'JSON_DECODING'),
                    (DECODING, 'DECODING'),
@@ -255,11 +319,40 @@ class FailedConnector(models.Model):
                    (SENDING_ERROR, 'SENDING_ERROR'),
                    (UNKNOWN_ERROR, 'UNKNOWN_ERROR'),
                    (DATABASE_ERROR, 'DATABASE_ERROR'),
-                   (WRONG_ACTION, 'WRONG_ACTION'))
+                   (WRONG_ACTION, 'WRONG_ACTION'),
+                   (SOURCE_UNAVAILABLE, 'SOURCE_UNAVAILABLE'),
+                   (PENDING_OPERATION, 'PENDING_OPERATION'))
+
+    RETRIABLE_REASONS = (DATABASE_ERROR, SENDING_ERROR, SOURCE_UNAVAILABLE, PENDING_OPERATION)
 
     message = models.CharField(max_length=1500, blank=False, null=False)
+    # the operations of the same channel are retried in order
+    channel_id = models.CharField(max_length=32, blank=True, null=True, db_index=True)
     reason = models.CharField(max_length=2, choices=FAIL_REASON)
     retry = models.BooleanField()
+    attempts = models.PositiveIntegerField(default=0)
+    next_retry = models.DateTimeField(default=timezone.now, db_index=True)
+
+    @staticmethod
+    def get_retry_delay(attempts):
+        """
+        Returns the delay before the next retry, doubled at every attempt. The failure that saved the operation is
+        not counted in the :param:`attempts`
+        """
+        return get_retry_delay(attempts + 1, settings.FAILED_CONNECTOR_RETRY_BASE_DELAY,
+                               settings.FAILED_CONNECTOR_RETRY_MAX_DELAY)
+
+    def schedule_retry(self, reason, count_attempt=True):
+        """
+        Updates the failure reason and schedules the next retry. When the maximum number of attempts is reached,
+        the operation is not retried anymore
+        """
+        self.reason = reason
+        if count_attempt:
+            self.attempts += 1
+        self.retry = reason in self.RETRIABLE_REASONS and \
+            self.attempts < settings.FAILED_CONNECTOR_RETRY_MAX_ATTEMPTS
+        self.next_retry = timezone.now() + self.get_retry_delay(self.attempts)
 
 
 class RESTClient(AbstractApplication):
@@ -0,0 +1,126 @@
+# Copyright (c) 2017-2018 CRS4
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to use,
+# copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or
+# substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE
+# AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+import base64
+import binascii
+import json
+
+from django.conf import settings
+from rest_framework.exceptions import APIException, ParseError
+from rest_framework.parsers import BaseParser
+
+from hgw_common.messaging.frames import (FRAME_CONTENT_TYPE, FrameError,
+                                         read_frames)
+
+
+class PayloadTooLarge(APIException):
+    status_code = 413
+    default_detail = 'Payload too large'
+    default_code = 'payload_too_large'
+
+
+class _BoundedStream(object):
+    """
+    Wraps a stream raising :class:`PayloadTooLarge` when more than max_size bytes are read
+    """
+
+    def __init__(self, stream, max_size):
+        self.stream = stream
+        self.max_size = max_size
+        self.read_bytes = 0
+
+    def _count(self, data):
+        self.read_bytes += len(data)
+        if self.read_bytes > self.max_size:
+            raise PayloadTooLarge()
+        return data
+
+    def read(self, size=-1):
+        return self._count(self.stream.read(size))
+
+    def readline(self):
+        return self._count(self.stream.readline())
+
+
+def _check_content_length(parser_context, max_size):
+    request = (parser_context or {}).get('request')
+    if request is not None and int(request.META.get('CONTENT_LENGTH') or 0) > max_size:
+        raise PayloadTooLarge()
+
+
+class RawPayloadParser(BaseParser):
+    """
+    Parser that returns the body of the request as bytes. The body is read from the stream with a single bounded
+    read, so it is never larger than MESSAGES_MAX_SIZE
+    """
+    media_type = 'application/octet-stream'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        max_size = settings.MESSAGES_MAX_SIZE
+        _check_content_length(parser_context, max_size)
+        if stream is None:
+            return b''
+        payload = stream.read(max_size + 1)
+        if len(payload) > max_size:
+            raise PayloadTooLarge()
+        return payload
+
+
+class NDJSONMessagesParser(BaseParser):
+    """
+    Parser for a batch of messages sent as newline delimited json. Every line is a json object with the
+    channel_id and the base64 encoded payload. It returns a list with, for every line, a dict with the channel_id
+    and the decoded payload or with the error
+    """
+    media_type = 'application/x-ndjson'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        _check_content_length(parser_context, settings.MESSAGES_BULK_MAX_SIZE)
+        if stream is None:
+            return []
+        stream = _BoundedStream(stream, settings.MESSAGES_BULK_MAX_SIZE)
+        messages = []
+        while True:
+            line = stream.readline()
+            if not line:
+                return messages
+            if not line.strip():
+                continue
+            try:
+                item = json.loads(line.decode('utf-8'))
+                messages.append({'channel_id': item['channel_id'], 'payload': base64.b64decode(item['payload'])})
+            except (ValueError, KeyError, TypeError, binascii.Error):
+                messages.append({'error': 'invalid_item'})
+
+
+class FramesMessagesParser(BaseParser):
+    """
+    Parser for a batch of messages sent as binary frames (see :mod:`hgw_common.messaging.frames`). The header of
+    every frame contains the channel_id and the payload is the raw message. It returns a list with, for every frame,
+    a dict with the channel_id and the payload
+    """
+    media_type = FRAME_CONTENT_TYPE
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        _check_content_length(parser_context, settings.MESSAGES_BULK_MAX_SIZE)
+        if stream is None:
+            return []
+        try:
+            return [{'channel_id': header.get('channel_id') if isinstance(header, dict) else None,
+                     'payload': payload}
+                    for header, payload in read_frames(_BoundedStream(stream, settings.MESSAGES_BULK_MAX_SIZE))]
+        except FrameError as ex:
+            raise ParseError(str(ex))
@@ -239,3 +239,49 @@ KAFKA_SSL = cfg['kafka']['ssl']
 KAFKA_CA_CERT = get_path(BASE_CONF_DIR, cfg['kafka']['ca_cert'])
 KAFKA_CLIENT_CERT = get_path(BASE_CONF_DIR, cfg['kafka']['client_cert'])
 KAFKA_CLIENT_KEY = get_path(BASE_CONF_DIR, cfg['kafka']['client_key'])
+# Maximum size in bytes of a message sent by a Source. It must not exceed the max request size of the Kafka producer
+MESSAGES_MAX_SIZE = cfg['kafka'].get('max_message_size', 1024 * 1024)
+# Maximum size in bytes of the body and maximum number of messages of a bulk request
+MESSAGES_BULK_MAX_SIZE = cfg['kafka'].get('max_bulk_size', 32 * 1024 * 1024)
+MESSAGES_BULK_MAX_ITEMS = cfg['kafka'].get('max_bulk_items', 1000)
+
+_ingestion_cfg = cfg.get('ingestion', {})
+# Maximum number of messages being sent to kafka at the same time by a process
+INGESTION_MAX_IN_FLIGHT = _ingestion_cfg.get('max_in_flight', 1000)
+# Maximum fraction of the producer buffer in use. Over it the messages are rejected
+INGESTION_MAX_BUFFER_USAGE = _ingestion_cfg.get('max_buffer_usage', 0.8)
+# Messages per second and burst allowed to every Source by a process. A null rate, the default, disables the limit
+INGESTION_SOURCE_RATE = _ingestion_cfg.get('source_rate', None)
+INGESTION_SOURCE_BURST = _ingestion_cfg.get('source_burst', 200)
+# Seconds after which a Source should retry when the broker is overloaded
+INGESTION_RETRY_AFTER = _ingestion_cfg.get('retry_after', 1)
+# Seconds within which the broker must ack the messages of a request. Slower requests count as broker failures
+INGESTION_BROKER_MAX_LATENCY = _ingestion_cfg.get('broker_max_latency', 1)
+# Consecutive broker failures after which a process rejects the messages and seconds after which it probes the broker
+INGESTION_BROKER_FAILURE_THRESHOLD = _ingestion_cfg.get('broker_failure_threshold', 3)
+INGESTION_BROKER_RECOVERY_TIMEOUT = _ingestion_cfg.get('broker_recovery_timeout', 10)
+# Seconds of traffic that a Source can send at once within the quotas configured in the admin
+INGESTION_QUOTA_BURST_SECONDS = _ingestion_cfg.get('quota_burst_seconds', 1)
+# Seconds and maximum number of channels for which the status of the channels is cached by a process
+INGESTION_CHANNEL_CACHE_TTL = _ingestion_cfg.get('channel_cache_ttl', 30)
+INGESTION_CHANNEL_CACHE_SIZE = _ingestion_cfg.get('channel_cache_size', 100000)
+# Whether to reject the messages of the channels not notified by the hgw_frontend
+INGESTION_REJECT_UNKNOWN_CHANNELS = _ingestion_cfg.get('reject_unknown_channels', False)
+
+# Consecutive failures after which the connector operations on a Source are suspended
+CIRCUIT_BREAKER_FAILURE_THRESHOLD = cfg.get('circuit_breaker', {}).get('failure_threshold', 5)
+# Seconds after which a suspended Source is probed again
+CIRCUIT_BREAKER_RECOVERY_TIMEOUT = cfg.get('circuit_breaker', {}).get('recovery_timeout', 60)
+
+_retry_cfg = cfg.get('failed_connector_retry', {})
+# Number of failed connector operations claimed at once by the retry scheduler
+FAILED_CONNECTOR_RETRY_BATCH_SIZE = _retry_cfg.get('batch_size', 100)
+# Number of Sources contacted concurrently by the retry scheduler
+FAILED_CONNECTOR_RETRY_WORKERS = _retry_cfg.get('workers', 8)
+# Delay in seconds before the first retry. It is doubled at every attempt up to the max delay
+FAILED_CONNECTOR_RETRY_BASE_DELAY = _retry_cfg.get('base_delay', 30)
+FAILED_CONNECTOR_RETRY_MAX_DELAY = _retry_cfg.get('max_delay', 3600)
+# Attempts after which a failed connector operation is not retried anymore
+FAILED_CONNECTOR_RETRY_MAX_ATTEMPTS = _retry_cfg.get('max_attempts', 10)
+# Seconds a claimed operation is reserved to a scheduler before other schedulers can claim it again
+FAILED_CONNECTOR_RETRY_LEASE = _retry_cfg.get('lease', 300)
@@ -4,8 +4,7 @@ from django.dispatch import Signal
 
 from hgw_backend.settings import (KAFKA_CONNECTOR_NOTIFICATION_TOPIC,
                                   KAFKA_SOURCE_NOTIFICATION_TOPIC)
-from hgw_common.messaging.sender import create_sender
-from hgw_common.utils import create_broker_parameters_from_settings
+from hgw_common.utils.outbox import enqueue
 
 logger = logging.getLogger('hgw_backend.signals')
 
@@ -15,7 +14,7 @@ connector_created = Signal(providing_args=['connector'])
 def source_saved_handler(sender, instance, **kwargs):
     """
     Post save signal handler for Source model.
-    It sends new Source data to kafka
+    It saves the new Source data in the outbox, to be sent to kafka
     """
     message = {
         'source_id': instance.source_id,
@@ -27,18 +26,16 @@ def source_saved_handler(sender, instance, **kwargs):
         }
     }
 
-    sender = create_sender(create_broker_parameters_from_settings())
-    if sender.send(KAFKA_SOURCE_NOTIFICATION_TOPIC, message):
-        logger.info("Souce notified correctly")
+    enqueue(KAFKA_SOURCE_NOTIFICATION_TOPIC, message)
+    logger.info("Source queued for notification")
 
 
 def connector_created_handler(connector, **kwargs):
     """
-    Handler for signal create_connector. It notifies the correct operation
+    Handler for signal create_connector. It saves the notification of the correct operation in the outbox
     """
     message = {
         'channel_id': connector['channel_id']
     }
-    sender = create_sender(create_broker_parameters_from_settings())
-    if sender.send(KAFKA_CONNECTOR_NOTIFICATION_TOPIC, message):
-        logger.info("Connector notified correctly")
+    enqueue(KAFKA_CONNECTOR_NOTIFICATION_TOPIC, message)
+    logger.info("Connector queued for notification")
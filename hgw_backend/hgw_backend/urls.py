@@ -33,4 +33,6 @@ urlpatterns = [
     path(r'{}/sources/<str:source_id>/'.format(VERSION_REGEX), views.Sources.as_view({'get': 'retrieve'})),
     path(r'{}/profiles/'.format(VERSION_REGEX), views.Profiles.as_view({'get': 'list'})),
     path(r'{}/messages/'.format(VERSION_REGEX), views.Messages.as_view()),
+    path(r'{}/messages/raw/'.format(VERSION_REGEX), views.RawMessages.as_view()),
+    path(r'{}/messages/bulk/'.format(VERSION_REGEX), views.BulkMessages.as_view()),
 ] + static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)
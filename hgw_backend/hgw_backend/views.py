@@ -16,24 +16,30 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 
 import logging
+import math
+import time
 
+from django.conf import settings
 from django.core.files.uploadedfile import InMemoryUploadedFile
+from django.db import DatabaseError
 from django.http import Http404, HttpResponse
 from rest_framework import status
+from rest_framework.exceptions import ParseError, UnsupportedMediaType
 from rest_framework.parsers import MultiPartParser
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework.viewsets import ViewSet
 
 from hgw_common.cipher import is_encrypted
-from hgw_common.messaging.sender import create_sender
-from hgw_common.messaging.serializer import RawSerializer
 from hgw_common.models import Profile
 from hgw_common.serializers import ProfileSerializer
-from hgw_common.utils import create_broker_parameters_from_settings
 from hgw_common.utils.authorization import TokenHasResourceDetailedScope
 
+from .ingestion import (admit, get_admission_controller, get_channel_cache,
+                        get_sender, record_source_usage)
 from .models import Source
+from .parsers import (FramesMessagesParser, NDJSONMessagesParser,
+                      PayloadTooLarge, RawPayloadParser)
 from .serializers import SourceSerializer
 
 logger = logging.getLogger('hgw_backend.views')
@@ -43,6 +49,17 @@ def home(request):
     return HttpResponse('<a href="/admin/">Click here to access admin page</a>')
 
 
+def _record_source_usage(source, count=1, size=0):
+    """
+    Records the usage of the Source. The messages have already been sent, so a db error is only logged: failing the
+    request would make the Source send them again
+    """
+    try:
+        record_source_usage(source, count, size)
+    except DatabaseError:
+        logger.error('Error recording the usage of Source %s: %s messages not counted', source.source_id, count)
+
+
 class Sources(ViewSet):
     permission_classes = (TokenHasResourceDetailedScope,)
     required_scopes = ['sources']
@@ -130,12 +147,155 @@ class Messages(APIView):
         except ValueError:
             return Response({'error': 'invalid_paramater: channel_id'})
 
-        topic = self._get_kafka_topic(request)
-        sender = create_sender(create_broker_parameters_from_settings(), serializer=RawSerializer)
+        return self._send(request, channel_id.decode('utf-8'), payload)
+
+    @staticmethod
+    def _too_many_requests(retry_after):
+        return Response({'error': 'too_many_requests'}, status.HTTP_429_TOO_MANY_REQUESTS,
+                        headers={'Retry-After': str(int(math.ceil(retry_after)))})
+
+    def _send(self, request, channel_id, payload):
+        source = request.auth.application.source
+        if get_channel_cache().get_inactive_channels(source, [channel_id]):
+            logger.info('Source %s sent a message for the inactive channel %s', source.name, channel_id)
+            return Response({'error': 'inactive_channel'}, status.HTTP_403_FORBIDDEN)
 
-        success = sender.send(topic, payload, key=channel_id.decode('utf-8'))
+        sender = get_sender()
+        retry_after = admit(source, sender, size=len(payload))
+        if retry_after is not None:
+            return self._too_many_requests(retry_after)
+        success, start = False, time.monotonic()
+        try:
+            success = sender.send(self._get_kafka_topic(request), payload, key=channel_id)
+        finally:
+            get_admission_controller().release(sent=success is not False, elapsed=time.monotonic() - start)
         if success is False:
             logger.error('Cannot connect to kafka')
             return Response({'error': 'cannot_send_message'}, status.HTTP_500_INTERNAL_SERVER_ERROR)
-        
+
+        _record_source_usage(source, size=len(payload))
         return Response({}, 200)
+
+
+class RawMessages(Messages):
+    """
+    View for /messages/raw/ REST API. The payload is the body of the request, sent with content type
+    application/octet-stream, and it is not parsed. The channel_id is sent in the X-Channel-Id header or
+    in the query string
+    """
+    parser_classes = (RawPayloadParser,)
+
+    def handle_exception(self, exc):
+        # the body can be parsed also during the authentication, so the parsing errors are handled here
+        if isinstance(exc, PayloadTooLarge):
+            return Response({'error': 'payload_too_large'}, status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+        if isinstance(exc, UnsupportedMediaType):
+            return Response({'error': 'unsupported_media_type'}, status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
+        if isinstance(exc, ParseError):
+            return Response({'error': 'malformed_body'}, status.HTTP_400_BAD_REQUEST)
+        return super(RawMessages, self).handle_exception(exc)
+
+    def post(self, request):
+        """
+        Create a message
+        """
+        channel_id = request.META.get('HTTP_X_CHANNEL_ID') or request.query_params.get('channel_id')
+        if not channel_id:
+            logger.debug('Missing channel_id in request')
+            return Response({'error': 'missing_parameters'}, status.HTTP_400_BAD_REQUEST)
+
+        payload = request.data
+        if not payload:
+            logger.debug('Missing payload in request')
+            return Response({'error': 'missing_parameters'}, status.HTTP_400_BAD_REQUEST)
+
+        if not is_encrypted(payload):
+            logger.info('Source %s sent an unencrypted message', self.request.auth.application.source.name)
+            return Response({'error': 'not_encrypted_payload'}, status.HTTP_400_BAD_REQUEST)
+
+        return self._send(request, channel_id, payload)
+
+
+class BulkMessages(RawMessages):
+    """
+    View for /messages/bulk/ REST API. It creates many messages with a single request. The messages are sent as
+    newline delimited json or as binary frames and they are sent to the broker without waiting for the ack of
+    every message
+    """
+    parser_classes = (NDJSONMessagesParser, FramesMessagesParser)
+
+    @staticmethod
+    def _validate(message):
+        if 'error' in message:
+            return message['error']
+        if not isinstance(message['channel_id'], str) or not message['channel_id'] or not message['payload']:
+            return 'missing_parameters'
+        if len(message['payload']) > settings.MESSAGES_MAX_SIZE:
+            return 'payload_too_large'
+        if not is_encrypted(message['payload']):
+            return 'not_encrypted_payload'
+        return None
+
+    def post(self, request):
+        """
+        Create the messages. It returns a list with the outcome of every message, in the same order of the input
+        """
+        messages = request.data
+        if not messages:
+            logger.debug('Missing messages in request')
+            return Response({'error': 'missing_parameters'}, status.HTTP_400_BAD_REQUEST)
+        if len(messages) > settings.MESSAGES_BULK_MAX_ITEMS:
+            return Response({'error': 'too_many_messages'}, status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+
+        results = []
+        to_send = []
+        for message in messages:
+            error = self._validate(message)
+            if error is None:
+                results.append({'channel_id': message['channel_id'], 'success': True})
+                to_send.append((len(results) - 1, message))
+            else:
+                results.append({'channel_id': message.get('channel_id'), 'success': False, 'error': error})
+
+        source = request.auth.application.source
+        inactive_channels = get_channel_cache().get_inactive_channels(
+            source, [message['channel_id'] for _, message in to_send])
+        if inactive_channels:
+            for index, _ in to_send:
+                if results[index]['channel_id'] in inactive_channels:
+                    results[index].update({'success': False, 'error': 'inactive_channel'})
+            to_send = [(index, message) for index, message in to_send if results[index]['success']]
+
+        if len(to_send) < len(messages):
+            logger.info('Source %s sent %s invalid messages', source.name, len(messages) - len(to_send))
+
+        if to_send:
+            sender = get_sender()
+            retry_after = admit(source, sender, len(to_send), sum(len(message['payload']) for _, message in to_send))
+            if retry_after is not None:
+                return self._too_many_requests(retry_after)
+            outcomes, start = [], time.monotonic()
+            try:
+                outcomes = sender.send_many(self._get_kafka_topic(request),
+                                            [(message['channel_id'], message['payload']) for _, message in to_send])
+            finally:
+                get_admission_controller().release(len(to_send), sent=bool(outcomes) and all(outcomes),
+                                                   elapsed=time.monotonic() - start)
+            sent_count, sent_size = 0, 0
+            for (index, message), sent in zip(to_send, outcomes):
+                if sent:
+                    sent_count += 1
+                    sent_size += len(message['payload'])
+                else:
+                    results[index].update({'success': False, 'error': 'cannot_send_message'})
+            if sent_count:
+                _record_source_usage(source, sent_count, sent_size)
+
+        if any(result['success'] for result in results):
+            status_code = status.HTTP_200_OK
+        elif any(result.get('error') == 'cannot_send_message' for result in results):
+            logger.error('Cannot connect to kafka')
+            status_code = status.HTTP_500_INTERNAL_SERVER_ERROR
+        else:
+            status_code = status.HTTP_400_BAD_REQUEST
+        return Response(results, status_code)
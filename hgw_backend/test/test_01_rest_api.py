@@ -15,21 +15,25 @@
 # DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 
+import base64
+import itertools
 import json
 import os
 import sys
 from ssl import SSLError
 
 from Cryptodome.PublicKey import RSA
+from django.db import DatabaseError
 from kafka.errors import (KafkaError, KafkaTimeoutError, NoBrokersAvailable,
                           TopicAuthorizationFailedError)
 from mock import patch, MagicMock
 from oauth2_provider.settings import oauth2_settings
 
-from hgw_backend import settings
-from hgw_backend.models import RESTClient
+from hgw_backend import ingestion, settings
+from hgw_backend.models import Channel, RESTClient, SourceUsage
 from hgw_backend.serializers import SourceSerializer
 from hgw_common.cipher import Cipher
+from hgw_common.messaging.frames import FRAME_CONTENT_TYPE, pack_frame
 from hgw_common.utils import ERRORS
 
 from . import (HGW_FRONTEND_CLIENT_NAME, SOURCE_ENDPOINT_CLIENT_NAME,
@@ -213,6 +217,7 @@ class TestMessagesAPI(GenericTestCase):
 
     def setUp(self):
         self.encrypter = Cipher(public_key=RSA.importKey(DEST_PUBLIC_KEY))
+        ingestion.reset()
 
     def test_send_message_bytes(self):
         """
@@ -414,3 +419,420 @@ class TestMessagesAPI(GenericTestCase):
             res = self.client.post('/v1/messages/', data=data, **oauth2_header)
             self.assertEqual(res.status_code, 500)
             self.assertEqual(res.json(), {'error': 'cannot_send_message'})
+
+    def test_send_raw_message(self):
+        """
+        Tests sending a message as raw bytes, with the channel_id in the header or in the query string
+        """
+        payload = self.encrypter.encrypt('payload')
+        oauth2_header = self._get_oauth_header()
+        source_id = RESTClient.objects.get(pk=1).source.source_id
+        for url, headers in (('/v1/messages/raw/', {'HTTP_X_CHANNEL_ID': 'channel_id'}),
+                             ('/v1/messages/raw/?channel_id=channel_id', {})):
+            ingestion.reset()
+            with patch('hgw_common.messaging.sender.KafkaProducer') as MockKP:
+                res = self.client.post(url, data=payload, content_type='application/octet-stream',
+                                       **headers, **oauth2_header)
+                self.assertEqual(res.status_code, 200)
+                self.assertEqual(res.json(), {})
+                self.assertEqual(MockKP().send.call_args_list[0][0][0], source_id)
+                self.assertEqual(MockKP().send.call_args_list[0][1]['key'], b'channel_id')
+                self.assertEqual(MockKP().send.call_args_list[0][1]['value'], payload)
+
+    def test_send_raw_message_missing_parameters(self):
+        """
+        Tests that the channel_id and the payload are required
+        """
+        oauth2_header = self._get_oauth_header()
+        res = self.client.post('/v1/messages/raw/', data=self.encrypter.encrypt('payload'),
+                               content_type='application/octet-stream', **oauth2_header)
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(res.json(), {'error': 'missing_parameters'})
+
+        res = self.client.post('/v1/messages/raw/', data=b'', content_type='application/octet-stream',
+                               HTTP_X_CHANNEL_ID='channel_id', **oauth2_header)
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(res.json(), {'error': 'missing_parameters'})
+
+    def test_send_raw_message_not_encrypted(self):
+        oauth2_header = self._get_oauth_header()
+        res = self.client.post('/v1/messages/raw/', data=b'not_encrypted_payload',
+                               content_type='application/octet-stream', HTTP_X_CHANNEL_ID='channel_id',
+                               **oauth2_header)
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(res.json(), {'error': 'not_encrypted_payload'})
+
+    def test_send_raw_message_too_large(self):
+        """
+        Tests that payloads larger than the limit are rejected
+        """
+        oauth2_header = self._get_oauth_header()
+        payload = self.encrypter.encrypt('payload')
+        with self.settings(MESSAGES_MAX_SIZE=len(payload) - 1), \
+                patch('hgw_common.messaging.sender.KafkaProducer') as MockKP:
+            res = self.client.post('/v1/messages/raw/', data=payload, content_type='application/octet-stream',
+                                   HTTP_X_CHANNEL_ID='channel_id', **oauth2_header)
+            self.assertEqual(res.status_code, 413)
+            self.assertEqual(res.json(), {'error': 'payload_too_large'})
+            MockKP().send.assert_not_called()
+
+    def test_send_raw_message_wrong_content_type(self):
+        oauth2_header = self._get_oauth_header()
+        res = self.client.post('/v1/messages/raw/', data={'payload': 'payload'},
+                               HTTP_X_CHANNEL_ID='channel_id', **oauth2_header)
+        self.assertEqual(res.status_code, 415)
+        self.assertEqual(res.json(), {'error': 'unsupported_media_type'})
+
+    def test_send_raw_message_no_broker_available(self):
+        oauth2_header = self._get_oauth_header()
+        with patch('hgw_common.messaging.sender.KafkaProducer') as MockKP:
+            MockKP.side_effect = NoBrokersAvailable
+            res = self.client.post('/v1/messages/raw/', data=self.encrypter.encrypt('payload'),
+                                   content_type='application/octet-stream', HTTP_X_CHANNEL_ID='channel_id',
+                                   **oauth2_header)
+            self.assertEqual(res.status_code, 500)
+            self.assertEqual(res.json(), {'error': 'cannot_send_message'})
+
+    def _get_ndjson(self, messages):
+        return b'\n'.join(json.dumps({'channel_id': channel_id, 'payload': base64.b64encode(payload).decode('ascii')})
+                          .encode('utf-8') for channel_id, payload in messages)
+
+    def test_send_bulk_messages(self):
+        """
+        Tests sending many messages as ndjson and as binary frames
+        """
+        messages = [('channel_{}'.format(i), self.encrypter.encrypt('payload_{}'.format(i))) for i in range(3)]
+        oauth2_header = self._get_oauth_header()
+        source_id = RESTClient.objects.get(pk=1).source.source_id
+        for content_type, body in (('application/x-ndjson', self._get_ndjson(messages)),
+                                   (FRAME_CONTENT_TYPE, b''.join(pack_frame({'channel_id': channel_id}, payload)
+                                                                 for channel_id, payload in messages))):
+            ingestion.reset()
+            with patch('hgw_common.messaging.sender.KafkaProducer') as MockKP:
+                res = self.client.post('/v1/messages/bulk/', data=body, content_type=content_type,
+                                       **oauth2_header)
+                self.assertEqual(res.status_code, 200)
+                self.assertEqual(res.json(), [{'channel_id': channel_id, 'success': True}
+                                              for channel_id, _ in messages])
+                self.assertEqual(MockKP().send.call_count, 3)
+                # the messages are sent without waiting for the acks
+                MockKP().flush.assert_called_once()
+                for i, (channel_id, payload) in enumerate(messages):
+                    self.assertEqual(MockKP().send.call_args_list[i][0][0], source_id)
+                    self.assertEqual(MockKP().send.call_args_list[i][1]['key'], channel_id.encode('utf-8'))
+                    self.assertEqual(MockKP().send.call_args_list[i][1]['value'], payload)
+
+    def test_send_bulk_messages_invalid_items(self):
+        """
+        Tests that the invalid messages are reported and the valid ones are sent
+        """
+        payload = self.encrypter.encrypt('payload')
+        body = b'\n'.join((self._get_ndjson([('channel_1', payload)]),
+                           self._get_ndjson([('channel_2', b'not_encrypted_payload')]),
+                           b'{"channel_id": "channel_3"}',
+                           b'not json',
+                           self._get_ndjson([('', payload)])))
+        oauth2_header = self._get_oauth_header()
+        with patch('hgw_common.messaging.sender.KafkaProducer') as MockKP:
+            res = self.client.post('/v1/messages/bulk/', data=body, content_type='application/x-ndjson',
+                                   **oauth2_header)
+            self.assertEqual(res.status_code, 200)
+            self.assertEqual(res.json(), [
+                {'channel_id': 'channel_1', 'success': True},
+                {'channel_id': 'channel_2', 'success': False, 'error': 'not_encrypted_payload'},
+                {'channel_id': None, 'success': False, 'error': 'invalid_item'},
+                {'channel_id': None, 'success': False, 'error': 'invalid_item'},
+                {'channel_id': '', 'success': False, 'error': 'missing_parameters'},
+            ])
+            self.assertEqual(MockKP().send.call_count, 1)
+
+        res = self.client.post('/v1/messages/bulk/', data=self._get_ndjson([('channel_1', b'not_encrypted')]),
+                               content_type='application/x-ndjson', **oauth2_header)
+        self.assertEqual(res.status_code, 400)
+
+    def test_send_bulk_messages_limits(self):
+        """
+        Tests the limits on the size of the request and on the number of messages
+        """
+        messages = [('channel_{}'.format(i), self.encrypter.encrypt('payload')) for i in range(3)]
+        body = self._get_ndjson(messages)
+        oauth2_header = self._get_oauth_header()
+        with self.settings(MESSAGES_BULK_MAX_ITEMS=2):
+            res = self.client.post('/v1/messages/bulk/', data=body, content_type='application/x-ndjson',
+                                   **oauth2_header)
+            self.assertEqual(res.status_code, 413)
+            self.assertEqual(res.json(), {'error': 'too_many_messages'})
+        with self.settings(MESSAGES_BULK_MAX_SIZE=len(body) - 1):
+            res = self.client.post('/v1/messages/bulk/', data=body, content_type='application/x-ndjson',
+                                   **oauth2_header)
+            self.assertEqual(res.status_code, 413)
+            self.assertEqual(res.json(), {'error': 'payload_too_large'})
+
+    def test_send_bulk_messages_truncated_frames(self):
+        oauth2_header = self._get_oauth_header()
+        body = pack_frame({'channel_id': 'channel_1'}, self.encrypter.encrypt('payload'))
+        res = self.client.post('/v1/messages/bulk/', data=body[:-1], content_type=FRAME_CONTENT_TYPE,
+                               **oauth2_header)
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(res.json(), {'error': 'malformed_body'})
+
+    def test_send_bulk_messages_kafka_error(self):
+        """
+        Tests that the messages that cannot be sent are reported
+        """
+        messages = [('channel_{}'.format(i), self.encrypter.encrypt('payload')) for i in range(2)]
+        oauth2_header = self._get_oauth_header()
+        with patch('hgw_common.messaging.sender.KafkaProducer') as MockKP:
+            failed_future = MagicMock()
+            failed_future.get.side_effect = KafkaError
+            MockKP().send.side_effect = [MagicMock(), failed_future]
+            res = self.client.post('/v1/messages/bulk/', data=self._get_ndjson(messages),
+                                   content_type='application/x-ndjson', **oauth2_header)
+            self.assertEqual(res.status_code, 200)
+            self.assertEqual(res.json(), [{'channel_id': 'channel_0', 'success': True},
+                                          {'channel_id': 'channel_1', 'success': False,
+                                           'error': 'cannot_send_message'}])
+
+        ingestion.reset()
+        with patch('hgw_common.messaging.sender.KafkaProducer') as MockKP:
+            MockKP.side_effect = NoBrokersAvailable
+            res = self.client.post('/v1/messages/bulk/', data=self._get_ndjson(messages),
+                                   content_type='application/x-ndjson', **oauth2_header)
+            self.assertEqual(res.status_code, 500)
+
+    def test_send_message_source_rate_limit(self):
+        """
+        Tests that, when the Source exceeds its rate, the messages are rejected with 429 and Retry-After
+        """
+        payload = self.encrypter.encrypt('payload')
+        oauth2_header = self._get_oauth_header()
+        with self.settings(INGESTION_SOURCE_RATE=0.5, INGESTION_SOURCE_BURST=2), \
+                patch('hgw_common.messaging.sender.KafkaProducer') as MockKP:
+            for _ in range(2):
+                res = self.client.post('/v1/messages/raw/', data=payload, content_type='application/octet-stream',
+                                       HTTP_X_CHANNEL_ID='channel_id', **oauth2_header)
+                self.assertEqual(res.status_code, 200)
+            res = self.client.post('/v1/messages/raw/', data=payload, content_type='application/octet-stream',
+                                   HTTP_X_CHANNEL_ID='channel_id', **oauth2_header)
+            self.assertEqual(res.status_code, 429)
+            self.assertEqual(res.json(), {'error': 'too_many_requests'})
+            self.assertEqual(res['Retry-After'], '2')
+            self.assertEqual(MockKP().send.call_count, 2)
+
+            # bulk requests consume a token for every message
+            res = self.client.post('/v1/messages/bulk/',
+                                   data=self._get_ndjson([('channel_id', payload)] * 2),
+                                   content_type='application/x-ndjson', **oauth2_header)
+            self.assertEqual(res.status_code, 429)
+            self.assertEqual(res['Retry-After'], '4')
+
+    def test_send_message_broker_overloaded(self):
+        """
+        Tests that, when the producer buffer is almost full or too many messages are being sent,
+        the messages are rejected with 429 and Retry-After
+        """
+        data = {
+            'channel_id': 'channel_id',
+            'payload': self.encrypter.encrypt('payload')
+        }
+        oauth2_header = self._get_oauth_header()
+        with self.settings(INGESTION_MAX_BUFFER_USAGE=0.8, INGESTION_RETRY_AFTER=3), \
+                patch('hgw_common.messaging.sender.KafkaProducer') as MockKP, \
+                patch('hgw_common.messaging.sender.KafkaSender.get_buffer_usage', return_value=0.9):
+            res = self.client.post('/v1/messages/', data=data, **oauth2_header)
+            self.assertEqual(res.status_code, 429)
+            self.assertEqual(res['Retry-After'], '3')
+            MockKP().send.assert_not_called()
+
+        ingestion.reset()
+        with self.settings(INGESTION_MAX_IN_FLIGHT=10), \
+                patch('hgw_common.messaging.sender.KafkaProducer') as MockKP:
+            admission_controller = ingestion.get_admission_controller()
+            admission_controller.in_flight = 10
+            res = self.client.post('/v1/messages/', data=data, **oauth2_header)
+            self.assertEqual(res.status_code, 429)
+            MockKP().send.assert_not_called()
+
+            admission_controller.in_flight = 9
+            res = self.client.post('/v1/messages/', data=data, **oauth2_header)
+            self.assertEqual(res.status_code, 200)
+            self.assertEqual(admission_controller.in_flight, 9)
+
+    def test_send_message_broker_failing(self):
+        """
+        Tests that, after some consecutive requests failed or acked too slowly by the broker, the messages are
+        rejected with 429 without waiting for the broker, until a probe request succeeds
+        """
+        data = {
+            'channel_id': 'channel_id',
+            'payload': self.encrypter.encrypt('payload')
+        }
+        oauth2_header = self._get_oauth_header()
+        with self.settings(INGESTION_BROKER_FAILURE_THRESHOLD=2, INGESTION_BROKER_RECOVERY_TIMEOUT=60,
+                           INGESTION_RETRY_AFTER=3), \
+                patch('hgw_common.messaging.sender.KafkaProducer') as MockKP:
+            MockKP().send().get.side_effect = KafkaTimeoutError
+            MockKP().send.reset_mock()
+            for _ in range(2):
+                res = self.client.post('/v1/messages/', data=data, **oauth2_header)
+                self.assertEqual(res.status_code, 500)
+            res = self.client.post('/v1/messages/', data=data, **oauth2_header)
+            self.assertEqual(res.status_code, 429)
+            self.assertEqual(res['Retry-After'], '3')
+            self.assertEqual(MockKP().send.call_count, 2)
+            self.assertEqual(ingestion.get_admission_controller().in_flight, 0)
+
+        # the slow acks count as failures
+        ingestion.reset()
+        with self.settings(INGESTION_BROKER_FAILURE_THRESHOLD=1, INGESTION_BROKER_MAX_LATENCY=1), \
+                patch('hgw_common.messaging.sender.KafkaProducer') as MockKP, \
+                patch('hgw_backend.views.time.monotonic', side_effect=itertools.count(step=2)):
+            res = self.client.post('/v1/messages/', data=data, **oauth2_header)
+            self.assertEqual(res.status_code, 200)
+            res = self.client.post('/v1/messages/bulk/', data=self._get_ndjson([('channel_id', data['payload'])]),
+                                   content_type='application/x-ndjson', **oauth2_header)
+            self.assertEqual(res.status_code, 429)
+            self.assertEqual(MockKP().send.call_count, 1)
+
+        # after the recovery timeout a probe is let through and its success closes the breaker
+        ingestion.reset()
+        with self.settings(INGESTION_BROKER_FAILURE_THRESHOLD=1, INGESTION_BROKER_RECOVERY_TIMEOUT=0), \
+                patch('hgw_common.messaging.sender.KafkaProducer') as MockKP:
+            ingestion.get_admission_controller().broker_breaker.record_failure()
+            for _ in range(2):
+                res = self.client.post('/v1/messages/', data=data, **oauth2_header)
+                self.assertEqual(res.status_code, 200)
+            self.assertEqual(ingestion.get_admission_controller().broker_breaker.state, 'CLOSED')
+
+    def test_send_message_source_quota(self):
+        """
+        Tests that the messages exceeding the quotas of the Source are rejected with 429 and that the usage of the
+        Source is counted
+        """
+        source = RESTClient.objects.get(name=SOURCE_ENDPOINT_CLIENT_NAME).source
+        source.max_messages_per_second = 2
+        source.save()
+        payload = self.encrypter.encrypt('payload')
+        oauth2_header = self._get_oauth_header()
+        with patch('hgw_common.messaging.sender.KafkaProducer') as MockKP:
+            for _ in range(2):
+                res = self.client.post('/v1/messages/raw/', data=payload, content_type='application/octet-stream',
+                                       HTTP_X_CHANNEL_ID='channel_id', **oauth2_header)
+                self.assertEqual(res.status_code, 200)
+            res = self.client.post('/v1/messages/raw/', data=payload, content_type='application/octet-stream',
+                                   HTTP_X_CHANNEL_ID='channel_id', **oauth2_header)
+            self.assertEqual(res.status_code, 429)
+            self.assertEqual(res.json(), {'error': 'too_many_requests'})
+            self.assertEqual(res['Retry-After'], '1')
+            self.assertEqual(MockKP().send.call_count, 2)
+            # the rejected messages don't count as in flight
+            self.assertEqual(ingestion.get_admission_controller().in_flight, 0)
+
+        usage = SourceUsage.objects.get(source=source)
+        self.assertEqual(usage.messages, 2)
+        self.assertEqual(usage.bytes, 2 * len(payload))
+        self.assertEqual(usage.rejected_messages, 1)
+
+        # the bytes quota is enforced on the size of the payloads
+        source.max_messages_per_second = None
+        source.max_bytes_per_second = len(payload) * 3
+        source.save()
+        ingestion.reset()
+        with patch('hgw_common.messaging.sender.KafkaProducer') as MockKP:
+            res = self.client.post('/v1/messages/bulk/',
+                                   data=self._get_ndjson([('channel_id', payload)] * 3),
+                                   content_type='application/x-ndjson', **oauth2_header)
+            self.assertEqual(res.status_code, 200)
+            res = self.client.post('/v1/messages/bulk/',
+                                   data=self._get_ndjson([('channel_id', payload)] * 2),
+                                   content_type='application/x-ndjson', **oauth2_header)
+            self.assertEqual(res.status_code, 429)
+
+        usage.refresh_from_db()
+        self.assertEqual(usage.messages, 5)
+        self.assertEqual(usage.bytes, 5 * len(payload))
+        self.assertEqual(usage.rejected_messages, 3)
+
+    def test_send_message_source_quota_db_error(self):
+        """
+        Tests that the messages are admitted when the quotas cannot be read from the db, and that the admitted
+        messages are released when the quota check raises an unexpected error
+        """
+        source = RESTClient.objects.get(name=SOURCE_ENDPOINT_CLIENT_NAME).source
+        source.max_messages_per_second = 2
+        source.save()
+        payload = self.encrypter.encrypt('payload')
+        oauth2_header = self._get_oauth_header()
+        with patch('hgw_common.messaging.sender.KafkaProducer') as MockKP, \
+                patch('hgw_backend.ingestion.acquire_source_quota', side_effect=DatabaseError):
+            res = self.client.post('/v1/messages/raw/', data=payload, content_type='application/octet-stream',
+                                   HTTP_X_CHANNEL_ID='channel_id', **oauth2_header)
+            self.assertEqual(res.status_code, 200)
+            self.assertEqual(MockKP().send.call_count, 1)
+            self.assertEqual(ingestion.get_admission_controller().in_flight, 0)
+
+        with patch('hgw_common.messaging.sender.KafkaProducer'), \
+                patch('hgw_backend.ingestion.acquire_source_quota', side_effect=RuntimeError):
+            self.assertRaises(RuntimeError, ingestion.admit, source,
+                              MagicMock(**{'get_buffer_usage.return_value': None}), 3)
+            self.assertEqual(ingestion.get_admission_controller().in_flight, 0)
+
+    def test_send_message_usage_db_error(self):
+        """
+        Tests that the messages sent are acknowledged even if their usage cannot be recorded in the db
+        """
+        payload = self.encrypter.encrypt('payload')
+        oauth2_header = self._get_oauth_header()
+        with patch('hgw_common.messaging.sender.KafkaProducer') as MockKP, \
+                patch('hgw_backend.views.record_source_usage', side_effect=DatabaseError):
+            res = self.client.post('/v1/messages/raw/', data=payload, content_type='application/octet-stream',
+                                   HTTP_X_CHANNEL_ID='channel_id', **oauth2_header)
+            self.assertEqual(res.status_code, 200)
+            res = self.client.post('/v1/messages/bulk/',
+                                   data=self._get_ndjson([('channel_id', payload)] * 2),
+                                   content_type='application/x-ndjson', **oauth2_header)
+            self.assertEqual(res.status_code, 200)
+            self.assertEqual(MockKP().send.call_count, 3)
+
+    def test_send_message_inactive_channel(self):
+        """
+        Tests that the messages for the revoked channels are rejected without sending them to kafka
+        """
+        source = RESTClient.objects.get(name=SOURCE_ENDPOINT_CLIENT_NAME).source
+        Channel.objects.create(source=source, channel_id='active_channel', active=True)
+        Channel.objects.create(source=source, channel_id='revoked_channel', active=False)
+        payload = self.encrypter.encrypt('payload')
+        oauth2_header = self._get_oauth_header()
+        with patch('hgw_common.messaging.sender.KafkaProducer') as MockKP:
+            res = self.client.post('/v1/messages/raw/', data=payload, content_type='application/octet-stream',
+                                   HTTP_X_CHANNEL_ID='revoked_channel', **oauth2_header)
+            self.assertEqual(res.status_code, 403)
+            self.assertEqual(res.json(), {'error': 'inactive_channel'})
+            MockKP().send.assert_not_called()
+
+            res = self.client.post('/v1/messages/bulk/',
+                                   data=self._get_ndjson([('active_channel', payload), ('revoked_channel', payload),
+                                                          ('unknown_channel', payload)]),
+                                   content_type='application/x-ndjson', **oauth2_header)
+            self.assertEqual(res.status_code, 200)
+            self.assertEqual(res.json(), [{'channel_id': 'active_channel', 'success': True},
+                                          {'channel_id': 'revoked_channel', 'success': False,
+                                           'error': 'inactive_channel'},
+                                          {'channel_id': 'unknown_channel', 'success': True}])
+            self.assertEqual(MockKP().send.call_count, 2)
+
+        # the status of the channels is cached
+        Channel.objects.filter(channel_id='active_channel').update(active=False)
+        with patch('hgw_common.messaging.sender.KafkaProducer') as MockKP:
+            res = self.client.post('/v1/messages/raw/', data=payload, content_type='application/octet-stream',
+                                   HTTP_X_CHANNEL_ID='active_channel', **oauth2_header)
+            self.assertEqual(res.status_code, 200)
+
+        ingestion.reset()
+        with self.settings(INGESTION_REJECT_UNKNOWN_CHANNELS=True), \
+                patch('hgw_common.messaging.sender.KafkaProducer') as MockKP:
+            for channel_id in ('active_channel', 'unknown_channel'):
+                res = self.client.post('/v1/messages/raw/', data=payload, content_type='application/octet-stream',
+                                       HTTP_X_CHANNEL_ID=channel_id, **oauth2_header)
+                self.assertEqual(res.status_code, 403)
+            MockKP().send.assert_not_called()
@@ -2,11 +2,13 @@ import json
 import logging
 import os
 
+from django.db import DatabaseError
 from django.test import TestCase
 from mock.mock import call, patch
 
+from hgw_backend.circuit_breaker import get_circuit_breaker, reset_circuit_breakers
 from hgw_backend.management.commands.channel_consumer import Command
-from hgw_backend.models import FailedConnector, Source
+from hgw_backend.models import Channel, FailedConnector, Source
 from hgw_backend.settings import KAFKA_CHANNEL_NOTIFICATION_TOPIC
 from hgw_common.utils.mocks import MockKafkaConsumer, MockMessage
 
@@ -31,6 +33,7 @@ class TestConsumer(GenericTestCase):
     fixtures = ['test_data.json']
 
     def setUp(self):
+        reset_circuit_breakers()
         self.base_messages = [{
             'channel_id': 'KKa8QqqTBGePJStJpQMbspEvvV4LJJCY',
             'source_id': 'LD2j7v35BvUlzWDe8G89JGzz4SOincB7',
@@ -109,6 +112,8 @@ class TestConsumer(GenericTestCase):
                 }
                 calls.append(call(source_obj, connector))
             mocked_create_connector.assert_has_calls(calls)
+            # the channel is stored as active
+            self.assertTrue(Channel.objects.get(channel_id='KKa8QqqTBGePJStJpQMbspEvvV4LJJCY').active)
         
     def test_correct_connector_update(self):
         """
@@ -150,6 +155,8 @@ class TestConsumer(GenericTestCase):
                 }
                 calls.append(call(source_obj, connector))
             mocked_delete_connector.assert_has_calls(calls)
+            # the channel is stored as not active
+            self.assertFalse(Channel.objects.get(channel_id='KKa8QqqTBGePJStJpQMbspEvvV4LJJCY').active)
     
     def test_message_failure_db_error(self):
         """
@@ -177,11 +184,72 @@ class TestConsumer(GenericTestCase):
             self.set_mock_kafka_consumer(MockKafkaConsumer, self.create_messages, True)
             Command().handle()
             self.assertEqual(FailedConnector.objects.count(), 2)
-            for index, failed in enumerate(FailedConnector.objects.all()):
+            # the second message is parked since the operation of the first one on the same channel failed
+            reasons = [FailedConnector.SENDING_ERROR, FailedConnector.PENDING_OPERATION]
+            for index, failed in enumerate(FailedConnector.objects.order_by('id')):
                 self.assertEqual(json.loads(failed.message), self.create_messages[index])
-                self.assertEqual(failed.reason, FailedConnector.SENDING_ERROR)
+                self.assertEqual(failed.channel_id, self.create_messages[index]['channel_id'])
+                self.assertEqual(failed.reason, reasons[index])
                 self.assertEqual(failed.retry, True)
 
+    def test_source_circuit_breaker(self):
+        """
+        Tests that, after repeated failures, the messages for the Source are parked without contacting it and that
+        the Source is contacted again when the circuit breaker is half open
+        """
+        messages = [dict(message, channel_id='channel_{}'.format(index))
+                    for index, message in enumerate(self.create_messages * 3)]
+        with patch('hgw_common.messaging.receiver.KafkaConsumer', MockKafkaConsumer), \
+                patch('hgw_backend.circuit_breaker.time.monotonic', return_value=1000), \
+                patch('hgw_backend.models.OAuth2Authentication.create_connector',
+                      return_value=None) as mocked_create_connector:
+            circuit_breaker = get_circuit_breaker(messages[0]['source_id'])
+            circuit_breaker.failure_threshold = 2
+            self.set_mock_kafka_consumer(MockKafkaConsumer, messages, True)
+            MockKafkaConsumer.END = len(messages)
+            Command().handle()
+            self.assertEqual(mocked_create_connector.call_count, 2)
+            self.assertEqual(circuit_breaker.state, circuit_breaker.OPEN)
+            reasons = [failed.reason for failed in FailedConnector.objects.order_by('id')]
+            self.assertEqual(reasons, [FailedConnector.SENDING_ERROR] * 2 + [FailedConnector.SOURCE_UNAVAILABLE] * 4)
+            self.assertTrue(all(failed.retry for failed in FailedConnector.objects.all()))
+
+        # after the recovery timeout the Source is probed and, if the probe succeeds, the circuit is closed
+        with patch('hgw_common.messaging.receiver.KafkaConsumer', MockKafkaConsumer), \
+                patch('hgw_backend.circuit_breaker.time.monotonic',
+                      return_value=1000 + circuit_breaker.recovery_timeout), \
+                patch('hgw_backend.models.OAuth2Authentication.create_connector',
+                      return_value=True) as mocked_create_connector:
+            self.assertEqual(circuit_breaker.state, circuit_breaker.HALF_OPEN)
+            self.set_mock_kafka_consumer(MockKafkaConsumer, self.create_messages, True)
+            Command().handle()
+            self.assertEqual(mocked_create_connector.call_count, 2)
+            self.assertEqual(circuit_breaker.state, circuit_breaker.CLOSED)
+
+    def test_source_circuit_breaker_probe_error(self):
+        """
+        Tests that, when the probe of a half open circuit breaker raises an error, the failure is recorded and the
+        Source can be probed again after the recovery timeout
+        """
+        circuit_breaker = get_circuit_breaker(self.create_messages[0]['source_id'])
+        with patch('hgw_backend.circuit_breaker.time.monotonic', return_value=1000):
+            for _ in range(circuit_breaker.failure_threshold):
+                circuit_breaker.record_failure()
+
+        with patch('hgw_common.messaging.receiver.KafkaConsumer', MockKafkaConsumer), \
+                patch('hgw_backend.circuit_breaker.time.monotonic',
+                      return_value=1000 + circuit_breaker.recovery_timeout), \
+                patch('hgw_backend.models.OAuth2Authentication.create_connector', return_value=True), \
+                patch('hgw_backend.models.connector_created.send', side_effect=DatabaseError):
+            self.assertEqual(circuit_breaker.state, circuit_breaker.HALF_OPEN)
+            self.set_mock_kafka_consumer(MockKafkaConsumer, self.create_messages, True)
+            self.assertRaises(DatabaseError, Command().handle)
+            self.assertEqual(circuit_breaker.state, circuit_breaker.OPEN)
+
+        with patch('hgw_backend.circuit_breaker.time.monotonic',
+                   return_value=1000 + 2 * circuit_breaker.recovery_timeout):
+            self.assertTrue(circuit_breaker.allow_request())
+
     def test_consume_message_fail_to_json_decode(self):
         """
         Tests failure because of json decode
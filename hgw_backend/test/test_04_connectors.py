@@ -5,13 +5,16 @@ from datetime import datetime, timedelta
 from test.utils import EXPIRED_CONSENT_CHANNEL, MockSourceEndpointHandler
 
 from django.contrib.contenttypes.models import ContentType
+from django.core.management import call_command
 from django.test import TestCase, client
 from mock import MagicMock, patch
+from requests.exceptions import ConnectionError, ReadTimeout
 from mock.mock import call
 
-from hgw_backend.models import (AccessToken, FailedConnector,
-                                OAuth2Authentication, Source)
+from hgw_backend.models import (AccessToken, CertificatesAuthentication,
+                                FailedConnector, OAuth2Authentication, Source)
 from hgw_backend.settings import KAFKA_CONNECTOR_NOTIFICATION_TOPIC
+from hgw_common.models import OutboxMessage
 from hgw_common.utils.mocks import (MockMessage, start_mock_server,
                                     stop_mock_server)
 
@@ -89,6 +92,10 @@ class TestConnectorCreation(TestCase):
         stop_mock_server(cls.cert_thread, cls.cert_server)
         return super().tearDownClass()
 
+    def setUp(self):
+        # removes the notifications of the Sources loaded from the fixtures
+        OutboxMessage.objects.all().delete()
+
     @staticmethod
     def _get_source_from_auth_obj(auth):
         content_type = ContentType.objects.get_for_model(auth)
@@ -103,6 +110,40 @@ class TestConnectorCreation(TestCase):
                                                  value=json.dumps(CHANNEL_MESSAGE).encode('utf-8')) for i in
                                   range(mock_kc_klass.FIRST, mock_kc_klass.END)}
 
+    def test_certificates_source_connector(self):
+        """
+        Tests that the connector operations of a Source authenticated with certificates return the response of the
+        Source and that the creation of the connector is notified
+        """
+        auth = CertificatesAuthentication.objects.first()
+        source = self._get_source_from_auth_obj(auth)
+        for m, status_code in (('create_connector', 201), ('update_connector', 200), ('delete_connector', 200)):
+            OutboxMessage.objects.all().delete()
+            with patch('hgw_backend.models.get_http_client') as mocked_http_client:
+                mocked_http_client().request.return_value = MagicMock(status_code=status_code)
+                res = getattr(source, m)(CONNECTOR)
+                self.assertIs(res, mocked_http_client().request.return_value)
+                args, kwargs = mocked_http_client().request.call_args
+                self.assertEqual(args, ({'create_connector': 'post', 'update_connector': 'put',
+                                         'delete_connector': 'delete'}[m], source.url))
+                self.assertEqual(kwargs['json'], CONNECTOR)
+                self.assertEqual(kwargs['cert'], (auth.cert.path, auth.key.path))
+            self.assertEqual(OutboxMessage.objects.count(), 1 if m == 'create_connector' else 0)
+
+    def test_certificates_source_connector_fails(self):
+        """
+        Tests that the connector operations of a Source authenticated with certificates return None when the Source
+        is unreachable, times out or answers with an error, and that the creation of the connector is not notified
+        """
+        auth = CertificatesAuthentication.objects.first()
+        source = self._get_source_from_auth_obj(auth)
+        for side_effect in (ConnectionError, ReadTimeout, [MagicMock(status_code=500)]):
+            for m in ('create_connector', 'update_connector', 'delete_connector'):
+                with patch('hgw_backend.models.get_http_client') as mocked_http_client:
+                    mocked_http_client().request.side_effect = side_effect
+                    self.assertIsNone(getattr(source, m)(CONNECTOR))
+        self.assertEqual(OutboxMessage.objects.count(), 0)
+
     def test_oauth2_source_fails_connector_unreachable(self):
         """
         Tests creation of new connector failure because of source endpoint unreachable whne calling /v1/connectors
@@ -274,6 +315,9 @@ class TestConnectorCreation(TestCase):
                 self.assertIsNotNone(res)
                 token.delete()
                 if m == 'create_connector':
+                    # the notification is sent by the outbox relay
+                    MockKafkaProducer().send.assert_not_called()
+                    call_command('relay_outbox', '--once')
                     MockKafkaProducer().send.assert_called_once()
                     self.assertEqual(MockKafkaProducer().send.call_args_list[0][0][0], KAFKA_CONNECTOR_NOTIFICATION_TOPIC)
                     self.assertEqual(json.loads(MockKafkaProducer().send.call_args_list[0][1]['value'].decode('utf-8')),
@@ -300,6 +344,9 @@ class TestConnectorCreation(TestCase):
                                     'expired')
                 self.assertIsNotNone(res)
                 if m == 'create_connector':
+                    # the notification is sent by the outbox relay
+                    MockKafkaProducer().send.assert_not_called()
+                    call_command('relay_outbox', '--once')
                     MockKafkaProducer().send.assert_called_once()
                     self.assertEqual(MockKafkaProducer().send.call_args_list[0][0][0], KAFKA_CONNECTOR_NOTIFICATION_TOPIC)
                     self.assertEqual(json.loads(MockKafkaProducer().send.call_args_list[0][1]['value'].decode('utf-8')),
@@ -330,6 +377,9 @@ class TestConnectorCreation(TestCase):
                                     'expired')
                 self.assertIsNotNone(res)
                 if m == 'create_connector':
+                    # the notification is sent by the outbox relay
+                    MockKafkaProducer().send.assert_not_called()
+                    call_command('relay_outbox', '--once')
                     MockKafkaProducer().send.assert_called_once()
                     self.assertEqual(MockKafkaProducer().send.call_args_list[0][0][0], KAFKA_CONNECTOR_NOTIFICATION_TOPIC)
                     self.assertEqual(json.loads(MockKafkaProducer().send.call_args_list[0][1]['value'].decode('utf-8')),
@@ -20,13 +20,14 @@ import logging
 import os
 
 from django.contrib.contenttypes.models import ContentType
+from django.core.management import call_command
 from django.test import TestCase
 from mock.mock import patch
 
 from hgw_backend.models import Source
 from hgw_backend.serializers import SourceSerializer
 from hgw_backend.settings import KAFKA_SOURCE_NOTIFICATION_TOPIC
-from hgw_common.models import Profile
+from hgw_common.models import OutboxMessage, Profile
 
 os.environ['OAUTHLIB_INSECURE_TRANSPORT'] = '1'
 
@@ -58,10 +59,15 @@ class TestNotification(TestCase):
 
     def test_notification_adding_source(self):
         """
-        Test that, when a new Source is created, it is notified to kafka
+        Test that, when a new Source is created, it is saved in the outbox and then notified to kafka by the relay
         """
         with patch('hgw_common.messaging.sender.KafkaProducer') as MockKafkaProducer:
             source = Source.objects.create(**self.new_source_data)
+            MockKafkaProducer().send.assert_not_called()
+            self.assertEqual(OutboxMessage.objects.count(), 1)
+
+            call_command('relay_outbox', '--once')
+            self.assertEqual(OutboxMessage.objects.count(), 0)
             MockKafkaProducer().send.assert_called_once()
             serializer = SourceSerializer(source)
             source_data = {k: serializer.data[k] for k in ('source_id', 'name', 'profile')}
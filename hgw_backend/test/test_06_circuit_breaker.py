@@ -0,0 +1,76 @@
+# Copyright (c) 2017-2018 CRS4
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to use,
+# copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or
+# substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE
+# AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+from django.test import SimpleTestCase
+from mock import patch
+
+from hgw_backend.circuit_breaker import (CircuitBreaker, get_circuit_breaker,
+                                         reset_circuit_breakers)
+
+
+class TestCircuitBreaker(SimpleTestCase):
+
+    def setUp(self):
+        self.circuit_breaker = CircuitBreaker('test', failure_threshold=3, recovery_timeout=10)
+
+    def test_open_after_failures(self):
+        """
+        Tests that the circuit is opened after consecutive failures and that a success resets the count
+        """
+        with patch('hgw_backend.circuit_breaker.time.monotonic', return_value=100):
+            self.circuit_breaker.record_failure()
+            self.circuit_breaker.record_failure()
+            self.circuit_breaker.record_success()
+            self.circuit_breaker.record_failure()
+            self.circuit_breaker.record_failure()
+            self.assertEqual(self.circuit_breaker.state, CircuitBreaker.CLOSED)
+            self.assertTrue(self.circuit_breaker.allow_request())
+
+            self.circuit_breaker.record_failure()
+            self.assertEqual(self.circuit_breaker.state, CircuitBreaker.OPEN)
+            self.assertFalse(self.circuit_breaker.allow_request())
+
+    def test_half_open(self):
+        """
+        Tests that, after the recovery timeout, only one probe is allowed and that a failed probe opens the circuit
+        """
+        with patch('hgw_backend.circuit_breaker.time.monotonic', return_value=100):
+            for _ in range(3):
+                self.circuit_breaker.record_failure()
+
+        with patch('hgw_backend.circuit_breaker.time.monotonic', return_value=110):
+            self.assertEqual(self.circuit_breaker.state, CircuitBreaker.HALF_OPEN)
+            self.assertTrue(self.circuit_breaker.allow_request())
+            self.assertFalse(self.circuit_breaker.allow_request())
+            self.circuit_breaker.record_failure()
+            self.assertEqual(self.circuit_breaker.state, CircuitBreaker.OPEN)
+
+        with patch('hgw_backend.circuit_breaker.time.monotonic', return_value=120):
+            self.assertTrue(self.circuit_breaker.allow_request())
+            self.circuit_breaker.record_success()
+            self.assertEqual(self.circuit_breaker.state, CircuitBreaker.CLOSED)
+            self.assertTrue(self.circuit_breaker.allow_request())
+            self.assertTrue(self.circuit_breaker.allow_request())
+
+    def test_circuit_breaker_per_source(self):
+        """
+        Tests that every Source has its own circuit breaker
+        """
+        reset_circuit_breakers()
+        self.assertIs(get_circuit_breaker('source_1'), get_circuit_breaker('source_1'))
+        self.assertIsNot(get_circuit_breaker('source_1'), get_circuit_breaker('source_2'))
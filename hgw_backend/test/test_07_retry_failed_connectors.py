@@ -0,0 +1,182 @@
+# Copyright (c) 2017-2018 CRS4
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to use,
+# copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or
+# substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE
+# AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+import json
+from datetime import timedelta
+
+from django.core.management import call_command
+from django.utils import timezone
+from mock import patch
+
+from hgw_backend.circuit_breaker import reset_circuit_breakers
+from hgw_backend.models import FailedConnector, Source
+
+from . import GenericTestCase
+
+OAUTH2_SOURCE_ID = 'LD2j7v35BvUlzWDe8G89JGzz4SOincB7'
+CERT_SOURCE_ID = '6IB70r5JwtxBh1lMj7rXatTGBgrOz6NC'
+
+
+class TestRetryFailedConnectors(GenericTestCase):
+    fixtures = ['test_data.json']
+
+    def setUp(self):
+        reset_circuit_breakers()
+        self.past = timezone.now() - timedelta(seconds=1)
+
+    def _create_failure(self, source_id, channel_id, action='CREATED', reason=FailedConnector.SENDING_ERROR,
+                        **kwargs):
+        message = {
+            'channel_id': channel_id,
+            'source_id': source_id,
+            'destination': {
+                'destination_id': 'ZQM4kvxYBaMf2nnVCdEfSLtswtthHY2Z',
+                'kafka_public_key': 'public_key'
+            },
+            'profile': {
+                'code': 'PROF002',
+                'version': 'hgw.document.profile.v0',
+                'payload': '{"clinical_domain": "Laboratory"}'
+            },
+            'person_id': 'AAAABBBBCCCCDDDD',
+            'start_validity': '2017-10-23T10:00:54+02:00',
+            'expire_validity': None,
+            'action': action
+        }
+        kwargs.setdefault('next_retry', self.past)
+        kwargs.setdefault('channel_id', channel_id)
+        return FailedConnector.objects.create(message=json.dumps(message), reason=reason, retry=True, **kwargs)
+
+    def test_retry_success(self):
+        """
+        Tests that the due operations are performed on the Sources and removed when they succeed
+        """
+        self._create_failure(OAUTH2_SOURCE_ID, 'channel_1')
+        self._create_failure(OAUTH2_SOURCE_ID, 'channel_2', action='REVOKED', reason=FailedConnector.SOURCE_UNAVAILABLE)
+        self._create_failure(CERT_SOURCE_ID, 'channel_3', reason=FailedConnector.DATABASE_ERROR)
+        not_due = self._create_failure(CERT_SOURCE_ID, 'channel_4', next_retry=timezone.now() + timedelta(hours=1))
+
+        with patch('hgw_backend.models.OAuth2Authentication.create_connector', return_value=True) as oauth2_create, \
+                patch('hgw_backend.models.OAuth2Authentication.delete_connector', return_value=True) as oauth2_delete, \
+                patch('hgw_backend.models.CertificatesAuthentication.create_connector',
+                      return_value=True) as cert_create, \
+                patch('hgw_backend.signals.enqueue') as enqueue:
+            # the notifications are saved by the worker threads, so they are mocked since the test db is not shared
+            call_command('retry_failed_connectors', once=True, batch_size=2)
+            self.assertEqual(enqueue.call_count, 2)
+
+            self.assertEqual(oauth2_create.call_count, 1)
+            self.assertEqual(oauth2_create.call_args[0][0], Source.objects.get(source_id=OAUTH2_SOURCE_ID))
+            self.assertEqual(oauth2_create.call_args[0][1]['channel_id'], 'channel_1')
+            self.assertEqual(oauth2_create.call_args[0][1]['start_validity'], '2017-10-23')
+            self.assertEqual(oauth2_delete.call_args[0][1], {'channel_id': 'channel_2'})
+            self.assertEqual(cert_create.call_count, 1)
+            self.assertEqual(cert_create.call_args[0][1]['channel_id'], 'channel_3')
+        self.assertEqual(list(FailedConnector.objects.all()), [not_due])
+
+    def test_retry_failure_backoff(self):
+        """
+        Tests that the operations that fail again are rescheduled with exponential backoff and that they are
+        not retried anymore after the maximum number of attempts
+        """
+        failure = self._create_failure(OAUTH2_SOURCE_ID, 'channel_1')
+        with patch('hgw_backend.models.OAuth2Authentication.create_connector', return_value=None) as oauth2_create, \
+                self.settings(FAILED_CONNECTOR_RETRY_BASE_DELAY=10, FAILED_CONNECTOR_RETRY_MAX_DELAY=30,
+                              FAILED_CONNECTOR_RETRY_MAX_ATTEMPTS=3):
+            for attempt, delay in ((1, 20), (2, 30)):
+                before = timezone.now()
+                call_command('retry_failed_connectors', once=True)
+                self.assertEqual(oauth2_create.call_count, attempt)
+                failure.refresh_from_db()
+                self.assertEqual(failure.attempts, attempt)
+                self.assertEqual(failure.reason, FailedConnector.SENDING_ERROR)
+                self.assertTrue(failure.retry)
+                self.assertTrue(before + timedelta(seconds=delay) <= failure.next_retry <=
+                                timezone.now() + timedelta(seconds=delay))
+
+                # the operation is not due yet
+                call_command('retry_failed_connectors', once=True)
+                self.assertEqual(oauth2_create.call_count, attempt)
+                FailedConnector.objects.update(next_retry=self.past)
+
+            call_command('retry_failed_connectors', once=True)
+            failure.refresh_from_db()
+            self.assertEqual(failure.attempts, 3)
+            self.assertFalse(failure.retry)
+
+    def test_retry_not_retriable_failure(self):
+        """
+        Tests that, when the operation cannot be performed anymore, it is not retried
+        """
+        failure = self._create_failure('UNKNOWN_SOURCE', 'channel_1')
+        call_command('retry_failed_connectors', once=True)
+        failure.refresh_from_db()
+        self.assertEqual(failure.reason, FailedConnector.SOURCE_NOT_FOUND)
+        self.assertFalse(failure.retry)
+
+    def test_retry_source_unavailable(self):
+        """
+        Tests that, when the circuit breaker of the Source is open, the Source is not contacted and the attempt
+        is not counted
+        """
+        failure = self._create_failure(OAUTH2_SOURCE_ID, 'channel_1')
+        with patch('hgw_backend.models.OAuth2Authentication.create_connector', return_value=True) as oauth2_create, \
+                patch('hgw_backend.management.commands.channel_consumer.get_circuit_breaker') as mocked_breaker:
+            mocked_breaker().allow_request.return_value = False
+            call_command('retry_failed_connectors', once=True)
+            self.assertEqual(oauth2_create.call_count, 0)
+        failure.refresh_from_db()
+        self.assertEqual(failure.reason, FailedConnector.SOURCE_UNAVAILABLE)
+        self.assertEqual(failure.attempts, 0)
+        self.assertTrue(failure.retry)
+        self.assertTrue(failure.next_retry > timezone.now())
+
+    def test_retry_in_order_of_channel(self):
+        """
+        Tests that the operations of a channel are retried in the order they were saved, even when a later one is
+        due before an earlier one, and that they wait for the earlier ones that fail
+        """
+        create = self._create_failure(OAUTH2_SOURCE_ID, 'channel_1', next_retry=timezone.now() + timedelta(hours=1))
+        revoke = self._create_failure(OAUTH2_SOURCE_ID, 'channel_1', action='REVOKED')
+        other = self._create_failure(OAUTH2_SOURCE_ID, 'channel_2', action='REVOKED')
+        with patch('hgw_backend.models.OAuth2Authentication.create_connector', return_value=None) as oauth2_create, \
+                patch('hgw_backend.models.OAuth2Authentication.delete_connector', return_value=True) as oauth2_delete:
+            call_command('retry_failed_connectors', once=True)
+            self.assertEqual(oauth2_create.call_count, 0)
+            self.assertEqual(oauth2_delete.call_count, 1)
+            self.assertEqual(oauth2_delete.call_args[0][1], {'channel_id': 'channel_2'})
+            self.assertFalse(FailedConnector.objects.filter(pk=other.pk).exists())
+
+            # the earlier operation fails, so the later one is not performed in the same batch
+            FailedConnector.objects.update(next_retry=self.past)
+            call_command('retry_failed_connectors', once=True)
+            self.assertEqual(oauth2_create.call_count, 1)
+            self.assertEqual(oauth2_delete.call_count, 1)
+            create.refresh_from_db()
+            self.assertEqual(create.attempts, 1)
+            revoke.refresh_from_db()
+            self.assertEqual(revoke.attempts, 0)
+
+            FailedConnector.objects.update(next_retry=self.past)
+            oauth2_create.return_value = True
+            with patch('hgw_backend.signals.enqueue'):
+                call_command('retry_failed_connectors', once=True)
+            self.assertEqual(oauth2_create.call_count, 2)
+            self.assertEqual(oauth2_delete.call_count, 2)
+            self.assertEqual(oauth2_delete.call_args[0][1], {'channel_id': 'channel_1'})
+        self.assertEqual(FailedConnector.objects.count(), 0)
@@ -17,14 +17,34 @@
 
 
 import hashlib
+import os
+import zlib
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
 from Cryptodome.PublicKey import RSA
 from Cryptodome.Signature.pss import MGF1
 from Cryptodome.Hash import SHA, SHA256
 from Cryptodome.Cipher import AES, PKCS1_OAEP
 from Cryptodome import Random
 
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
 MAGIC_BYTES = b'\xdf\xbb'
 
+# The compression flag is the first byte of the plaintext. 0xff never appears in utf-8 text, so it can't be
+# confused with the first byte of uncompressed payloads
+COMPRESSION_FLAG = b'\xff'
+ZLIB = 'zlib'
+ZSTD = 'zstd'
+COMPRESSION_CODES = {
+    ZLIB: b'\x01',
+    ZSTD: b'\x02'
+}
+
 
 class NotEncryptedMessage(Exception):
     pass
@@ -38,6 +58,56 @@ def is_encrypted(message, magic_bytes=MAGIC_BYTES):
     return message[:2] == magic_bytes
 
 
+def _export_key(key):
+    return key.exportKey() if isinstance(key, RSA.RsaKey) else key
+
+
+def _encrypt_group(public_key, messages, compression, magic_bytes):
+    cipher = Cipher(public_key=RSA.importKey(public_key), compression=compression, magic_bytes=magic_bytes)
+    return [cipher.encrypt(message) for message in messages]
+
+
+def encrypt_many(payloads, recipients, keys=None, compression=None, magic_bytes=MAGIC_BYTES, max_workers=None):
+    """
+    Encrypts a batch of payloads using a pool of processes. The i-th payload is encrypted with the public key
+    of the i-th recipient. The payloads with the same key (e.g., the channel they are sent to) are encrypted,
+    in order, by the same :class:`Cipher`, so the RSA encryption of the AES key is performed only once for every
+    key and the messages of a key must be decrypted in the same order. Without keys, every payload is encrypted
+    by its own :class:`Cipher` and can be decrypted independently from the others
+
+    :param payloads: a list of messages (str or bytes) to encrypt
+    :param recipients: a list of public keys (RSA objects or PEM strings), one for every payload
+    :param keys: a list of keys, one for every payload. The payloads with the same key must have the same recipient
+    :param compression: the compression algorithm to use. See :class:`Cipher`
+    :param magic_bytes: 2 bytes length string for marking enconded message
+    :param max_workers: the number of processes to use. If it is 1 the payloads are encrypted in the
+        current process. By default it uses the number of CPUs
+    :return: the list of encrypted messages, in the same order of the input
+    """
+    if len(payloads) != len(recipients) or (keys is not None and len(keys) != len(payloads)):
+        raise ValueError('payloads, recipients and keys must have the same length')
+
+    groups = OrderedDict()
+    for index, key in enumerate(keys if keys is not None else range(len(payloads))):
+        groups.setdefault(key, []).append(index)
+
+    args = [(_export_key(recipients[indexes[0]]), [payloads[index] for index in indexes], compression, magic_bytes)
+            for indexes in groups.values()]
+    if max_workers == 1 or len(args) == 1:
+        encrypted_groups = [_encrypt_group(*arg) for arg in args]
+    else:
+        # the groups are sent to the processes in chunks, since without keys every group holds a single payload
+        chunksize = max(1, len(args) // (4 * (max_workers or os.cpu_count() or 1)))
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            encrypted_groups = list(executor.map(_encrypt_group, *zip(*args), chunksize=chunksize))
+
+    results = [None] * len(payloads)
+    for indexes, encrypted in zip(groups.values(), encrypted_groups):
+        for index, message in zip(indexes, encrypted):
+            results[index] = message
+    return results
+
+
 class Cipher(object):
     class MissingPrivateKey(Exception):
         pass
@@ -48,7 +118,11 @@ class Cipher(object):
     class MissingAESKey(Exception):
         pass
 
-    def __init__(self, public_key=None, private_key=None, aes_key=None, iv=None, magic_bytes=MAGIC_BYTES):
+    class UnsupportedCompression(Exception):
+        pass
+
+    def __init__(self, public_key=None, private_key=None, aes_key=None, iv=None, magic_bytes=MAGIC_BYTES,
+                 compression=None):
         """
 
         :param public_key: RSA object, required for encrypting
@@ -56,7 +130,14 @@ class Cipher(object):
         :param aes_key:  16 bytes length string for symmetric encrypting, required for encrypting
         :param iv: initialization vector (16 bytes length string), required for encrypting
         :param magic_bytes: 2 bytes length string for marking enconded message
+        :param compression: the algorithm (``zlib`` or ``zstd``) used to compress the message before encrypting it.
+            If ``None`` the message is not compressed. Compressed messages are decompressed automatically by
+            :meth:`decrypt`
         """
+        if compression is not None and compression not in COMPRESSION_CODES:
+            raise Cipher.UnsupportedCompression(compression)
+        if compression == ZSTD and zstandard is None:
+            raise Cipher.UnsupportedCompression('zstandard package is required for zstd compression')
 
         self.public_key = public_key
         self.private_key = private_key
@@ -64,6 +145,7 @@ class Cipher(object):
         self.iv = iv or Random.new().read(AES.block_size)
         self.block_size = AES.block_size
         self.magic_bytes = magic_bytes
+        self.compression = compression
 
         self.aes_hashes = {}
         self.enc_aes_key = None
@@ -100,7 +182,8 @@ class Cipher(object):
                 aes_key = AES.new(key_dec, AES.MODE_CBC, iv)
                 self.aes_hashes[aes_key_hash] = aes_key
 
-            return self.unpad(self.aes_hashes[aes_key_hash].decrypt(enc_payload)).decode('utf-8')
+            message = self.unpad(self.aes_hashes[aes_key_hash].decrypt(enc_payload))
+            return self.decompress(message).decode('utf-8')
         else:
             raise NotEncryptedMessage()
 
@@ -125,7 +208,37 @@ class Cipher(object):
                                 self.aes_key_hash + \
                                 self.enc_aes_key + \
                                 self.iv
-        return self.base_message + self.aes_cipher.encrypt(self.pad(message))
+        return self.base_message + self.aes_cipher.encrypt(self.pad(self.compress(message)))
+
+    def compress(self, message):
+        """
+        Compresses the message with the configured algorithm, prepending the compression flag and the code of the
+        algorithm. If no compression is configured, it returns the message unchanged
+        """
+        if self.compression is None:
+            return message
+        if self.compression == ZLIB:
+            compressed = zlib.compress(message)
+        else:
+            compressed = zstandard.ZstdCompressor().compress(message)
+        return COMPRESSION_FLAG + COMPRESSION_CODES[self.compression] + compressed
+
+    @staticmethod
+    def decompress(message):
+        """
+        Decompresses a decrypted message if it is marked with the compression flag.
+        Not compressed messages are returned unchanged
+        """
+        if message[:1] != COMPRESSION_FLAG:
+            return message
+        code, compressed = message[1:2], message[2:]
+        if code == COMPRESSION_CODES[ZLIB]:
+            return zlib.decompress(compressed)
+        if code == COMPRESSION_CODES[ZSTD]:
+            if zstandard is None:
+                raise Cipher.UnsupportedCompression('zstandard package is required for zstd compression')
+            return zstandard.ZstdDecompressor().decompress(compressed)
+        raise Cipher.UnsupportedCompression(code)
 
     def is_encrypted(self, message):
         return is_encrypted(message, self.magic_bytes)
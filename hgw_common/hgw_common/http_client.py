@@ -0,0 +1,221 @@
+# Copyright (c) 2017-2018 CRS4
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to use,
+# copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or
+# substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE
+# AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+"""
+Shared HTTP client for the calls among the services of the gateway and to the sources.
+
+All the sessions of the process use the same :class:`PooledHTTPAdapter`, so the connections to a host are kept alive
+and reused instead of paying a new TCP and TLS handshake for every call. Since the connection pools of the adapter
+are shared by all the requests, the sessions that authenticate with a client certificate (mTLS) use a different
+adapter for every certificate, so that a connection opened with a certificate is never reused with another one.
+
+The adapter also:
+
+    - applies a connect and a read timeout to the requests that don't specify one
+    - retries the requests for connection errors and for 502, 503 and 504 responses, with exponential backoff and
+      jitter. Read errors and error responses are retried only for idempotent methods
+    - collects, for every host, the number of requests, errors and retries and the total time spent. The metrics
+      are logged every :data:`DEFAULT_METRICS_LOG_INTERVAL` seconds, when there are new requests
+
+Example:
+
+.. code::
+
+    session = get_http_client().mount(OAuth2Session(client=client))
+    get_http_client().request('post', url, json=data, cert=(cert_file, key_file))
+"""
+
+import logging
+import random
+import threading
+import time
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger('hgw_common.http_client')
+
+DEFAULT_CONNECT_TIMEOUT = 5
+DEFAULT_READ_TIMEOUT = 30
+DEFAULT_RETRIES = 2
+DEFAULT_BACKOFF_FACTOR = 0.5
+DEFAULT_POOL_MAXSIZE = 10
+RETRY_STATUSES = (502, 503, 504)
+DEFAULT_METRICS_LOG_INTERVAL = 300
+
+
+class JitterRetry(Retry):
+    """
+    Retry policy that waits a random time between 0 and the exponential backoff (i.e., full jitter),
+    so that the clients that failed together don't retry at the same time
+    """
+
+    def get_backoff_time(self):
+        backoff = super(JitterRetry, self).get_backoff_time()
+        return random.uniform(0, backoff) if backoff > 0 else 0
+
+
+class HostMetrics(object):
+    """
+    Counters of the requests performed to a host
+    """
+
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.retries = 0
+        self.elapsed = 0.0
+
+    def to_python(self):
+        return {
+            'requests': self.requests,
+            'errors': self.errors,
+            'retries': self.retries,
+            'elapsed': self.elapsed
+        }
+
+
+class PooledHTTPAdapter(HTTPAdapter):
+    """
+    HTTPAdapter with default timeouts, retries and per host metrics
+    """
+
+    def __init__(self, client, timeout, retries, pool_maxsize):
+        self._client = client
+        self.timeout = timeout
+        super(PooledHTTPAdapter, self).__init__(pool_connections=pool_maxsize, pool_maxsize=pool_maxsize,
+                                                max_retries=retries)
+
+    def send(self, request, timeout=None, **kwargs):
+        host = urlparse(request.url).netloc
+        start = time.monotonic()
+        try:
+            response = super(PooledHTTPAdapter, self).send(request, timeout=timeout or self.timeout, **kwargs)
+        except requests.exceptions.RequestException:
+            self._client.record(host, time.monotonic() - start, error=True)
+            raise
+        retries = getattr(response.raw, 'retries', None)
+        self._client.record(host, time.monotonic() - start, error=response.status_code >= 500,
+                            retries=len(retries.history) if retries is not None else 0)
+        return response
+
+    def close(self):
+        # The adapter is shared by all the sessions of the process, so the pools are not closed with the session
+        pass
+
+
+class HTTPClient(object):
+    """
+    Client that manages the connection pools and the metrics of the process
+    """
+
+    def __init__(self, connect_timeout=DEFAULT_CONNECT_TIMEOUT, read_timeout=DEFAULT_READ_TIMEOUT,
+                 retries=DEFAULT_RETRIES, backoff_factor=DEFAULT_BACKOFF_FACTOR, pool_maxsize=DEFAULT_POOL_MAXSIZE,
+                 metrics_log_interval=DEFAULT_METRICS_LOG_INTERVAL):
+        self.timeout = (connect_timeout, read_timeout)
+        self.retry = JitterRetry(total=retries, backoff_factor=backoff_factor, status_forcelist=RETRY_STATUSES,
+                                 raise_on_status=False)
+        self.pool_maxsize = pool_maxsize
+        self.metrics_log_interval = metrics_log_interval
+        self._adapters = {}
+        self._metrics = {}
+        self._metrics_logged_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def get_adapter(self, cert=None):
+        """
+        Returns the adapter to use for the client certificate :param:`cert`
+        """
+        if isinstance(cert, list):
+            cert = tuple(cert)
+        with self._lock:
+            if cert not in self._adapters:
+                self._adapters[cert] = PooledHTTPAdapter(self, self.timeout, self.retry, self.pool_maxsize)
+            return self._adapters[cert]
+
+    def mount(self, session, cert=None):
+        """
+        Mounts the shared adapter on :param:`session` (e.g., an OAuth2Session) and returns it
+        """
+        adapter = self.get_adapter(cert)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
+
+    def session(self, cert=None):
+        """
+        Returns a new session that uses the shared connection pools
+        """
+        session = self.mount(requests.Session(), cert)
+        session.cert = cert
+        return session
+
+    def request(self, method, url, cert=None, **kwargs):
+        """
+        Performs a request using the shared connection pools
+        """
+        return self.session(cert).request(method.upper(), url, **kwargs)
+
+    def record(self, host, elapsed, error=False, retries=0):
+        now = time.monotonic()
+        log_metrics = False
+        with self._lock:
+            metrics = self._metrics.setdefault(host, HostMetrics())
+            metrics.requests += 1
+            metrics.errors += int(error)
+            metrics.retries += retries
+            metrics.elapsed += elapsed
+            if now - self._metrics_logged_at >= self.metrics_log_interval:
+                self._metrics_logged_at = now
+                log_metrics = True
+        if retries:
+            logger.debug('Request to %s retried %s times', host, retries)
+        if log_metrics:
+            self.log_metrics()
+
+    def log_metrics(self):
+        """
+        Logs the metrics of every host
+        """
+        for host, metrics in sorted(self.get_metrics().items()):
+            logger.info('Requests to %s: %s requests, %s errors, %s retries, %.3f seconds on average', host,
+                        metrics['requests'], metrics['errors'], metrics['retries'],
+                        metrics['elapsed'] / metrics['requests'])
+
+    def get_metrics(self):
+        """
+        Returns a dictionary with the metrics of every host
+        """
+        with self._lock:
+            return {host: metrics.to_python() for host, metrics in self._metrics.items()}
+
+
+_http_client = None
+_http_client_lock = threading.Lock()
+
+
+def get_http_client():
+    """
+    Returns the :class:`HTTPClient` of the process
+    """
+    global _http_client
+    with _http_client_lock:
+        if _http_client is None:
+            _http_client = HTTPClient()
+        return _http_client
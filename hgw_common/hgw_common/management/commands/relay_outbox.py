@@ -0,0 +1,45 @@
+# Copyright (c) 2017-2018 CRS4
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to use,
+# copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or
+# substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE
+# AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+import logging
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from hgw_common.utils.outbox import OutboxRelay
+
+logger = logging.getLogger('hgw_common.outbox')
+
+
+class Command(BaseCommand):
+    """
+    Command that publishes the messages saved in the outbox
+    """
+    help = 'Publish the messages of the outbox'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=getattr(settings, 'OUTBOX_BATCH_SIZE', 500),
+                            help='Number of messages published at once')
+        parser.add_argument('--interval', type=float, default=1,
+                            help='Seconds to wait when there are no messages to publish')
+        parser.add_argument('--once', action='store_true',
+                            help='Publish the messages currently due and exit')
+
+    def handle(self, *args, **options):
+        relay = OutboxRelay(batch_size=options['batch_size'], lease=getattr(settings, 'OUTBOX_LEASE', 60))
+        metrics = relay.run(options['once'], options['interval'])
+        logger.info('Published %s messages in %s batches (%.1f messages/s)', metrics['published'],
+                    metrics['batches'], metrics['throughput'])
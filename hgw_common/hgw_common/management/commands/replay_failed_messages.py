@@ -0,0 +1,53 @@
+# Copyright (c) 2017-2018 CRS4
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to use,
+# copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or
+# substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE
+# AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+import logging
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.module_loading import import_string
+
+from hgw_common.utils.replay import FailedMessagesReplayer
+
+logger = logging.getLogger('hgw_common.replay')
+
+
+class Command(BaseCommand):
+    """
+    Command that replays the failed messages. The consumers are registered in the FAILED_MESSAGES_CONSUMERS setting,
+    a dict with the message types as keys and the dotted paths of the consumer commands as values
+    """
+    help = 'Replay the failed messages'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=getattr(settings, 'FAILED_MESSAGES_BATCH_SIZE', 100),
+                            help='Number of messages claimed at once')
+        parser.add_argument('--interval', type=float, default=10,
+                            help='Seconds to wait when there are no messages to replay')
+        parser.add_argument('--once', action='store_true',
+                            help='Replay the messages currently due and exit')
+
+    def handle(self, *args, **options):
+        consumers_paths = getattr(settings, 'FAILED_MESSAGES_CONSUMERS', {})
+        if not consumers_paths:
+            raise CommandError('No consumer registered in FAILED_MESSAGES_CONSUMERS')
+        consumers = {message_type: import_string(path)() for message_type, path in consumers_paths.items()}
+
+        replayer = FailedMessagesReplayer(consumers, options['batch_size'],
+                                          getattr(settings, 'FAILED_MESSAGES_LEASE', 300))
+        metrics = replayer.run(options['once'], options['interval'])
+        logger.info('Replayed %s messages in %s batches (%.1f messages/s)', metrics['replayed'], metrics['batches'],
+                    metrics['throughput'])
@@ -0,0 +1,80 @@
+import json
+from json import JSONDecodeError
+
+from hgw_common.messaging import SerializationError
+
+
+class Serializer():
+    """
+    Generic serializer class. Just define the interface
+    """
+
+    def serialize(self, obj):
+        """
+        Method that performs the serialization. It must be implemented by subclasses
+        """
+        raise NotImplementedError
+
+"""
+Binary framing of messages used to transfer raw payloads without base64 encoding them.
+
+Each frame is composed by:
+
+    - 4 bytes (big endian unsigned int) with the length of the header
+    - the header: a utf-8 json object with the metadata of the message
+    - 4 bytes (big endian unsigned int) with the length of the payload
+    - the payload as raw bytes
+"""
+
+import json
+import struct
+
+FRAME_CONTENT_TYPE = 'application/vnd.hgw.frames'
+
+_LENGTH = struct.Struct('>I')
+
+
+class FrameError(Exception):
+    """
+    Raised when a frame is truncated or malformed
+    """
+
+
+def pack_frame(header, payload):
+    """
+    Returns the frame bytes for the :param:`header` dict and the :param:`payload` bytes
+    """
+    encoded_header = json.dumps(header).encode('utf-8')
+    return b''.join((_LENGTH.pack(len(encoded_header)), encoded_header,
+                     _LENGTH.pack(len(payload)), payload))
+
+
+def _read_exactly(stream, size):
+    data = stream.read(size)
+    while len(data) < size:
+        chunk = stream.read(size - len(data))
+        if not chunk:
+            raise FrameError('Truncated frame')
+        data += chunk
+    return data
+
+
+def read_frames(stream):
+    """
+    Generator that reads the frames from a file-like object (e.g., an http raw response)
+    and yields tuples (header, payload). It stops when the stream ends
+
+    :param stream: an object with a read(size) method returning bytes
+    """
+    while True:
+        length = stream.read(_LENGTH.size)
+        if not length:
+            return
+        if len(length) < _LENGTH.size:
+            length += _read_exactly(stream, _LENGTH.size - len(length))
+        try:
+            header = json.loads(_read_exactly(stream, _LENGTH.unpack(length)[0]).decode('utf-8'))
+        except ValueError:
+            raise FrameError('Malformed frame header')
+        payload_length = _LENGTH.unpack(_read_exactly(stream, _LENGTH.size))[0]
+        yield header, _read_exactly(stream, payload_length)
@@ -17,11 +17,12 @@
 
 import collections.abc
 import logging
+import threading
 from ssl import SSLError
-from time import sleep
+from time import monotonic, sleep
 
-from kafka import KafkaConsumer, TopicPartition
-from kafka.errors import NoBrokersAvailable
+from kafka import KafkaConsumer, OffsetAndMetadata, TopicPartition
+from kafka.errors import KafkaError, NoBrokersAvailable
 
 from hgw_common.messaging import (BrokerConnectionError, DeserializationError,
                                   TopicNotAssigned)
@@ -31,6 +32,8 @@ from .deserializer import JSONDeserializer
 
 logger = logging.getLogger('hgw_common.receiver')
 
+DEFAULT_WATERMARKS_TTL = 2
+
 class GenericReceiver():
     """
     Generic sender abstract class. Subclass should implement the
@@ -51,9 +54,15 @@ class KafkaReceiver(GenericReceiver):
     :param blocking: if ``True``, the receiver will wait until it gets the authorization to consume from all the topics.
         if ``False``, it will if the topic is not assigned. By default it is True
     :param deserializer: the Deserializer class to use to deserializer the messages read
+    :param watermarks: an optional :class:`KafkaWatermarks` used to get the first and last ids without
+        querying the broker every time
+    :param subscribe: if ``False``, the partitions of the topics are assigned to the consumer without joining the
+        consumer group, so that creating the receiver doesn't cause a rebalance of the group. The group is used only
+        to store the committed offsets
     """
 
-    def __init__(self, topics, config, blocking=True, deserializer=JSONDeserializer):
+    def __init__(self, topics, config, blocking=True, deserializer=JSONDeserializer, watermarks=None,
+                 subscribe=True):
         if isinstance(topics, collections.abc.MutableSequence):
             self.topics = topics
         else:
@@ -67,6 +76,7 @@ class KafkaReceiver(GenericReceiver):
 
         self.blocking = blocking
         self.deserializer = deserializer()
+        self.watermarks = watermarks
 
         try:
             self.consumer = KafkaConsumer(**self.config)
@@ -77,14 +87,30 @@ class KafkaReceiver(GenericReceiver):
             logger.error('SSLError connecting to kafka broker')
             raise BrokerConnectionError('SSLError connecting to kafka broker')
 
-        self.consumer.subscribe(self.topics)
-        logger.info("Subscribed to topic(s) %s", ", ".join(self.topics))
-        if not blocking and not self._check_assignment():
-            raise TopicNotAssigned()
+        if not subscribe:
+            self._assign()
         else:
-            self._wait_assignments()
+            self.consumer.subscribe(self.topics)
+            logger.info("Subscribed to topic(s) %s", ", ".join(self.topics))
+            if not blocking and not self._check_assignment():
+                raise TopicNotAssigned()
+            else:
+                self._wait_assignments()
         super(KafkaReceiver, self).__init__()
 
+    def _assign(self):
+        """
+        Assigns all the partitions of the topics to the consumer, without joining the consumer group
+        """
+        topic_partitions = []
+        for topic in self.topics:
+            partitions = self.consumer.partitions_for_topic(topic)
+            if not partitions:
+                raise TopicNotAssigned()
+            topic_partitions.extend(TopicPartition(topic, partition) for partition in partitions)
+        self.consumer.assign(topic_partitions)
+        logger.info("Assigned topic(s) %s", ", ".join(self.topics))
+
     def _force_assignment(self):
         # force the assignment update. See https://github.com/dpkp/kafka-python/issues/601
         self.consumer.poll()
@@ -148,6 +174,8 @@ class KafkaReceiver(GenericReceiver):
         """
         Get the id of the fist available object in a partition
         """
+        if self.watermarks is not None:
+            return self.watermarks.get_first_id(topic, partition)
         tp = TopicPartition(topic, partition)
         return self.consumer.beginning_offsets([tp])[tp]
 
@@ -155,9 +183,26 @@ class KafkaReceiver(GenericReceiver):
         """
         Return the id of the last available object in a partition
         """
+        if self.watermarks is not None:
+            return self.watermarks.get_last_id(topic, partition)
         tp = TopicPartition(topic, partition)
         return self.consumer.end_offsets([tp])[tp] - 1
 
+    def get_committed_id(self, topic, partition=0):
+        """
+        Return the id of the next message to be consumed according to the offset committed by the consumer group.
+        It returns ``None`` if the group has never committed an offset
+        """
+        tp = TopicPartition(topic, partition)
+        return self.consumer.committed(tp)
+
+    def commit_id(self, message_id, topic, partition=0):
+        """
+        Commit for the consumer group that all the messages until :param:`message_id` included have been consumed
+        """
+        tp = TopicPartition(topic, partition)
+        self.consumer.commit({tp: OffsetAndMetadata(message_id + 1, None)})
+
     def get_by_id(self, message_id, topic, partition=0):
         self._go_to_id(message_id, topic, partition)
         msg = next(self.consumer)
@@ -167,16 +212,59 @@ class KafkaReceiver(GenericReceiver):
         """
         Return messages from the :param:`first_id` to the :param:`last_id` included
         """
+        return list(self.iter_range(first_id, last_id, topic, partition))
+
+    def iter_range(self, first_id, last_id, topic, partition=0):
+        """
+        Generator that returns messages from the :param:`first_id` to the :param:`last_id` included.
+        Differently from :meth:`get_by_id`, it seeks only once and then reads the messages sequentially,
+        so the caller can stop consuming them at any time
+        """
         if last_id < first_id:
             raise Exception
         if last_id > self.get_last_id(topic, partition):
             last_id = self.get_last_id(topic, partition)
         if first_id < self.get_first_id(topic, partition):
             first_id = self.get_first_id(topic, partition)
-        msgs = []
-        for msg_id in range(first_id, last_id + 1):
-            msgs.append(self.get_by_id(msg_id, topic, partition))
-        return msgs
+        if first_id > last_id:
+            return
+        self.consumer.seek(TopicPartition(topic, partition), first_id)
+        for msg in self.consumer:
+            yield self._construct_message(msg)
+            if msg.offset >= last_id:
+                return
+
+    def stream(self, start_id, topic, partition=0, timeout=60, poll_timeout_ms=1000):
+        """
+        Generator that returns the messages from :param:`start_id` on, as soon as they are available.
+        When no message arrives for :param:`poll_timeout_ms` it yields ``None``, so that the caller can
+        perform periodic operations (e.g., sending keep-alives). It stops after :param:`timeout` seconds
+
+        :param start_id: the id of the first message to return. It can be the id of the next message
+            to be produced (i.e., last id + 1)
+        :param timeout: the number of seconds after which the generator stops
+        :param poll_timeout_ms: the maximum time to wait for new messages
+        """
+        tp = TopicPartition(topic, partition)
+        if not self.get_first_id(topic, partition) <= start_id <= self.get_last_id(topic, partition) + 1:
+            raise NotInRangeError()
+        self.consumer.seek(tp, start_id)
+
+        deadline = monotonic() + timeout
+        while True:
+            records = self.consumer.poll(timeout_ms=poll_timeout_ms).get(tp, [])
+            if not records:
+                yield None
+            for msg in records:
+                yield self._construct_message(msg)
+            if monotonic() >= deadline:
+                return
+
+    def close(self):
+        """
+        Closes the consumer and its connections to the broker
+        """
+        self.consumer.close()
 
     def __iter__(self):
         return self
@@ -189,21 +277,174 @@ class KafkaReceiver(GenericReceiver):
         self.consumer.close()
 
 
-def create_receiver(name, client_name, configuration_params, blocking=True, deserializer=JSONDeserializer):
+class KafkaWatermarks():
+    """
+    Cache of the first and last ids of the topics partitions, shared by the receivers of a process.
+    The ids are fetched from the broker the first time they are requested and then they are refreshed
+    in background every :param:`ttl` seconds by a thread, using only one consumer for all the topics.
+    The partitions that are not requested for :param:`idle_timeout` seconds are removed from the cache
+
+    :param config: a dict with the kafka configuration for the :class:`KafkaConsumer`
+    :param ttl: the number of seconds after which the ids are refreshed. It must be greater than 0
+    :param idle_timeout: the number of seconds after which a partition not requested is removed from the cache
+    :param background_refresh: if ``False`` the thread is not started and the ids older than :param:`ttl` are
+        fetched synchronously when they are requested
+    :param clock: the function used to measure the age of the ids
+    """
+
+    def __init__(self, config, ttl=DEFAULT_WATERMARKS_TTL, idle_timeout=None, background_refresh=True,
+                 clock=monotonic):
+        if ttl <= 0:
+            raise ValueError('The ttl must be greater than 0')
+        self.config = config
+        self.ttl = ttl
+        self.idle_timeout = idle_timeout if idle_timeout is not None else ttl * 30
+        self.background_refresh = background_refresh
+        self.clock = clock
+        self._consumer = None
+        self._refresher = None
+        # the consumer is not thread safe: the requests to the broker are serialized with a different lock,
+        # so that the cached ids can be read while the refresh is in progress
+        self._consumer_lock = threading.Lock()
+        self._lock = threading.Lock()
+        # TopicPartition -> dict with first_id, last_id, the time of the update and the time of the last request
+        self._watermarks = {}
+
+    def _get_consumer(self):
+        if self._consumer is None:
+            try:
+                self._consumer = KafkaConsumer(**self.config)
+            except NoBrokersAvailable:
+                logger.error("Cannot connect to kafka")
+                raise BrokerConnectionError
+            except SSLError:
+                logger.error('SSLError connecting to kafka broker')
+                raise BrokerConnectionError('SSLError connecting to kafka broker')
+        return self._consumer
+
+    def _fetch(self, topic_partitions):
+        with self._consumer_lock:
+            consumer = self._get_consumer()
+            beginning_offsets = consumer.beginning_offsets(topic_partitions)
+            end_offsets = consumer.end_offsets(topic_partitions)
+        now = self.clock()
+        with self._lock:
+            for tp in topic_partitions:
+                entry = self._watermarks.setdefault(tp, {'requested': now})
+                entry.update({
+                    'first_id': beginning_offsets[tp],
+                    'last_id': end_offsets[tp] - 1,
+                    'updated': now
+                })
+
+    def _start_refresher(self):
+        if self._refresher is None or not self._refresher.is_alive():
+            self._refresher = threading.Thread(target=self._refresh_loop, daemon=True)
+            self._refresher.start()
+
+    def _refresh_loop(self):
+        while True:
+            sleep(self.ttl)
+            with self._lock:
+                now = self.clock()
+                for tp in [tp for tp, entry in self._watermarks.items()
+                           if now - entry['requested'] > self.idle_timeout]:
+                    del self._watermarks[tp]
+                if not self._watermarks:
+                    self._refresher = None
+                    return
+                topic_partitions = list(self._watermarks)
+            try:
+                self._fetch(topic_partitions)
+            except Exception:
+                logger.exception('Error refreshing the topics watermarks')
+
+    def get(self, topic, partition=0, refresh=False):
+        """
+        Return a tuple with the first and the last ids available in the partition. When the ids cannot be fetched
+        from the broker, the cached ones are returned, even if they are old
+
+        :param refresh: if ``True`` the ids are fetched from the broker before returning them. It is useful when the
+            caller has a reason to think that the cached ids are old (e.g., a client requested an id not in range)
+        """
+        tp = TopicPartition(topic, partition)
+        if refresh:
+            try:
+                self._fetch([tp])
+            except (KafkaError, BrokerConnectionError):
+                logger.exception('Error refreshing the ids of %s. Using the cached ones', tp)
+        # if the background refresh is late (e.g., because of broker errors) the ids are fetched synchronously
+        max_age = self.ttl * 2 if self.background_refresh else self.ttl
+        fetched = False
+        while True:
+            with self._lock:
+                entry = self._watermarks.get(tp)
+                if entry is not None and (fetched or self.clock() - entry['updated'] <= max_age):
+                    entry['requested'] = self.clock()
+                    if self.background_refresh:
+                        self._start_refresher()
+                    return entry['first_id'], entry['last_id']
+            try:
+                self._fetch([tp])
+            except (KafkaError, BrokerConnectionError):
+                if entry is None:
+                    raise
+                logger.exception('Error fetching the ids of %s. Using the cached ones', tp)
+            fetched = True
+
+    def get_first_id(self, topic, partition=0):
+        return self.get(topic, partition)[0]
+
+    def get_last_id(self, topic, partition=0):
+        return self.get(topic, partition)[1]
+
+    def clear(self):
+        """
+        Remove all the ids from the cache
+        """
+        with self._lock:
+            self._watermarks = {}
+
+
+def _create_kafka_config(configuration_params):
+    return {
+        'bootstrap_servers': configuration_params['broker_url'],
+        'security_protocol': 'SSL' if configuration_params['ssl'] is True else 'PLAINTEXT',
+        'ssl_check_hostname': True,
+        'ssl_cafile': configuration_params['ca_cert'],
+        'ssl_certfile': configuration_params['client_cert'],
+        'ssl_keyfile': configuration_params['client_key'],
+    }
+
+
+def create_receiver(name, client_name, configuration_params, blocking=True, deserializer=JSONDeserializer,
+                    auto_commit=True, watermarks=None, subscribe=True):
     """
     Methods that returns the correct sender based on the settings file
+
+    :param auto_commit: if ``False`` the offsets are committed only explicitly using :meth:`KafkaReceiver.commit_id`
+    :param watermarks: an optional :class:`KafkaWatermarks` created with :func:`create_watermarks`
+    :param subscribe: if ``False`` the receiver doesn't join the consumer group (see :class:`KafkaReceiver`)
     """
     if configuration_params['broker_type'] == 'kafka':
-        kafka_config = {
-            'bootstrap_servers': configuration_params['broker_url'],
+        kafka_config = _create_kafka_config(configuration_params)
+        kafka_config.update({
             'group_id': client_name,
-            'security_protocol': 'SSL' if configuration_params['ssl'] is True else 'PLAINTEXT',
-            'ssl_check_hostname': True,
-            'ssl_cafile': configuration_params['ca_cert'],
-            'ssl_certfile': configuration_params['client_cert'],
-            'ssl_keyfile': configuration_params['client_key'],
-        }
+            'enable_auto_commit': auto_commit,
+        })
 
-        return KafkaReceiver(name, kafka_config, blocking=blocking, deserializer=deserializer)
+        return KafkaReceiver(name, kafka_config, blocking=blocking, deserializer=deserializer, watermarks=watermarks,
+                             subscribe=subscribe)
 
     raise UnknownReceiver("Cannot instantiate a sender")
+
+
+def create_watermarks(configuration_params, ttl=DEFAULT_WATERMARKS_TTL, **kwargs):
+    """
+    Methods that returns the correct watermarks cache based on the settings file.
+    The other keyword arguments are passed to the cache (see :class:`KafkaWatermarks`)
+    """
+    if configuration_params['broker_type'] == 'kafka':
+        return KafkaWatermarks(_create_kafka_config(configuration_params), ttl=ttl, **kwargs)
+
+    raise UnknownReceiver("Cannot instantiate a watermarks cache")
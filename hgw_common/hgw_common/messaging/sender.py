@@ -16,6 +16,7 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 
 import logging
+import time
 from ssl import SSLError
 from traceback import format_exc
 
@@ -30,6 +31,9 @@ from hgw_common.messaging.serializer import JSONSerializer
 
 logger = logging.getLogger('hgw_common.sender')
 
+# Seconds within which the messages sent by send_many must be acked
+SEND_MANY_TIMEOUT = 5
+
 class GenericSender():
     """
     Generic sender abstract class. Subclass should implement the
@@ -42,6 +46,12 @@ class GenericSender():
         """
         raise NotImplementedError
 
+    def send_many(self, topic, messages):
+        """
+        Abstract bulk send method. Subclasses should implement this
+        """
+        raise NotImplementedError
+
 
 class KafkaConfig(object):
     def __init__(self, config: dict):
@@ -107,6 +117,78 @@ class KafkaSender(GenericSender):
         else:
             return True
 
+    def send_many(self, topic, messages, timeout=SEND_MANY_TIMEOUT):
+        """
+        Sends a batch of messages to the topic. All the messages are sent without waiting for the acks of the
+        previous ones; the acks are collected at the end.
+
+        :param topic: the topic where to publish the messages
+        :param messages: a list of tuples (key, message)
+        :param timeout: seconds to wait for the acks of the messages. The messages not acked in time are failed
+        :return: a list with the outcome (``True`` or ``False``) of every message, in the same order of the input
+        """
+        try:
+            self._create_producer()
+        except SendingError:
+            logger.error('Error connecting to Kafka')
+            return [False] * len(messages)
+
+        futures = []
+        for key, message in messages:
+            try:
+                futures.append(self.producer.send(topic,
+                                                  value=self.serializer.serialize(message),
+                                                  key=key.encode('utf-8') if key is not None else key))
+            except KafkaTimeoutError:
+                logger.error('Cannot get topic %s metadata. Probably the token does not exist', topic)
+                futures.append(None)
+            except SerializationError:
+                futures.append(None)
+
+        deadline = time.monotonic() + timeout
+        try:
+            self.producer.flush(timeout=timeout)
+        except KafkaTimeoutError:
+            logger.error('Timeout waiting for the acks of the messages sent to topic %s', topic)
+
+        results = []
+        for future in futures:
+            if future is None:
+                results.append(False)
+                continue
+            try:
+                future.get(timeout=max(deadline - time.monotonic(), 0))
+            except TopicAuthorizationFailedError:
+                logger.debug('Missing write permission to write in topic %s', topic)
+                results.append(False)
+            except KafkaError:
+                logger.debug('An error occurred sending message to topic %s. Error details %s', topic, format_exc())
+                results.append(False)
+            else:
+                results.append(True)
+        return results
+
+    def get_buffer_usage(self):
+        """
+        Returns the fraction (between 0 and 1) of the producer buffer memory in use, or None if it is not available.
+        When the buffer is full, the sends block until the broker acks the pending messages.
+        The producer metrics only report the time spent waiting for free buffers, so the memory in use is read
+        from the producer buffer pool of the pinned kafka-python version
+        """
+        if self.producer is None:
+            return None
+        try:
+            if self.producer.metrics()['producer-metrics']['bufferpool-wait-ratio'] > 0:
+                return 1.0
+            pool = self.producer._accumulator._free
+            buffers = self.producer.config['buffer_memory'] // self.producer.config['batch_size']
+            if pool.queued() > 0:
+                return 1.0
+            return 1.0 - len(pool._free) / buffers
+        except (AttributeError, KeyError, TypeError, ZeroDivisionError):
+            logger.warning('Cannot read the producer buffer usage. Error details %s', format_exc())
+            return None
+
     def send_async(self, topic, message, key=None):
         try:
             self._create_producer()
@@ -0,0 +1,44 @@
+# Generated by Django 2.2.5 on 2026-10-19 13:39
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hgw_common', '0002_failedmessages'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='failedmessages',
+            name='attempts',
+            field=models.PositiveIntegerField(default=0, help_text='Number of times the message has been replayed'),
+        ),
+        migrations.AddField(
+            model_name='failedmessages',
+            name='created',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddField(
+            model_name='failedmessages',
+            name='next_attempt_at',
+            field=models.DateTimeField(db_index=True, default=django.utils.timezone.now),
+        ),
+        migrations.AddField(
+            model_name='failedmessages',
+            name='updated',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AlterField(
+            model_name='failedmessages',
+            name='message',
+            field=models.TextField(),
+        ),
+        migrations.AlterField(
+            model_name='failedmessages',
+            name='reason',
+            field=models.CharField(max_length=30),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 2.2.5 on 2026-10-19 13:54
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hgw_common', '0003_failedmessages_replay'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OutboxMessage',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('topic', models.CharField(max_length=255)),
+                ('key', models.CharField(blank=True, max_length=255, null=True)),
+                ('message', models.TextField()),
+                ('attempts', models.PositiveIntegerField(default=0, help_text='Number of times the publishing failed')),
+                ('next_attempt_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+                ('created', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 2.2.5 on 2026-10-19 16:12
+
+from django.db import migrations, models
+
+
+def delete_tokens(apps, schema_editor):
+    # the client of the stored tokens is unknown: they will be requested again
+    AccessToken = apps.get_model('hgw_common', 'AccessToken')
+    AccessToken.objects.all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hgw_common', '0004_outboxmessage'),
+    ]
+
+    operations = [
+        migrations.RunPython(delete_tokens, migrations.RunPython.noop),
+        migrations.AddField(
+            model_name='accesstoken',
+            name='client_id',
+            field=models.CharField(default='', max_length=100),
+            preserve_default=False,
+        ),
+        migrations.AlterField(
+            model_name='accesstoken',
+            name='token_url',
+            field=models.CharField(max_length=200),
+        ),
+        migrations.AlterUniqueTogether(
+            name='accesstoken',
+            unique_together={('token_url', 'client_id')},
+        ),
+    ]
@@ -16,16 +16,23 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 import copy
 import logging
+import threading
+import time
 from datetime import datetime
 
-from django.db import models
+from django.conf import settings
+from django.db import connection, models
+from django.utils import timezone
 from django.utils.crypto import get_random_string
 from oauthlib.oauth2 import (BackendApplicationClient, MissingTokenError,
                              TokenExpiredError)
 from requests.exceptions import ConnectionError as RequestsConnectionError
+from requests.exceptions import Timeout
 from requests_oauthlib import OAuth2Session
 
 from hgw_common.fields import JSONValidator
+from hgw_common.http_client import get_http_client
+from hgw_common.utils.batches import get_retry_delay
 
 logger = logging.getLogger('hgw_common.models')
 
@@ -47,7 +54,8 @@ class Profile(models.Model):
 
 
 class AccessToken(models.Model):
-    token_url = models.CharField(max_length=200, null=False, blank=False, unique=True)
+    token_url = models.CharField(max_length=200, null=False, blank=False)
+    client_id = models.CharField(max_length=100, null=False, blank=False)
     access_token = models.CharField(max_length=1024, null=False, blank=False)
     token_type = models.CharField(max_length=10, null=False, blank=False)
     expires_in = models.IntegerField()
@@ -63,17 +71,119 @@ class AccessToken(models.Model):
             'scope': self.scope.split(" ")
         }
 
+    class Meta:
+        unique_together = ('token_url', 'client_id')
+
+
+TOKEN_REFRESH_MARGIN = 60
+TOKEN_IDLE_TIMEOUT = 3600
+
+
+class TokenCache(object):
+    """
+    Thread-safe, process-level cache of the OAuth2 tokens shared by all the :class:`OAuth2SessionProxy`.
+    The tokens are keyed by token url and client id, like the :class:`AccessToken` stored in the db. When a token is
+    stored together with a refresh function, the function is called in a background thread :attr:`refresh_margin`
+    seconds before the token expires. The tokens not requested for :attr:`idle_timeout` seconds are removed instead of being refreshed
+    """
+
+    def __init__(self, refresh_margin=TOKEN_REFRESH_MARGIN, idle_timeout=TOKEN_IDLE_TIMEOUT):
+        self.refresh_margin = refresh_margin
+        self.idle_timeout = idle_timeout
+        self._lock = threading.Lock()
+        self._tokens = {}
+        self._requested = {}
+        self._timers = {}
+        self._fetch_locks = {}
+
+    def get(self, key):
+        """
+        Returns the token for :param:`key` or None if it is not present or it is expired
+        """
+        with self._lock:
+            token = self._tokens.get(key)
+            if token is not None:
+                self._requested[key] = time.monotonic()
+        if token is not None and token['expires_at'] > time.time():
+            return token
+        return None
+
+    def set(self, key, token, refresh=None):
+        """
+        Stores the :param:`token` for :param:`key` and schedules the call to :param:`refresh`
+        """
+        with self._lock:
+            self._tokens[key] = token
+            self._requested.setdefault(key, time.monotonic())
+            timer = self._timers.pop(key, None)
+            if timer is not None:
+                timer.cancel()
+            delay = token['expires_at'] - self.refresh_margin - time.time()
+            if refresh is not None and delay > 0:
+                timer = threading.Timer(delay, self._refresh, args=(key, refresh))
+                timer.daemon = True
+                self._timers[key] = timer
+                timer.start()
+
+    def fetch_lock(self, key):
+        """
+        Returns the lock to be acquired to get a new token for :param:`key`, so that the threads of the process
+        don't request a token at the same time
+        """
+        with self._lock:
+            return self._fetch_locks.setdefault(key, threading.Lock())
+
+    def clear(self):
+        """
+        Removes all the tokens and cancels the scheduled refreshes
+        """
+        with self._lock:
+            for timer in self._timers.values():
+                timer.cancel()
+            self._timers.clear()
+            self._tokens.clear()
+            self._requested.clear()
+            self._fetch_locks.clear()
+
+    def _refresh(self, key, refresh):
+        with self._lock:
+            # the timer has fired: it must not keep the refresh function alive
+            if self._timers.get(key) is threading.current_thread():
+                del self._timers[key]
+            requested = self._requested.get(key)
+            if requested is None or time.monotonic() - requested > self.idle_timeout:
+                logger.debug('Removing the token for %s not requested for %s seconds', key[0], self.idle_timeout)
+                self._tokens.pop(key, None)
+                self._requested.pop(key, None)
+                self._fetch_locks.pop(key, None)
+                return
+        logger.debug('Refreshing the token for %s', key[0])
+        try:
+            refresh()
+        except Exception:
+            # the token will be requested again when it is needed
+            logger.warning('Error refreshing the token for %s', key[0], exc_info=True)
+        finally:
+            # the connection opened by the timer thread
+            connection.close()
+
+
+token_cache = TokenCache()
+
 
 class OAuth2SessionProxy(object):
     """
     This class can be used to access an OAuth2 protected resources. It reuses an AccessToken until the token expires.
-    It handles automatic creation and refresh of a token
+    It handles automatic creation and refresh of a token.
+    The tokens are shared among the instances of the process using :data:`token_cache` and they are refreshed before
+    they expire. The :class:`AccessToken` table is used to share the tokens with the other processes
     """
 
     def __init__(self, token_url, client_id, client_secret):
         self.token_url = token_url
         self.client_id = client_id
         self.client_secret = client_secret
+        self._key = (token_url, client_id)
         self._session = self.create_session()
 
     def request(self, method, url, **kwargs):
@@ -82,17 +192,18 @@ class OAuth2SessionProxy(object):
         """
         try:
             logger.debug('Performing request with method %s to %s', method, url)
+            self._update_token()
             meth = getattr(self._session, method.lower())
-            res = meth(url, **kwargs)            
+            res = meth(url, **kwargs)
             if res.status_code == 401:
                 raise TokenExpiredError
         except TokenExpiredError:
             logger.debug('Token expired. Getting a new one')
-            self._fetch_token(self._session)
+            self._fetch_token(self._session, stale_token=self._session.token)
             logger.debug('Retrying to perform the request')
             meth = getattr(self._session, method.lower())
             res = meth(url, **kwargs)
-        except RequestsConnectionError:
+        except (RequestsConnectionError, Timeout):
             logger.debug('Connection error performing %s on %s', method, url)
             res = None
         except MissingTokenError:
@@ -114,29 +225,70 @@ class OAuth2SessionProxy(object):
 
     def create_session(self):
         """
-        Creates an oauth session, getting a token
+        Creates an oauth session, getting a token from the cache, from the db or requesting a new one
         """
         client = BackendApplicationClient(self.client_id)
-        try:
-            logger.debug("Querying db to check for a previuos token for url: %s", self.token_url)
-            access_token = AccessToken.objects.get(token_url=self.token_url)
-        except AccessToken.DoesNotExist:
-            logger.debug("No token found in the db. Requesting a new one")
-            oauth_session = OAuth2Session(client=client)
+        token = token_cache.get(self._key) or self._get_db_token()
+        if token is None:
+            logger.debug("No valid token found. Requesting a new one")
+            oauth_session = get_http_client().mount(OAuth2Session(client=client))
             self._fetch_token(oauth_session)
         else:
             logger.debug("Token found")
-            oauth_session = OAuth2Session(client=client, token=access_token.to_python())
+            oauth_session = get_http_client().mount(OAuth2Session(client=client, token=token))
 
         return oauth_session
 
-    def _fetch_token(self, oauth_session):
+    def _get_db_token(self):
+        """
+        Gets the token from the db, where it has possibly been stored by another process, and stores it in the cache.
+        It returns None if the token is not present or it is expired
+        """
+        try:
+            logger.debug("Querying db to check for a previuos token for url: %s", self.token_url)
+            access_token = AccessToken.objects.get(token_url=self.token_url, client_id=self.client_id)
+        except AccessToken.DoesNotExist:
+            return None
+        token = access_token.to_python()
+        if token['expires_at'] <= time.time():
+            return None
+        token_cache.set(self._key, token, self._refresh_token)
+        return token
+
+    def _update_token(self):
+        """
+        Updates the session with the token in the cache, since it could have been refreshed by another proxy or in
+        background. If the token is expired it gets a new one before performing the request
+        """
+        token = token_cache.get(self._key)
+        if token is None:
+            self._fetch_token(self._session, stale_token=self._session.token)
+        elif token['access_token'] != (self._session.token or {}).get('access_token'):
+            self._session.token = token
+
+    def _fetch_token(self, oauth_session, stale_token=None):
+        """
+        Gets a new token for :param:`oauth_session`. If, in the meanwhile, another thread got a token different from
+        the :param:`stale_token`, it uses that token without requesting a new one
+        """
+        with token_cache.fetch_lock(self._key):
+            token = token_cache.get(self._key)
+            if token is not None and (stale_token is None or token['access_token'] != stale_token['access_token']):
+                oauth_session.token = token
+            else:
+                self._request_token(oauth_session)
+
+    def _refresh_token(self):
+        with token_cache.fetch_lock(self._key):
+            oauth_session = OAuth2Session(client=BackendApplicationClient(self.client_id))
+            self._request_token(get_http_client().mount(oauth_session))
 
+    def _request_token(self, oauth_session):
         try:
             oauth_session.fetch_token(token_url=self.token_url,
                                       client_id=self.client_id,
                                       client_secret=self.client_secret)
-        except RequestsConnectionError:
+        except (RequestsConnectionError, Timeout):
             logger.warning('Cannot obtain a token: the server is down')
             raise
 
@@ -149,13 +301,14 @@ class OAuth2SessionProxy(object):
         }
 
         try:
-            access_token = AccessToken.objects.get(token_url=self.token_url)
+            access_token = AccessToken.objects.get(token_url=self.token_url, client_id=self.client_id)
         except AccessToken.DoesNotExist:
-            AccessToken.objects.create(token_url=self.token_url, **token_data)
+            AccessToken.objects.create(token_url=self.token_url, client_id=self.client_id, **token_data)
         else:
             for k, v in token_data.items():
                 setattr(access_token, k, v)
             access_token.save()
+        token_cache.set(self._key, oauth_session.token, self._refresh_token)
 
 
 class FailedMessages(models.Model):
@@ -179,6 +332,51 @@ class FailedMessages(models.Model):
     #                (UNKNOWN_ERROR, 'UNKNOWN_ERROR'))
 
     message_type = models.CharField(max_length=30, blank=False, null=False)
-    message = models.CharField(max_length=1500, blank=False, null=False)
-    reason = models.CharField(max_length=10, blank=False, null=False)
-    retry = models.BooleanField(help_text="Boolean indicating if the message delivery should be retried")
\ No newline at end of file
+    message = models.TextField(blank=False, null=False)
+    reason = models.CharField(max_length=30, blank=False, null=False)
+    retry = models.BooleanField(help_text="Boolean indicating if the message delivery should be retried")
+    attempts = models.PositiveIntegerField(default=0, help_text="Number of times the message has been replayed")
+    next_attempt_at = models.DateTimeField(default=timezone.now, db_index=True)
+    created = models.DateTimeField(default=timezone.now)
+    updated = models.DateTimeField(auto_now=True)
+
+    @staticmethod
+    def get_retry_delay(attempts):
+        """
+        Returns the delay before the next replay, doubled at every attempt. The failure that saved the message is
+        not counted in the :param:`attempts`
+        """
+        return get_retry_delay(attempts + 1, getattr(settings, 'FAILED_MESSAGES_RETRY_BASE_DELAY', 30),
+                               getattr(settings, 'FAILED_MESSAGES_RETRY_MAX_DELAY', 3600))
+
+    def schedule_retry(self, reason, retry):
+        """
+        Updates the failure reason after a failed replay and schedules the next one. When the maximum number of
+        attempts is reached, the message is not replayed anymore
+        """
+        self.reason = reason
+        self.attempts += 1
+        self.retry = retry and self.attempts < getattr(settings, 'FAILED_MESSAGES_RETRY_MAX_ATTEMPTS', 10)
+        self.next_attempt_at = timezone.now() + self.get_retry_delay(self.attempts)
+
+
+class OutboxMessage(models.Model):
+    """
+    Model to store the messages to be published. The messages are saved in the same transaction of the changes they
+    notify and they are published by the relay (see :mod:`hgw_common.utils.outbox`), so that a notification is not
+    lost when the broker is unreachable and the requests don't wait for the broker
+    """
+    topic = models.CharField(max_length=255, blank=False, null=False)
+    key = models.CharField(max_length=255, blank=True, null=True)
+    message = models.TextField(blank=False, null=False)
+    attempts = models.PositiveIntegerField(default=0, help_text="Number of times the publishing failed")
+    next_attempt_at = models.DateTimeField(default=timezone.now, db_index=True)
+    created = models.DateTimeField(default=timezone.now)
+
+    @staticmethod
+    def get_retry_delay(attempts):
+        """
+        Returns the delay before the next attempt, doubled at every attempt
+        """
+        return get_retry_delay(attempts, getattr(settings, 'OUTBOX_RETRY_BASE_DELAY', 5),
+                               getattr(settings, 'OUTBOX_RETRY_MAX_DELAY', 300))
@@ -0,0 +1,57 @@
+# Copyright (c) 2017-2018 CRS4
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to use,
+# copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or
+# substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE
+# AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+from datetime import timedelta
+
+from django.test import TestCase
+from django.utils import timezone
+
+from hgw_common.models import FailedMessages, OutboxMessage
+from hgw_common.utils.batches import claim_batch, get_retry_delay
+
+
+class TestBatches(TestCase):
+
+    def test_retry_delay(self):
+        """
+        Tests that the delay is the base delay after the first failure, that it is doubled at every failure and that
+        it is capped
+        """
+        self.assertEqual([get_retry_delay(failures, 10, 50).total_seconds() for failures in range(1, 6)],
+                         [10, 20, 40, 50, 50])
+        # the failed messages don't count the failure that saved them, the outbox messages do
+        self.assertEqual(FailedMessages.get_retry_delay(0), get_retry_delay(1, 30, 3600))
+        self.assertEqual(OutboxMessage.get_retry_delay(1), get_retry_delay(1, 5, 300))
+
+    def test_claim_batch(self):
+        """
+        Tests that only the due rows are claimed, in order and at most the batch size, and that they are reserved
+        for the lease time
+        """
+        now = timezone.now()
+        messages = [OutboxMessage.objects.create(topic='topic', message=str(index), next_attempt_at=now)
+                    for index in range(3)]
+        OutboxMessage.objects.create(topic='topic', message='not due', next_attempt_at=now + timedelta(hours=1))
+
+        claimed = claim_batch(OutboxMessage.objects.all(), 2, 60, order_by=('pk',))
+        self.assertEqual([m.pk for m in claimed], [m.pk for m in messages[:2]])
+        for message in OutboxMessage.objects.filter(pk__in=[m.pk for m in claimed]):
+            self.assertTrue(message.next_attempt_at >= now + timedelta(seconds=60))
+
+        claimed = claim_batch(OutboxMessage.objects.all(), 2, 60, select=lambda rows: [])
+        self.assertEqual(claimed, [])
+        self.assertEqual([m.pk for m in claim_batch(OutboxMessage.objects.all(), 2, 60)], [messages[2].pk])
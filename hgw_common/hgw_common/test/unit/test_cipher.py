@@ -20,7 +20,8 @@ import unittest
 
 from Cryptodome.PublicKey import RSA
 
-from hgw_common.cipher import Cipher, NotEncryptedMessage
+from hgw_common.cipher import (ZLIB, ZSTD, Cipher, NotEncryptedMessage,
+                               encrypt_many, zstandard)
 
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -48,6 +49,60 @@ class CipherTest(unittest.TestCase):
         enc_message = self.cipher.encrypt(message)
         self.assertEqual(message.decode('utf-8'), self.cipher.decrypt(enc_message))
 
+    def test_encrypt_compressed(self):
+        message = '{"resourceType": "Observation", "status": "final"}' * 100
+        cipher = Cipher(public_key=self.cipher.public_key, private_key=self.cipher.private_key, compression=ZLIB)
+        enc_message = cipher.encrypt(message)
+        self.assertLess(len(enc_message), len(self.cipher.encrypt(message)))
+        self.assertEqual(message, cipher.decrypt(enc_message))
+        # the decrypting cipher doesn't need to know the compression used
+        self.assertEqual(message, self.cipher.decrypt(enc_message))
+
+    @unittest.skipIf(zstandard is None, 'zstandard is not installed')
+    def test_encrypt_compressed_zstd(self):
+        message = '{"resourceType": "Observation", "status": "final"}' * 100
+        cipher = Cipher(public_key=self.cipher.public_key, compression=ZSTD)
+        enc_message = cipher.encrypt(message)
+        self.assertLess(len(enc_message), len(self.cipher.encrypt(message)))
+        self.assertEqual(message, self.cipher.decrypt(enc_message))
+
+    def test_unsupported_compression(self):
+        self.assertRaises(Cipher.UnsupportedCompression, Cipher, public_key=self.cipher.public_key,
+                          compression='lzma')
+
+    def test_encrypt_many(self):
+        other_private_key = RSA.generate(2048)
+        other_cipher = Cipher(private_key=other_private_key)
+        payloads = ['message {}'.format(i) for i in range(6)]
+        recipients = [self.cipher.public_key, other_private_key.publickey().exportKey()] * 3
+        keys = ['channel_1', 'channel_2'] * 3
+
+        for max_workers in (1, 2):
+            # a new decrypting cipher is needed since the messages are encrypted with new AES keys
+            decrypters = [Cipher(private_key=self.cipher.private_key), Cipher(private_key=other_private_key)]
+            enc_messages = encrypt_many(payloads, recipients, keys, compression=ZLIB, max_workers=max_workers)
+            self.assertEqual(len(enc_messages), len(payloads))
+            for index, (payload, enc_message) in enumerate(zip(payloads, enc_messages)):
+                self.assertEqual(payload, decrypters[index % 2].decrypt(enc_message))
+            self.assertRaises(Exception, other_cipher.decrypt, enc_messages[0])
+
+    def test_encrypt_many_out_of_order(self):
+        """
+        Tests that the messages of different keys, or without keys, can be decrypted in any order
+        """
+        payloads = ['message {}'.format(i) for i in range(4)]
+        recipients = [self.cipher.public_key] * 4
+        for keys in (None, ['channel_1', 'channel_2', 'channel_3', 'channel_4']):
+            for max_workers in (1, 2):
+                decrypter = Cipher(private_key=self.cipher.private_key)
+                enc_messages = encrypt_many(payloads, recipients, keys, max_workers=max_workers)
+                for payload, enc_message in reversed(list(zip(payloads, enc_messages))):
+                    self.assertEqual(payload, decrypter.decrypt(enc_message))
+
+    def test_encrypt_many_wrong_length(self):
+        self.assertRaises(ValueError, encrypt_many, ['message'], [])
+        self.assertRaises(ValueError, encrypt_many, ['message'], [self.cipher.public_key], ['channel_1', 'channel_2'])
+
     def test_is_encrypted(self):
         message = 'message'
         self.assertFalse(self.cipher.is_encrypted(message))
@@ -0,0 +1,178 @@
+# Copyright (c) 2017-2018 CRS4
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to use,
+# copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or
+# substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE
+# AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread
+
+import requests
+from mock import patch
+
+from hgw_common.http_client import HTTPClient, JitterRetry
+from hgw_common.utils.mocks import get_free_port
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    """
+    Handler that keeps the connections alive. The path /status/<code>/<n>/ returns the status code
+    for the first n requests and 200 afterwards. The path /sleep/ waits before answering
+    """
+    protocol_version = 'HTTP/1.1'
+    CLIENT_PORTS = []
+    ERRORS_SENT = {}
+
+    def _handle(self):
+        self.CLIENT_PORTS.append(self.client_address[1])
+        status_code = 200
+        if self.path.startswith('/status/'):
+            code, count = self.path.split('/')[2:4]
+            sent = self.ERRORS_SENT.get(self.path, 0)
+            if sent < int(count):
+                self.ERRORS_SENT[self.path] = sent + 1
+                status_code = int(code)
+        elif self.path.startswith('/sleep/'):
+            time.sleep(0.5)
+        self.send_response(status_code)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def do_GET(self):
+        self._handle()
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self._handle()
+
+    def log_message(self, *args):
+        pass
+
+
+class TestHTTPClient(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        # the server must be multithreaded since the connections are kept alive
+        cls.server = ThreadingHTTPServer(('localhost', get_free_port()), MockHandler)
+        cls.server.daemon_threads = True
+        cls.thread = Thread(target=cls.server.serve_forever, daemon=True)
+        cls.thread.start()
+        cls.url = 'http://localhost:{}'.format(cls.server.server_port)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        MockHandler.CLIENT_PORTS = []
+        MockHandler.ERRORS_SENT = {}
+        self.client = HTTPClient(connect_timeout=1, read_timeout=0.2, retries=2, backoff_factor=0.01)
+
+    def test_connections_reused(self):
+        """
+        Tests that different sessions reuse the same connection to the host and that the metrics are collected
+        """
+        for _ in range(3):
+            res = self.client.request('get', '{}/'.format(self.url))
+            self.assertEqual(res.status_code, 200)
+        self.assertEqual(len(MockHandler.CLIENT_PORTS), 3)
+        self.assertEqual(len(set(MockHandler.CLIENT_PORTS)), 1)
+
+        metrics = self.client.get_metrics()['localhost:{}'.format(self.server.server_port)]
+        self.assertEqual(metrics['requests'], 3)
+        self.assertEqual(metrics['errors'], 0)
+        self.assertEqual(metrics['retries'], 0)
+
+    def test_metrics_logged(self):
+        """
+        Tests that the metrics are logged periodically
+        """
+        with self.assertLogs('hgw_common.http_client', level='INFO') as logs:
+            client = HTTPClient(metrics_log_interval=0)
+            client.request('get', '{}/'.format(self.url))
+        self.assertEqual(logs.output, [
+            'INFO:hgw_common.http_client:Requests to localhost:{}: 1 requests, 0 errors, 0 retries, {:.3f} seconds on '
+            'average'.format(self.server.server_port, client.get_metrics()[
+                'localhost:{}'.format(self.server.server_port)]['elapsed'])])
+
+        with patch('hgw_common.http_client.logger') as logger:
+            self.client.request('get', '{}/'.format(self.url))
+            logger.info.assert_not_called()
+
+    def test_adapter_per_certificate(self):
+        """
+        Tests that the connection pools are not shared among different client certificates
+        """
+        self.assertIs(self.client.get_adapter(), self.client.get_adapter())
+        self.assertIs(self.client.get_adapter(('cert', 'key')), self.client.get_adapter(['cert', 'key']))
+        self.assertIsNot(self.client.get_adapter(('cert', 'key')), self.client.get_adapter())
+        self.assertIsNot(self.client.get_adapter(('cert', 'key')), self.client.get_adapter(('cert2', 'key2')))
+
+    def test_mount(self):
+        """
+        Tests that the shared adapter can be mounted on an existing session
+        """
+        session = self.client.mount(requests.Session())
+        self.assertIs(session.get_adapter('https://host/'), self.client.get_adapter())
+        self.assertIs(session.get_adapter('http://host/'), self.client.get_adapter())
+
+    def test_read_timeout(self):
+        """
+        Tests that the default read timeout is applied
+        """
+        self.assertRaises(requests.exceptions.ReadTimeout, self.client.request, 'post', '{}/sleep/'.format(self.url))
+        metrics = self.client.get_metrics()['localhost:{}'.format(self.server.server_port)]
+        self.assertEqual(metrics['errors'], 1)
+
+    def test_retries(self):
+        """
+        Tests that the error responses are retried for idempotent methods
+        """
+        res = self.client.request('get', '{}/status/503/2/'.format(self.url))
+        self.assertEqual(res.status_code, 200)
+        metrics = self.client.get_metrics()['localhost:{}'.format(self.server.server_port)]
+        self.assertEqual(metrics['requests'], 1)
+        self.assertEqual(metrics['retries'], 2)
+
+        # the retries are bounded
+        res = self.client.request('get', '{}/status/503/5/'.format(self.url))
+        self.assertEqual(res.status_code, 503)
+
+    def test_post_not_retried(self):
+        """
+        Tests that error responses of not idempotent methods are not retried
+        """
+        res = self.client.request('post', '{}/status/503/1/'.format(self.url), json={})
+        self.assertEqual(res.status_code, 503)
+        self.assertEqual(len(MockHandler.CLIENT_PORTS), 1)
+
+    def test_connection_error(self):
+        """
+        Tests that connection errors are raised after the retries
+        """
+        self.assertRaises(requests.exceptions.ConnectionError, self.client.request, 'get', 'http://localhost:1/')
+        self.assertEqual(self.client.get_metrics()['localhost:1']['errors'], 1)
+
+    def test_backoff_jitter(self):
+        """
+        Tests that the backoff time is randomized between 0 and the exponential backoff
+        """
+        retry = JitterRetry(total=5, backoff_factor=1).increment().increment().increment()
+        for _ in range(20):
+            self.assertTrue(0 <= retry.get_backoff_time() <= 4)
+        self.assertEqual(JitterRetry(total=5, backoff_factor=1).get_backoff_time(), 0)
@@ -18,17 +18,21 @@
 """
 Tests senders
 """
+import io
 import json
 from unittest import TestCase
 
 from kafka.errors import (KafkaError, KafkaTimeoutError,
                           TopicAuthorizationFailedError)
+from kafka.producer.buffer import SimpleBufferPool
 from mock import Mock, patch
 
-from hgw_common.messaging import (BrokerConnectionError, TopicNotAssigned,
-                                  UnknownSender)
+from hgw_common.messaging import (BrokerConnectionError, NotInRangeError,
+                                  TopicNotAssigned, UnknownSender)
 from hgw_common.messaging.deserializer import JSONDeserializer
-from hgw_common.messaging.receiver import KafkaReceiver, create_receiver
+from hgw_common.messaging.frames import FrameError, pack_frame, read_frames
+from hgw_common.messaging.receiver import (KafkaReceiver, create_receiver,
+                                          create_watermarks)
 from hgw_common.messaging.sender import KafkaSender, create_sender
 from hgw_common.messaging.serializer import JSONSerializer
 from hgw_common.utils import create_broker_parameters_from_settings
@@ -110,6 +114,52 @@ class TestSender(TestCase):
         self.assertEqual(mocked_kafka_producer().send.call_args_list[0][0][0], TOPIC)
         self.assertEqual(mocked_kafka_producer().send.call_args_list[0][1]['value'], b'"message"')
 
+    @patch('hgw_common.utils.settings', SettingsNoSSLMock)
+    @patch('hgw_common.messaging.sender.KafkaProducer')
+    def test_message_send_many(self, mocked_kafka_producer):
+        """
+        Tests that send_many sends all the messages and returns the outcome of each one
+        """
+        failed_future = Mock()
+        failed_future.get.side_effect = KafkaError
+        mocked_kafka_producer().send.side_effect = [Mock(), failed_future, Mock()]
+        sender = create_sender(create_broker_parameters_from_settings())
+        results = sender.send_many(TOPIC, [('key_0', 'message_0'), ('key_1', 'message_1'), (None, {'message_2'})])
+        # the third message is not serializable so it is not sent
+        self.assertEqual(results, [True, False, False])
+        self.assertEqual(mocked_kafka_producer().send.call_count, 2)
+        self.assertEqual(mocked_kafka_producer().send.call_args_list[0][1]['key'], b'key_0')
+        self.assertEqual(mocked_kafka_producer().send.call_args_list[1][1]['value'], b'"message_1"')
+        mocked_kafka_producer().flush.assert_called_once_with(timeout=5)
+
+    @patch('hgw_common.utils.settings', SettingsNoSSLMock)
+    @patch('hgw_common.messaging.sender.KafkaProducer')
+    def test_message_send_many_timeout(self, mocked_kafka_producer):
+        """
+        Tests that send_many waits for the acks at most the timeout and that the messages not acked in time fail
+        """
+        acked_future = Mock()
+        pending_future = Mock()
+        pending_future.get.side_effect = KafkaTimeoutError
+        mocked_kafka_producer().send.side_effect = [acked_future, pending_future]
+        mocked_kafka_producer().flush.side_effect = KafkaTimeoutError
+        sender = create_sender(create_broker_parameters_from_settings())
+        with patch('hgw_common.messaging.sender.time.monotonic', side_effect=[100, 103, 104]):
+            results = sender.send_many(TOPIC, [('key_0', 'message_0'), ('key_1', 'message_1')], timeout=3)
+        self.assertEqual(results, [True, False])
+        mocked_kafka_producer().flush.assert_called_once_with(timeout=3)
+        # the acks are waited for within the remaining time
+        acked_future.get.assert_called_once_with(timeout=0)
+        pending_future.get.assert_called_once_with(timeout=0)
+
+    @patch('hgw_common.utils.settings', SettingsNoSSLMock)
+    def test_send_many_fail_no_broker(self):
+        """
+        Tests that, if the broker is not available, all the messages fail
+        """
+        sender = create_sender(create_broker_parameters_from_settings())
+        self.assertEqual(sender.send_many(TOPIC, [('key_0', 'message_0'), ('key_1', 'message_1')]), [False, False])
+
     @patch('hgw_common.utils.settings', SettingsNoSSLMock)
     def test_send_message_fail_no_broker(self):
         """
@@ -159,6 +209,50 @@ class TestSender(TestCase):
         self.assertFalse(sender.send(TOPIC, {'message'}))
 
 
+    def test_get_buffer_usage(self):
+        """
+        Tests that the buffer usage is computed from the buffers available in the producer pool
+        """
+        sender = KafkaSender({}, JSONSerializer)
+        self.assertIsNone(sender.get_buffer_usage())
+
+        pool = SimpleBufferPool(400, 100)
+        sender.producer = Mock(config={'buffer_memory': 400, 'batch_size': 100})
+        sender.producer.metrics.return_value = {'producer-metrics': {'bufferpool-wait-ratio': 0.0}}
+        sender.producer._accumulator._free = pool
+        self.assertEqual(sender.get_buffer_usage(), 0.0)
+        buffers = [pool.allocate(100, 0) for _ in range(3)]
+        self.assertEqual(sender.get_buffer_usage(), 0.75)
+        pool.deallocate(buffers[0])
+        self.assertEqual(sender.get_buffer_usage(), 0.5)
+
+        sender.producer.metrics.return_value = {'producer-metrics': {'bufferpool-wait-ratio': 0.1}}
+        self.assertEqual(sender.get_buffer_usage(), 1.0)
+
+    def test_get_buffer_usage_unavailable(self):
+        """
+        Tests that a warning is logged when the buffer usage cannot be read from the producer
+        """
+        sender = KafkaSender({}, JSONSerializer)
+        sender.producer = Mock(spec=['config', 'metrics'], config={'buffer_memory': 400, 'batch_size': 100})
+        sender.producer.metrics.return_value = {'producer-metrics': {}}
+        with self.assertLogs('hgw_common.sender', level='WARNING'):
+            self.assertIsNone(sender.get_buffer_usage())
+
+    def test_get_buffer_usage_kafka_producer(self):
+        """
+        Tests that the buffer usage can be read from a real KafkaProducer. It fails if a kafka-python upgrade
+        removes the metric or the buffer pool used by get_buffer_usage
+        """
+        sender = KafkaSender({'bootstrap_servers': 'localhost:9092', 'api_version': (1, 0, 0)}, JSONSerializer)
+        sender._create_producer()
+        try:
+            self.assertIn('bufferpool-wait-ratio', sender.producer.metrics()['producer-metrics'])
+            self.assertEqual(sender.get_buffer_usage(), 0.0)
+        finally:
+            sender.producer.close(timeout=0)
+
+
 class TestReceiver(TestCase):
     """
     Test senders class
@@ -188,7 +282,8 @@ class TestReceiver(TestCase):
             'ssl_check_hostname': True,
             'ssl_cafile': SettingsSSLMock.KAFKA_CA_CERT,
             'ssl_certfile': SettingsSSLMock.KAFKA_CLIENT_CERT,
-            'ssl_keyfile': SettingsSSLMock.KAFKA_CLIENT_KEY
+            'ssl_keyfile': SettingsSSLMock.KAFKA_CLIENT_KEY,
+            'enable_auto_commit': True
         }
         self.assertEqual(receiver.topics, [TOPIC])
         self.assertIsInstance(receiver.deserializer, JSONDeserializer)
@@ -220,7 +315,8 @@ class TestReceiver(TestCase):
             'ssl_check_hostname': True,
             'ssl_cafile': None,
             'ssl_certfile': None,
-            'ssl_keyfile': None
+            'ssl_keyfile': None,
+            'enable_auto_commit': True
         }
         self.assertEqual(receiver.topics, [TOPIC])
         self.assertIsInstance(receiver.deserializer, JSONDeserializer)
@@ -253,6 +349,102 @@ class TestReceiver(TestCase):
                 self.assertEqual(m['headers'], ('header_name', b'header_value'))
                 self.assertEqual(m['queue'], TOPIC)
 
+    @patch('hgw_common.utils.settings', SettingsNoSSLMock)
+    def test_message_commit(self):
+        """
+        Tests that the committed id is the one after the last committed message and that it is kept by group
+        """
+        with patch('hgw_common.messaging.receiver.KafkaConsumer', MockKafkaConsumer):
+            MockKafkaConsumer.COMMITTED = {}
+            self.set_mock_kafka_consumer(MockKafkaConsumer, ['message_{}'.format(i) for i in range(10)], TOPIC)
+
+            receiver = create_receiver(TOPIC, 'test_client', create_broker_parameters_from_settings(),
+                                       auto_commit=False)
+            self.assertFalse(receiver.config['enable_auto_commit'])
+            self.assertIsNone(receiver.get_committed_id(TOPIC))
+            receiver.commit_id(4, TOPIC)
+            self.assertEqual(receiver.get_committed_id(TOPIC), 5)
+
+            receiver = create_receiver(TOPIC, 'test_client', create_broker_parameters_from_settings())
+            self.assertEqual(receiver.get_committed_id(TOPIC), 5)
+            receiver = create_receiver(TOPIC, 'other_client', create_broker_parameters_from_settings())
+            self.assertIsNone(receiver.get_committed_id(TOPIC))
+
+    @patch('hgw_common.utils.settings', SettingsNoSSLMock)
+    def test_watermarks(self):
+        """
+        Tests that the watermarks are cached, that they are used by the receiver and that they are refreshed
+        """
+        with patch('hgw_common.messaging.receiver.KafkaConsumer', MockKafkaConsumer):
+            self.set_mock_kafka_consumer(MockKafkaConsumer, ['message_{}'.format(i) for i in range(10)], TOPIC)
+            MockKafkaConsumer.END = 10
+
+            watermarks = create_watermarks(create_broker_parameters_from_settings(), ttl=60)
+            receiver = create_receiver(TOPIC, 'test_client', create_broker_parameters_from_settings(),
+                                       watermarks=watermarks)
+            self.assertEqual(watermarks.get(TOPIC), (0, 9))
+
+            MockKafkaConsumer.FIRST = 2
+            MockKafkaConsumer.END = 12
+            self.assertEqual(receiver.get_first_id(TOPIC), 0)
+            self.assertEqual(receiver.get_last_id(TOPIC), 9)
+            self.assertEqual(watermarks.get(TOPIC, refresh=True), (2, 11))
+            self.assertEqual(receiver.get_last_id(TOPIC), 11)
+
+            MockKafkaConsumer.END = 13
+            watermarks.clear()
+            self.assertEqual(receiver.get_last_id(TOPIC), 12)
+
+            self.assertRaises(ValueError, create_watermarks, create_broker_parameters_from_settings(), ttl=0)
+
+    @patch('hgw_common.utils.settings', SettingsNoSSLMock)
+    def test_watermarks_broker_error(self):
+        """
+        Tests that the cached ids are returned, even if they are old, when the broker is not available, and that the
+        ids older than the ttl are fetched again when the background refresh is disabled
+        """
+        now = [0]
+        with patch('hgw_common.messaging.receiver.KafkaConsumer', MockKafkaConsumer):
+            self.set_mock_kafka_consumer(MockKafkaConsumer, ['message_{}'.format(i) for i in range(10)], TOPIC)
+            MockKafkaConsumer.END = 10
+            watermarks = create_watermarks(create_broker_parameters_from_settings(), ttl=2,
+                                           background_refresh=False, clock=lambda: now[0])
+            self.assertEqual(watermarks.get(TOPIC), (0, 9))
+            self.assertIsNone(watermarks._refresher)
+
+            MockKafkaConsumer.END = 12
+            now[0] = 2
+            self.assertEqual(watermarks.get(TOPIC), (0, 9))
+            now[0] = 3
+            self.assertEqual(watermarks.get(TOPIC), (0, 11))
+
+            with patch.object(MockKafkaConsumer, 'end_offsets', side_effect=KafkaError):
+                self.assertEqual(watermarks.get(TOPIC, refresh=True), (0, 11))
+                now[0] = 10
+                self.assertEqual(watermarks.get(TOPIC), (0, 11))
+                self.assertRaises(KafkaError, watermarks.get, 'other_topic')
+
+    @patch('hgw_common.utils.settings', SettingsNoSSLMock)
+    def test_message_stream(self):
+        """
+        Tests that the stream returns the messages from the start id and None when no message is available
+        """
+        with patch('hgw_common.messaging.receiver.KafkaConsumer', MockKafkaConsumer):
+            messages = ['message_{}'.format(i) for i in range(10)]
+
+            self.set_mock_kafka_consumer(MockKafkaConsumer, messages, TOPIC)
+            # the end offset is the offset of the next message to be produced
+            MockKafkaConsumer.END = len(messages)
+
+            receiver = create_receiver(TOPIC, 'test_client', create_broker_parameters_from_settings())
+
+            stream = list(receiver.stream(7, TOPIC, timeout=0))
+            self.assertEqual([m['id'] for m in stream], [7, 8, 9])
+            self.assertEqual([m['data'] for m in stream], messages[7:])
+
+            self.assertEqual(list(receiver.stream(10, TOPIC, timeout=0)), [None])
+            self.assertRaises(NotInRangeError, next, receiver.stream(11, TOPIC, timeout=0))
+
     @patch('hgw_common.utils.settings', SettingsNoSSLMock)
     def test_message_receive_by_id(self):
         """
@@ -363,3 +555,26 @@ class TestReceiver(TestCase):
                 self.assertEqual(m['key'], None)
                 self.assertEqual(m['headers'], ('header_name', b'header_value'))
                 self.assertEqual(m['success'], False)
+
+
+class TestFrames(TestCase):
+
+    def test_frames(self):
+        """
+        Tests that the frames are read correctly, also when the stream returns less bytes than requested
+        """
+        frames = [({'message_id': i, 'channel_id': 'channel'}, bytes(range(256)) * i) for i in range(5)]
+        data = b''.join(pack_frame(header, payload) for header, payload in frames)
+        self.assertEqual(list(read_frames(io.BytesIO(data))), frames)
+
+        class SlowStream(io.BytesIO):
+            def read(self, size=-1):
+                return super(SlowStream, self).read(min(size, 3))
+
+        self.assertEqual(list(read_frames(SlowStream(data))), frames)
+        self.assertEqual(list(read_frames(io.BytesIO(b''))), [])
+
+    def test_truncated_frames(self):
+        data = pack_frame({'message_id': 0}, b'payload')
+        for size in (2, 6, len(data) - 1):
+            self.assertRaises(FrameError, list, read_frames(io.BytesIO(data[:size])))
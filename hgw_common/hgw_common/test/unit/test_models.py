@@ -1,14 +1,16 @@
 import os
+import time
 from datetime import datetime, timedelta
+from threading import Event
 from django.test import TestCase
-from mock import patch, call
+from mock import Mock, patch, call
 from oauthlib.oauth2 import TokenExpiredError, InvalidClientError
 
 from hgw_common.utils.mocks import MockOAuth2Session
 
 os.environ['DJANGO_SETTINGS_MODULE'] = 'hgw_common.test.settings'
 
-from hgw_common.models import OAuth2SessionProxy, AccessToken
+from hgw_common.models import OAuth2SessionProxy, AccessToken, TokenCache, token_cache
 
 
 class OAuthProxyTest(TestCase):
@@ -17,6 +19,7 @@ class OAuthProxyTest(TestCase):
         self.service_url = 'https://oauth2service'
         self.client_id = 'id'
         self.client_secret = 'secret'
+        token_cache.clear()
 
     def test_create_proxy(self):
         """
@@ -50,7 +53,7 @@ class OAuthProxyTest(TestCase):
                       'expires_in': 36000,
                       'expires_at': (datetime.now() + timedelta(hours=10)).isoformat(),
                       'scope': 'read write'}
-        AccessToken.objects.create(token_url=self.service_url, **token_data)
+        AccessToken.objects.create(token_url=self.service_url, client_id=self.client_id, **token_data)
         with patch('hgw_common.models.OAuth2Session', new_callable=MockOAuth2Session) as mock:
             mock(200)
             OAuth2SessionProxy(self.service_url, self.client_id, self.client_secret)
@@ -150,4 +153,99 @@ class OAuthProxyTest(TestCase):
             self.assertEqual(len(session.fetch_token.call_args_list), 2)  # Number of calls
             session.post.assert_has_calls([call('/fake_url/1/'), call('/fake_url/1/')])
             self.assertEqual(AccessToken.objects.count(), 1)
-            self.assertNotEquals(first_token, second_token)
\ No newline at end of file
+            self.assertNotEquals(first_token, second_token)
+
+    def test_access_token_cached(self):
+        """
+        Tests that the proxies of the same process share the token without querying the db
+        """
+        with patch('hgw_common.models.OAuth2Session', MockOAuth2Session):
+            MockOAuth2Session.RESPONSES = [200]
+            proxy = OAuth2SessionProxy(self.service_url, self.client_id, self.client_secret)
+            with self.assertNumQueries(0):
+                other_proxy = OAuth2SessionProxy(self.service_url, self.client_id, self.client_secret)
+                other_proxy.get("/fake_url/1/")
+            self.assertEqual(other_proxy._session.token['access_token'], proxy._session.token['access_token'])
+            other_proxy._session.fetch_token.assert_not_called()
+
+    def test_access_token_per_client(self):
+        """
+        Tests that the clients of the same token url don't share the token
+        """
+        with patch('hgw_common.models.OAuth2Session', MockOAuth2Session):
+            MockOAuth2Session.RESPONSES = [200]
+            OAuth2SessionProxy(self.service_url, self.client_id, self.client_secret)
+            other_proxy = OAuth2SessionProxy(self.service_url, 'other_id', 'other_secret')
+            other_proxy._session.fetch_token.assert_called_once()
+            self.assertEqual(AccessToken.objects.count(), 2)
+            self.assertEqual(AccessToken.objects.get(client_id='other_id').access_token,
+                             other_proxy._session.token['access_token'])
+
+    def test_expired_access_token_from_db_not_used(self):
+        """
+        Tests that an expired token in the db is not used, so that the first request doesn't fail with 401
+        """
+        token_data = {'access_token': 'OUfprCnmdJbhYAIk8rGMex4UBLXyf3',
+                      'token_type': 'Bearer',
+                      'expires_in': 36000,
+                      'expires_at': (datetime.now() - timedelta(hours=1)).isoformat(),
+                      'scope': 'read write'}
+        AccessToken.objects.create(token_url=self.service_url, client_id=self.client_id, **token_data)
+        with patch('hgw_common.models.OAuth2Session', MockOAuth2Session):
+            MockOAuth2Session.RESPONSES = [200]
+            proxy = OAuth2SessionProxy(self.service_url, self.client_id, self.client_secret)
+            proxy._session.fetch_token.assert_called_once()
+            self.assertNotEqual(AccessToken.objects.get().access_token, token_data['access_token'])
+
+    def test_access_token_refreshed_by_other_proxy(self):
+        """
+        Tests that a proxy uses the token refreshed by another proxy and that it gets a new token before
+        performing the request if the token is expired
+        """
+        with patch('hgw_common.models.OAuth2Session', MockOAuth2Session):
+            MockOAuth2Session.RESPONSES = [200]
+            proxy = OAuth2SessionProxy(self.service_url, self.client_id, self.client_secret)
+            other_proxy = OAuth2SessionProxy(self.service_url, self.client_id, self.client_secret)
+
+            other_proxy._fetch_token(other_proxy._session, stale_token=other_proxy._session.token)
+            proxy.get("/fake_url/1/")
+            self.assertEqual(proxy._session.token['access_token'], other_proxy._session.token['access_token'])
+            proxy._session.fetch_token.assert_called_once()
+
+            token_cache.get((self.service_url, self.client_id))['expires_at'] = time.time() - 1
+            proxy.get("/fake_url/2/")
+            self.assertEqual(proxy._session.fetch_token.call_count, 2)
+            self.assertEqual(proxy._session.get.call_count, 2)
+
+    def test_token_cache_background_refresh(self):
+        """
+        Tests that the refresh function is called before the token expires
+        """
+        cache = TokenCache(refresh_margin=10)
+        refreshed = Event()
+        refresh = Mock(side_effect=refreshed.set)
+        cache.set(('url', 'id'), {'access_token': 'token', 'expires_at': time.time() + 10.1}, refresh)
+        self.assertTrue(refreshed.wait(5))
+        refresh.assert_called_once()
+
+        # tokens too close to the expiration are not refreshed in background
+        refresh.reset_mock()
+        cache.set(('url', 'id'), {'access_token': 'token', 'expires_at': time.time() + 5}, refresh)
+        cache.clear()
+        self.assertIsNone(cache.get(('url', 'id')))
+        refresh.assert_not_called()
+
+    def test_token_cache_idle_token_not_refreshed(self):
+        """
+        Tests that the tokens not requested for idle_timeout seconds are removed instead of being refreshed
+        """
+        cache = TokenCache(refresh_margin=10, idle_timeout=0)
+        refresh = Mock()
+        cache.set(('url', 'id'), {'access_token': 'token', 'expires_at': time.time() + 10.1}, refresh)
+        timer = cache._timers[('url', 'id')]
+        timer.join(5)
+        self.assertFalse(timer.is_alive())
+        refresh.assert_not_called()
+        self.assertIsNone(cache.get(('url', 'id')))
+        self.assertEqual(cache._timers, {})
+        self.assertEqual(cache._requested, {})
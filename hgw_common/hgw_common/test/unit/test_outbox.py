@@ -0,0 +1,132 @@
+# Copyright (c) 2017-2018 CRS4
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to use,
+# copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or
+# substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE
+# AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import json
+from datetime import timedelta
+
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from mock import MagicMock
+
+from hgw_common.models import OutboxMessage
+from hgw_common.utils.outbox import OutboxRelay, enqueue, enqueue_many
+
+
+class TestOutboxRelay(TestCase):
+
+    def setUp(self):
+        self.sender = MagicMock()
+        self.sender.send_many.side_effect = lambda topic, messages: [True] * len(messages)
+        self.relay = OutboxRelay(self.sender, batch_size=2)
+
+    def test_enqueue(self):
+        """
+        Tests that the messages are saved in the outbox serialized in json
+        """
+        enqueue('topic', {'id': 0})
+        enqueue_many('other_topic', [('key_1', {'id': 1}), (None, {'id': 2})])
+        messages = list(OutboxMessage.objects.order_by('pk'))
+        self.assertEqual([(m.topic, m.key, json.loads(m.message)) for m in messages],
+                         [('topic', None, {'id': 0}), ('other_topic', 'key_1', {'id': 1}),
+                          ('other_topic', None, {'id': 2})])
+        self.sender.send_many.assert_not_called()
+
+    def test_relay(self):
+        """
+        Tests that the due messages are published in batches, grouped by topic and in order, and that they are
+        removed when they are acked
+        """
+        enqueue('topic', {'id': 0})
+        enqueue('other_topic', {'id': 1}, key='key')
+        enqueue('topic', {'id': 2})
+        OutboxMessage.objects.create(topic='topic', message=json.dumps({'id': 3}),
+                                     next_attempt_at=timezone.now() + timedelta(hours=1))
+
+        metrics = self.relay.run(once=True)
+        self.assertEqual([c[0] for c in self.sender.send_many.call_args_list],
+                         [('topic', [(None, b'{"id": 0}')]), ('other_topic', [('key', b'{"id": 1}')]),
+                          ('topic', [(None, b'{"id": 2}')])])
+        self.assertEqual([json.loads(m.message) for m in OutboxMessage.objects.all()], [{'id': 3}])
+        self.assertEqual(metrics['batches'], 2)
+        self.assertEqual(metrics['published'], 3)
+        self.assertEqual(metrics['failed'], 0)
+
+    @override_settings(OUTBOX_RETRY_BASE_DELAY=10)
+    def test_relay_failure(self):
+        """
+        Tests that the messages not acked are kept and published again with exponential backoff
+        """
+        enqueue('topic', {'id': 0})
+        enqueue('topic', {'id': 1})
+        self.sender.send_many.side_effect = lambda topic, messages: [False, True]
+
+        before = timezone.now()
+        metrics = self.relay.run(once=True)
+        self.assertEqual(metrics['published'], 1)
+        self.assertEqual(metrics['failed'], 1)
+        failed = OutboxMessage.objects.get()
+        self.assertEqual(json.loads(failed.message), {'id': 0})
+        self.assertEqual(failed.attempts, 1)
+        self.assertTrue(before + timedelta(seconds=10) <= failed.next_attempt_at)
+
+        # the message is not published before the delay
+        self.relay.run(once=True)
+        self.assertEqual(self.sender.send_many.call_count, 1)
+
+        OutboxMessage.objects.update(next_attempt_at=before)
+        self.sender.send_many.side_effect = lambda topic, messages: [True]
+        self.relay.run(once=True)
+        self.assertEqual(OutboxMessage.objects.count(), 0)
+
+    @override_settings(OUTBOX_RETRY_BASE_DELAY=10)
+    def test_relay_failure_keeps_order(self):
+        """
+        Tests that when a message is not acked the following ones with the same key are not published, even if
+        they are in the same batch, and that they are published in order after the retry
+        """
+        self.relay.batch_size = 10
+        enqueue('topic', {'id': 0, 'status': 'AC'}, key='consent')
+        enqueue('topic', {'id': 1}, key='other')
+        enqueue('topic', {'id': 0, 'status': 'RE'}, key='consent')
+        # the first message of the key "consent" fails, the other ones would succeed
+        self.sender.send_many.side_effect = lambda topic, messages: [m[0] != 'consent' for m in messages]
+
+        before = timezone.now()
+        metrics = self.relay.run(once=True)
+        self.assertEqual([c[0] for c in self.sender.send_many.call_args_list],
+                         [('topic', [('consent', b'{"id": 0, "status": "AC"}'), ('other', b'{"id": 1}')])])
+        self.assertEqual(metrics['published'], 1)
+        self.assertEqual(metrics['failed'], 2)
+        waiting = list(OutboxMessage.objects.order_by('pk'))
+        self.assertEqual([json.loads(m.message)['status'] for m in waiting], ['AC', 'RE'])
+        self.assertEqual([m.attempts for m in waiting], [1, 0])
+        self.assertTrue(all(before + timedelta(seconds=10) <= m.next_attempt_at for m in waiting))
+
+        # a new message of the same key is not published before the ones waiting for the retry
+        enqueue('topic', {'id': 0, 'status': 'AC'}, key='consent')
+        self.relay.run(once=True)
+        self.assertEqual(self.sender.send_many.call_count, 1)
+
+        OutboxMessage.objects.update(next_attempt_at=before)
+        self.sender.send_many.reset_mock()
+        self.sender.send_many.side_effect = lambda topic, messages: [True] * len(messages)
+        self.relay.run(once=True)
+        self.assertEqual([c[0] for c in self.sender.send_many.call_args_list],
+                         [('topic', [('consent', b'{"id": 0, "status": "AC"}')]),
+                          ('topic', [('consent', b'{"id": 0, "status": "RE"}')]),
+                          ('topic', [('consent', b'{"id": 0, "status": "AC"}')])])
+        self.assertEqual(OutboxMessage.objects.count(), 0)
@@ -0,0 +1,117 @@
+# Copyright (c) 2017-2018 CRS4
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to use,
+# copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or
+# substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE
+# AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import json
+from datetime import timedelta
+
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from hgw_common.models import FailedMessages
+from hgw_common.utils.management import ConsumerCommand
+from hgw_common.utils.replay import FailedMessagesReplayer
+
+
+class MockConsumer(ConsumerCommand):
+    """
+    Consumer that fails the messages with a "fail" key
+    """
+    failed_message_type = 'MOCK'
+
+    def __init__(self, *args, **kwargs):
+        self.handled = []
+        super(MockConsumer, self).__init__(*args, **kwargs)
+
+    def handle_message(self, message):
+        self.handled.append(message)
+        if message.get('raise'):
+            raise ValueError()
+        if message.get('fail'):
+            self.store_failure(message, message['fail'], message['fail'] == 'RETRIABLE')
+
+
+class TestFailedMessagesReplayer(TestCase):
+
+    def setUp(self):
+        self.consumer = MockConsumer()
+        self.replayer = FailedMessagesReplayer({'MOCK': self.consumer}, batch_size=2)
+
+    def _create_failed_message(self, message, message_type='MOCK', **kwargs):
+        kwargs.setdefault('next_attempt_at', timezone.now() - timedelta(seconds=1))
+        return FailedMessages.objects.create(message_type=message_type, message=json.dumps(message),
+                                             reason='RETRIABLE', retry=True, **kwargs)
+
+    def test_store_failure(self):
+        """
+        Tests that the consumer stores the failed messages scheduling the first replay
+        """
+        message = {'id': 1, 'data': 'x' * 2000, 'fail': 'RETRIABLE'}
+        self.consumer.handle_message(message)
+        failed_message = FailedMessages.objects.get()
+        self.assertEqual(failed_message.message_type, 'MOCK')
+        self.assertEqual(json.loads(failed_message.message), message)
+        self.assertTrue(failed_message.retry)
+        self.assertEqual(failed_message.attempts, 0)
+        self.assertTrue(failed_message.next_attempt_at > timezone.now())
+
+    def test_replay(self):
+        """
+        Tests that the due messages are fed again to the consumer in batches and that the succeeded ones are removed
+        """
+        for i in range(3):
+            self._create_failed_message({'id': i})
+        self._create_failed_message({'id': 3}, next_attempt_at=timezone.now() + timedelta(hours=1))
+        self._create_failed_message({'id': 4}, message_type='OTHER')
+
+        metrics = self.replayer.run(once=True)
+        self.assertEqual([m['id'] for m in self.consumer.handled], [0, 1, 2])
+        self.assertEqual(sorted(json.loads(m.message)['id'] for m in FailedMessages.objects.all()), [3, 4])
+        self.assertEqual(metrics['batches'], 2)
+        self.assertEqual(metrics['replayed'], 3)
+        self.assertEqual(metrics['succeeded'], 3)
+        self.assertEqual(metrics['failed'], 0)
+        self.assertTrue(metrics['throughput'] > 0)
+
+    @override_settings(FAILED_MESSAGES_RETRY_BASE_DELAY=10, FAILED_MESSAGES_RETRY_MAX_ATTEMPTS=2)
+    def test_replay_failure(self):
+        """
+        Tests that the messages that fail again are rescheduled with exponential backoff and are not replayed
+        anymore after the maximum number of attempts
+        """
+        retriable = self._create_failed_message({'id': 0, 'fail': 'RETRIABLE'})
+        not_retriable = self._create_failed_message({'id': 1, 'fail': 'NOT_RETRIABLE'})
+        error = self._create_failed_message({'id': 2, 'raise': True})
+
+        before = timezone.now()
+        self.replayer.run(once=True)
+        for failed_message in (retriable, not_retriable, error):
+            failed_message.refresh_from_db()
+            self.assertEqual(failed_message.attempts, 1)
+        self.assertEqual(FailedMessages.objects.count(), 3)
+        self.assertTrue(retriable.retry)
+        self.assertTrue(before + timedelta(seconds=20) <= retriable.next_attempt_at)
+        self.assertFalse(not_retriable.retry)
+        self.assertEqual(not_retriable.reason, 'NOT_RETRIABLE')
+        self.assertTrue(error.retry)
+        self.assertEqual(error.reason, 'ValueError')
+
+        FailedMessages.objects.update(next_attempt_at=before)
+        self.replayer.run(once=True)
+        retriable.refresh_from_db()
+        self.assertEqual(retriable.attempts, 2)
+        self.assertFalse(retriable.retry)
+        self.assertEqual(len(self.consumer.handled), 5)
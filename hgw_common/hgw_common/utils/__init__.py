@@ -73,11 +73,14 @@ def get_oauth_token(server_uri, client_id, client_secret):
 
 class ERRORS:
     MISSING_PARAMETERS = 'missing_parameters'
+    INVALID_PARAMETERS = 'invalid_parameters'
     FORBIDDEN = 'forbidden'
     NOT_AUTHENTICATED = 'not_authenticated'
     NOT_FOUND = 'not_found'
     DUPLICATED = 'duplicated'
     DB_ERROR = 'database_error'
+    BROKER_ERROR = 'broker_error'
+    TOO_MANY_REQUESTS = 'too_many_requests'
 
 
 def custom_exception_handler(exc, context):
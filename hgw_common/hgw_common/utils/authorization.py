@@ -35,7 +35,10 @@ class TokenHasResourceDetailedScope(TokenHasScope):
 
     For example: if the View class specifies `required_scopes = ['myscope']` and
     `view_custom_instance = {'myaction': {'read': ['custom']}}`
-    the token must have ['myscope:read', 'myscope:custom'] to access the view
+    the token must have ['myscope:read', 'myscope:custom'] to access the view.
+
+    The View class can also specify, in `read_actions`, the actions that, even if they use an unsafe method,
+    require the read scope (e.g., the acknowledgement of received data)
     """
 
     def get_scopes(self, request, view):
@@ -52,7 +55,8 @@ class TokenHasResourceDetailedScope(TokenHasScope):
         except ImproperlyConfigured:
             view_scopes = []
 
-        if request.method.upper() in SAFE_HTTP_METHODS:
+        if request.method.upper() in SAFE_HTTP_METHODS or \
+                getattr(view, 'action', None) in getattr(view, 'read_actions', ()):
             scope_type = [oauth2_settings.READ_SCOPE]
             try:
                 if view.action in view_specific_scopes and 'read' in view_specific_scopes[view.action]:
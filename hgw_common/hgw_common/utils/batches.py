@@ -0,0 +1,107 @@
+# Copyright (c) 2017-2018 CRS4
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to use,
+# copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or
+# substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE
+# AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+Helpers for the workers that process the rows of a table in batches, like the replay of the failed messages and the
+relay of the outbox.
+
+The due rows are claimed using SELECT ... FOR UPDATE SKIP LOCKED and they are reserved for a lease time, so that more
+workers can run concurrently. The rows that fail are rescheduled with exponential backoff.
+"""
+
+import time
+from datetime import timedelta
+
+from django.db import transaction
+from django.utils import timezone
+
+
+def get_retry_delay(failures, base_delay, max_delay):
+    """
+    Returns the delay before the next attempt after :param:`failures` failed attempts: it is :param:`base_delay`
+    seconds after the first failure and it is doubled at every failure, up to :param:`max_delay` seconds
+    """
+    return timedelta(seconds=min(base_delay * 2 ** max(failures - 1, 0), max_delay))
+
+
+def claim_batch(queryset, batch_size, lease, field='next_attempt_at', order_by=None, select=None):
+    """
+    Claims at most :param:`batch_size` rows of the :param:`queryset` that are due, i.e., whose :param:`field` is in
+    the past, and reserves them for :param:`lease` seconds moving :param:`field` forward
+
+    :param order_by: the ordering of the claimed rows. By default they are ordered by :param:`field`
+    :param select: an optional function that receives the locked rows and returns the ones to be claimed
+    :return: the list of the claimed rows
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        rows = list(queryset.select_for_update(skip_locked=True).filter(**{'{}__lte'.format(field): now})
+                    .order_by(*(order_by or (field,)))[:batch_size])
+        if select is not None:
+            rows = select(rows)
+        if rows:
+            queryset.model.objects.filter(pk__in=[row.pk for row in rows]).update(
+                **{field: now + timedelta(seconds=lease)})
+    return rows
+
+
+class BatchWorker(object):
+    """
+    Base class of the workers that process the rows in batches. It keeps the metrics of the batches and it runs the
+    processing loop. The subclasses implement :meth:`process_batch`
+
+    :param counters: the names of the counters of the worker metrics
+    :param throughput_counter: the counter used to compute the throughput
+    """
+
+    def __init__(self, counters, throughput_counter):
+        self.throughput_counter = throughput_counter
+        self.metrics = dict.fromkeys(('batches',) + tuple(counters), 0)
+        self.metrics['elapsed'] = 0.0
+
+    def process_batch(self):
+        """
+        Processes a batch of rows. It returns the number of rows claimed
+        """
+        raise NotImplementedError
+
+    def update_metrics(self, elapsed, **counters):
+        """
+        Adds a batch processed in :param:`elapsed` seconds to the metrics, incrementing the :param:`counters`
+        """
+        self.metrics['batches'] += 1
+        self.metrics['elapsed'] += elapsed
+        for counter, value in counters.items():
+            self.metrics[counter] += value
+
+    def get_metrics(self):
+        """
+        Returns the metrics of the worker. The throughput is expressed in rows per second
+        """
+        metrics = dict(self.metrics)
+        metrics['throughput'] = metrics[self.throughput_counter] / metrics['elapsed'] if metrics['elapsed'] else 0.0
+        return metrics
+
+    def run(self, once=False, interval=10):
+        """
+        Processes the due rows. If :param:`once` is False it waits :param:`interval` seconds when there are no
+        rows to process and starts again, otherwise it returns the metrics
+        """
+        while True:
+            if self.process_batch() == 0:
+                if once:
+                    return self.get_metrics()
+                time.sleep(interval)
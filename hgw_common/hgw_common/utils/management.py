@@ -14,10 +14,13 @@
 # AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
 # DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+import json
 
 from django.core.management.base import BaseCommand
+from django.utils import timezone
 
 from hgw_common.messaging.receiver import create_receiver
+from hgw_common.models import FailedMessages
 from hgw_common.utils import create_broker_parameters_from_settings
 
 
@@ -25,8 +28,13 @@ class ConsumerCommand(BaseCommand):
     """
     This class implements a Django Command that consumes message from a kafka topic.
     It provides connection funcionalities. Subclasses must implement only the 
-    real handling of the messages
+    real handling of the messages.
+    The messages that cannot be handled can be stored with :meth:`store_failure` using the
+    :attr:`failed_message_type` of the subclass. The ones marked to be retried are replayed later
+    by the FailedMessages replayer, that feeds them again to :meth:`handle_message`
     """
+    failed_message_type = None
+    _replay_failures = None
 
     def handle(self, *args, **options):
         receiver = create_receiver(self.topics, self.group_id, create_broker_parameters_from_settings())
@@ -34,4 +42,29 @@ class ConsumerCommand(BaseCommand):
             self.handle_message(msg)
 
     def handle_message(self, message):
-        raise NotImplementedError
\ No newline at end of file
+        raise NotImplementedError
+
+    def store_failure(self, message, reason, retry):
+        """
+        Stores a message that failed to be handled. If the message is being replayed, the failure is returned
+        to the replayer instead
+        """
+        if self._replay_failures is not None:
+            self._replay_failures.append((reason, retry))
+            return
+        FailedMessages.objects.create(message_type=self.failed_message_type, message=json.dumps(message),
+                                      reason=reason, retry=retry,
+                                      next_attempt_at=timezone.now() + FailedMessages.get_retry_delay(0))
+
+    def replay_message(self, message):
+        """
+        Handles again a message that previously failed. It returns the tuple (reason, retry) if the message
+        fails again, None otherwise
+        """
+        self._replay_failures = []
+        try:
+            self.handle_message(message)
+            failures = self._replay_failures
+        finally:
+            self._replay_failures = None
+        return failures[-1] if failures else None
@@ -129,14 +129,29 @@ class MockKafkaConsumer(object):
     MESSAGES = []
     FIRST = 0
     END = 1
+    COMMITTED = {}
 
     def __init__(self, *args, **kwargs):
         super(MockKafkaConsumer, self).__init__()
         self.counter = 0
+        self.group_id = kwargs.get('group_id')
+
+    def committed(self, topic_partition):
+        return self.COMMITTED.get((self.group_id, topic_partition))
+
+    def commit(self, offsets):
+        for topic_partition, offset in offsets.items():
+            self.COMMITTED[(self.group_id, topic_partition)] = offset.offset
 
     def subscribe(self, topics):
         self.topics = topics
 
+    def partitions_for_topic(self, topic):
+        return {0}
+
+    def assign(self, topic_partitions):
+        self.topics = [tp.topic for tp in topic_partitions]
+
     def assignment(self):
         return set([TopicPartition(topic, 0) for topic in self.topics])
 
@@ -149,6 +164,21 @@ class MockKafkaConsumer(object):
     def seek(self, topics_partition, index):
         self.counter = index
 
+    def poll(self, timeout_ms=0, max_records=None):
+        # poll with 0 timeout is used to force the assignment: it simulates that no message has been fetched yet
+        if timeout_ms == 0:
+            return {}
+        messages = []
+        while max_records is None or len(messages) < max_records:
+            try:
+                messages.append(self.MESSAGES[self.counter])
+            except (KeyError, IndexError):
+                break
+            self.counter += 1
+        if not messages:
+            return {}
+        return {TopicPartition(self.topics[0], 0): messages}
+
     def __getattr__(self, item):
         return MagicMock()
 
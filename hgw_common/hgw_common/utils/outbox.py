@@ -0,0 +1,173 @@
+# Copyright (c) 2017-2018 CRS4
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to use,
+# copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or
+# substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE
+# AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+Transactional outbox for the messages published to the broker.
+
+The messages are saved in :class:`hgw_common.models.OutboxMessage` by :func:`enqueue`, in the same transaction of the
+changes they notify, and they are published by :class:`OutboxRelay`. The relay claims the messages in batches (see
+:mod:`hgw_common.utils.batches`), publishes them without waiting for the acks of the single messages and deletes them
+when the broker acks them. The messages not acked are published again later,
+with exponential backoff. The messages with the same topic and key are published in the order they were saved: a
+message is published only after the previous ones with the same key have been acked, so when one of them is not acked
+the following ones wait for it to be published again.
+"""
+
+import json
+import logging
+import time
+from collections import OrderedDict, deque
+
+from django.db import DatabaseError, transaction
+from django.db.models import Min
+from django.utils import timezone
+
+from hgw_common.messaging.sender import create_sender
+from hgw_common.messaging.serializer import RawSerializer
+from hgw_common.models import OutboxMessage
+from hgw_common.utils import create_broker_parameters_from_settings
+from hgw_common.utils.batches import BatchWorker, claim_batch
+
+logger = logging.getLogger('hgw_common.outbox')
+
+
+def enqueue(topic, message, key=None):
+    """
+    Saves the :param:`message` to be published in the :param:`topic`. It must be called in the transaction of the
+    changes notified by the message
+    """
+    return OutboxMessage.objects.create(topic=topic, key=key, message=json.dumps(message))
+
+
+def enqueue_many(topic, messages):
+    """
+    Saves many messages to be published in the :param:`topic`.
+
+    :param messages: a list of tuples (key, message)
+    """
+    return OutboxMessage.objects.bulk_create([OutboxMessage(topic=topic, key=key, message=json.dumps(message))
+                                              for key, message in messages])
+
+
+class OutboxRelay(BatchWorker):
+    """
+    Publishes the messages of the outbox.
+
+    :param sender: the sender used to publish the messages. If it is None it is created from the settings
+    :param batch_size: number of messages claimed at once
+    :param lease: seconds a claimed message is reserved to the relay
+    """
+
+    def __init__(self, sender=None, batch_size=500, lease=60):
+        super(OutboxRelay, self).__init__(('published', 'failed'), 'published')
+        self.sender = sender
+        self.batch_size = batch_size
+        self.lease = lease
+
+    @staticmethod
+    def _drop_blocked(messages):
+        """
+        Removes from the claimed :param:`messages` the ones preceded by a message with the same topic and key that
+        has not been claimed (i.e., it is waiting for a retry or it is claimed by another relay)
+        """
+        keys = {m.key for m in messages if m.key is not None}
+        if not keys:
+            return messages
+        pending = OutboxMessage.objects.filter(key__in=keys).exclude(pk__in=[m.pk for m in messages]) \
+            .values('topic', 'key').annotate(first=Min('pk'))
+        first_pending = {(p['topic'], p['key']): p['first'] for p in pending}
+        return [m for m in messages
+                if m.key is None or (m.topic, m.key) not in first_pending or m.pk < first_pending[(m.topic, m.key)]]
+
+    def claim_batch(self):
+        """
+        Claims the due messages, reserving them for the lease time
+        """
+        return claim_batch(OutboxMessage.objects.all(), self.batch_size, self.lease, order_by=('pk',),
+                           select=self._drop_blocked)
+
+    def _publish(self, messages):
+        """
+        Publishes the messages grouped by topic. The messages with the same topic and key are published in rounds, one
+        per round, and when one of them is not acked the following ones are not published. The messages without key
+        are all published in the first round. It returns the pks of the messages acked and of the ones not acked
+        """
+        if self.sender is None:
+            self.sender = create_sender(create_broker_parameters_from_settings(), serializer=RawSerializer)
+        queues = OrderedDict()
+        for message in messages:
+            group = (message.topic, message.key if message.key is not None else 'pk:{}'.format(message.pk))
+            queues.setdefault(group, deque()).append(message)
+
+        acked = set()
+        failed = set()
+        while queues:
+            topics = OrderedDict()
+            for group, queue in queues.items():
+                topics.setdefault(group[0], []).append((group, queue.popleft()))
+            for topic, topic_messages in topics.items():
+                outcomes = self.sender.send_many(topic, [(m.key, m.message.encode('utf-8'))
+                                                         for _, m in topic_messages])
+                for (group, message), sent in zip(topic_messages, outcomes):
+                    if sent:
+                        acked.add(message.pk)
+                    else:
+                        failed.add(message.pk)
+                        # the following messages with the same key wait for this one
+                        del queues[group]
+            queues = OrderedDict((group, queue) for group, queue in queues.items() if queue)
+        return acked, failed
+
+    def process_batch(self):
+        """
+        Publishes a batch of messages. It returns the number of messages claimed
+        """
+        start = time.monotonic()
+        try:
+            messages = self.claim_batch()
+        except DatabaseError:
+            logger.error('Error claiming the outbox messages')
+            return 0
+        if not messages:
+            return 0
+
+        acked, failed = self._publish(messages)
+        not_acked = [m for m in messages if m.pk not in acked]
+        now = timezone.now()
+        retry_at = {}
+        for message in not_acked:
+            if message.pk in failed:
+                message.attempts += 1
+                message.next_attempt_at = now + OutboxMessage.get_retry_delay(message.attempts)
+                retry_at[(message.topic, message.key)] = message.next_attempt_at
+        for message in not_acked:
+            if message.pk not in failed:
+                # the message has not been published, since a previous one with the same key has not been acked
+                message.next_attempt_at = retry_at[(message.topic, message.key)]
+        try:
+            with transaction.atomic():
+                OutboxMessage.objects.filter(pk__in=acked).delete()
+                OutboxMessage.objects.bulk_update(not_acked, ['attempts', 'next_attempt_at'])
+        except DatabaseError:
+            # the acked messages will be published again after the lease
+            logger.error('Error saving the results of the published messages')
+
+        elapsed = time.monotonic() - start
+        self.update_metrics(elapsed, published=len(acked), failed=len(not_acked))
+        if not_acked:
+            logger.warning('%s messages not published. They will be retried', len(not_acked))
+        logger.info('Published %s messages in %.3f seconds', len(acked), elapsed)
+        return len(messages)
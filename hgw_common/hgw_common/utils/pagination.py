@@ -0,0 +1,128 @@
+# Copyright (c) 2017-2018 CRS4
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to use,
+# copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or
+# substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE
+# AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+"""
+Keyset pagination and NDJSON streaming of querysets for the REST list views.
+
+The pagination is enabled when the client specifies the `limit` or the `after` query parameters: the rows are ordered
+by an indexed unique column (the key) and the page contains the first `limit` rows with the key greater than `after`.
+If there are more rows, the key of the last row is returned in the `X-Next-After` header, to be used as the `after`
+parameter of the next request. Differently from offset pagination, the cost of a page doesn't depend on its position
+and no count query is needed.
+
+When the client asks for `application/x-ndjson` (with the Accept header or with `?format=ndjson`), the rows are
+streamed one per line, reading them from the database in chunks, so that they are never all in memory.
+"""
+
+import json
+
+from django.core.exceptions import ValidationError
+from django.http import StreamingHttpResponse
+from rest_framework import status
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+from rest_framework.utils.encoders import JSONEncoder
+
+from hgw_common.utils import ERRORS
+
+DEFAULT_PAGE_LIMIT = 100
+MAX_PAGE_LIMIT = 1000
+STREAM_CHUNK_SIZE = 500
+NEXT_AFTER_HEADER = 'X-Next-After'
+
+
+class NDJSONRenderer(JSONRenderer):
+    """
+    Renderer used to negotiate the NDJSON streaming. The rows are written directly by :func:`list_response`,
+    so it renders only the errors, in json
+    """
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+
+
+def _get_limit(request, default):
+    limit = int(request.GET.get('limit', default))
+    if limit <= 0:
+        raise ValueError('The limit must be positive')
+    return min(limit, MAX_PAGE_LIMIT)
+
+
+def iter_chunks(queryset, key='id', after=None, chunk_size=STREAM_CHUNK_SIZE):
+    """
+    Generator that returns the rows of the :param:`queryset` with :param:`key` greater than :param:`after`, ordered
+    by :param:`key`. The rows are read with one query every :param:`chunk_size` rows. Differently from
+    :meth:`QuerySet.iterator`, the `select_related` and `prefetch_related` of the queryset are applied to every chunk
+    """
+    queryset = queryset.order_by(key)
+    while True:
+        chunk_queryset = queryset if after is None else queryset.filter(**{'{}__gt'.format(key): after})
+        chunk = list(chunk_queryset[:chunk_size])
+        for obj in chunk:
+            yield obj
+        if len(chunk) < chunk_size:
+            return
+        after = getattr(chunk[-1], key)
+
+
+def _stream_response(queryset, serializer_class, key, limit):
+    def generate():
+        for index, obj in enumerate(iter_chunks(queryset, key)):
+            if limit is not None and index >= limit:
+                return
+            yield json.dumps(serializer_class(obj).data, cls=JSONEncoder) + '\n'
+
+    return StreamingHttpResponse(generate(), content_type=NDJSONRenderer.media_type)
+
+
+def list_response(request, queryset, serializer_class, key='id', headers=None):
+    """
+    Returns the response of a list view for the :param:`queryset`, serialized using :param:`serializer_class`.
+    Depending on the request, the rows are paginated, streamed or, for backward compatibility, all returned in one
+    response with the `X-Total-Count` header
+
+    :param key: the name of the indexed unique column used to order and paginate the rows
+    :param headers: additional headers of the response
+    """
+    headers = headers or {}
+    after = request.GET.get('after')
+    paginated = 'limit' in request.GET or after is not None
+    try:
+        if after is not None:
+            queryset = queryset.filter(**{'{}__gt'.format(key): after})
+
+        if request.accepted_renderer.format == NDJSONRenderer.format:
+            limit = _get_limit(request, MAX_PAGE_LIMIT) if 'limit' in request.GET else None
+            response = _stream_response(queryset, serializer_class, key, limit)
+            for header, value in headers.items():
+                response[header] = value
+            return response
+
+        if not paginated:
+            data = serializer_class(queryset, many=True).data
+            headers['X-Total-Count'] = len(data)
+            return Response(data, headers=headers)
+
+        limit = _get_limit(request, DEFAULT_PAGE_LIMIT)
+        # it gets one more row to know if there is a next page
+        rows = list(queryset.order_by(key)[:limit + 1])
+    except (ValueError, ValidationError):
+        return Response({'errors': [ERRORS.INVALID_PARAMETERS]}, status.HTTP_400_BAD_REQUEST)
+
+    if len(rows) > limit:
+        rows = rows[:limit]
+        headers[NEXT_AFTER_HEADER] = getattr(rows[-1], key)
+    return Response(serializer_class(rows, many=True).data, headers=headers)
@@ -0,0 +1,110 @@
+# Copyright (c) 2017-2018 CRS4
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to use,
+# copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or
+# substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE
+# AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+Replay of the messages stored in :class:`hgw_common.models.FailedMessages`.
+
+The messages marked to be retried are claimed in batches (see :mod:`hgw_common.utils.batches`) and fed again to
+the :meth:`handle_message` of the consumer registered for their message type. The messages that fail again are
+rescheduled with exponential backoff.
+"""
+
+import json
+import logging
+import time
+
+from django.db import DatabaseError, transaction
+from django.utils import timezone
+
+from hgw_common.models import FailedMessages
+from hgw_common.utils.batches import BatchWorker, claim_batch
+
+logger = logging.getLogger('hgw_common.replay')
+
+
+class FailedMessagesReplayer(BatchWorker):
+    """
+    Replays the failed messages.
+
+    :param consumers: dict with the message types as keys and the consumers (instances of
+        :class:`hgw_common.utils.management.ConsumerCommand`) that handle them as values
+    :param batch_size: number of messages claimed at once
+    :param lease: seconds a claimed message is reserved to the replayer
+    """
+
+    def __init__(self, consumers, batch_size=100, lease=300):
+        super(FailedMessagesReplayer, self).__init__(('replayed', 'succeeded', 'failed'), 'replayed')
+        self.consumers = consumers
+        self.batch_size = batch_size
+        self.lease = lease
+
+    def claim_batch(self):
+        """
+        Claims the due messages, reserving them for the lease time
+        """
+        return claim_batch(FailedMessages.objects.filter(retry=True, message_type__in=list(self.consumers.keys())),
+                           self.batch_size, self.lease)
+
+    def _replay(self, failure):
+        consumer = self.consumers[failure.message_type]
+        try:
+            message = json.loads(failure.message)
+        except ValueError:
+            logger.error('Cannot decode the failed message %s', failure.pk)
+            return 'JSON_DECODING', False
+        try:
+            return consumer.replay_message(message)
+        except Exception as ex:
+            logger.exception('Error replaying the failed message %s', failure.pk)
+            return type(ex).__name__[:30], True
+
+    def process_batch(self):
+        """
+        Replays a batch of messages. It returns the number of messages claimed
+        """
+        start = time.monotonic()
+        try:
+            failures = self.claim_batch()
+        except DatabaseError:
+            logger.error('Error claiming the failed messages')
+            return 0
+        if not failures:
+            return 0
+
+        succeeded = []
+        failed = []
+        for failure in failures:
+            result = self._replay(failure)
+            if result is None:
+                succeeded.append(failure.pk)
+            else:
+                failure.schedule_retry(*result)
+                # bulk_update doesn't set the auto_now fields
+                failure.updated = timezone.now()
+                failed.append(failure)
+        try:
+            with transaction.atomic():
+                FailedMessages.objects.filter(pk__in=succeeded).delete()
+                FailedMessages.objects.bulk_update(failed, ['reason', 'retry', 'attempts', 'next_attempt_at',
+                                                            'updated'])
+        except DatabaseError:
+            logger.error('Error saving the results of the replayed messages')
+
+        elapsed = time.monotonic() - start
+        self.update_metrics(elapsed, replayed=len(failures), succeeded=len(succeeded), failed=len(failed))
+        logger.info('Replayed %s messages in %.3f seconds (%.1f messages/s): %s succeeded, %s failed',
+                    len(failures), elapsed, len(failures) / elapsed if elapsed else 0.0, len(succeeded), len(failed))
+        return len(failures)
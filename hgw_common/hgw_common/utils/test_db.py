@@ -0,0 +1,45 @@
+# Copyright (c) 2017-2018 CRS4
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to use,
+# copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or
+# substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE
+# AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+"""
+Database utilities for the unit tests that check the query plans
+"""
+import re
+
+from django.db import connection
+
+
+def get_used_indexes(queryset, column):
+    """
+    Returns the names of the indexes on :param:`column` that the database uses to execute the :param:`queryset`,
+    according to its query plan (i.e., the output of EXPLAIN). It works with SQLite and PostgreSQL
+    """
+    table = queryset.model._meta.db_table
+    with connection.cursor() as cursor:
+        constraints = connection.introspection.get_constraints(cursor, table)
+    indexes = [name for name, constraint in constraints.items()
+               if (constraint['index'] or constraint['unique']) and constraint['columns'][:1] == [column]]
+    plan = queryset.explain()
+    return [name for name in indexes if re.search(r'\b{}\b'.format(re.escape(name)), plan)]
+
+
+def analyze_db():
+    """
+    Updates the statistics used by the database query planner
+    """
+    with connection.cursor() as cursor:
+        cursor.execute('ANALYZE')
@@ -33,6 +33,9 @@ setup(
         'PyYAML==5.1.1',
         'djangosaml2==0.17.2',
     ],
+    extras_require={
+        'zstd': ['zstandard'],
+    },
     package_data={},
     data_files=[],
     entry_points={},
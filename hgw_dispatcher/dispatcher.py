@@ -36,6 +36,7 @@ from hgw_common.messaging.receiver import create_receiver
 from hgw_common.messaging.sender import create_sender
 from hgw_common.messaging.serializer import RawSerializer
 from hgw_common.messaging.deserializer import RawDeserializer
+from hgw_common.http_client import get_http_client
 
 def get_path(base_path, file_path):
     return file_path if os.path.isabs(file_path) else os.path.join(base_path, file_path)
@@ -136,7 +137,7 @@ class Dispatcher(object):
     def _obtain_oauth_token(url, client_id, client_secret):
         logger.debug('Getting OAuth token from %s', url)
         client = BackendApplicationClient(client_id)
-        oauth_session = OAuth2Session(client=client)
+        oauth_session = get_http_client().mount(OAuth2Session(client=client))
         token_url = '{}/oauth2/token/'.format(url)
         try:
             res = oauth_session.fetch_token(token_url=token_url, client_id=client_id,
@@ -144,7 +145,7 @@ class Dispatcher(object):
         except InvalidClientError:
             logger.error("Cannot obtain the token from %s. Invalid client", url)
             return None
-        except requests.exceptions.ConnectionError:
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
             logger.error(traceback.format_exc())
             logger.error("Cannot obtain the token from %s. Connection error", url)
             return None
@@ -225,7 +226,7 @@ class Dispatcher(object):
                 logger.debug('Consent token expired: getting new one')
                 self._obtain_consent_oauth_token()
                 cm_res = self.consent_oauth_session.get('{}/v1/consents/{}/'.format(CONSENT_MANAGER_URI, consent_id))
-        except requests.exceptions.ConnectionError:
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
             logger.error('Cannot connect to the Consent Manager to verify the channel status. Skipping')
         else:
             if cm_res.status_code == 200:  # checks that the consent is active
@@ -236,7 +237,7 @@ class Dispatcher(object):
                         # gets from the hgw frontend the channel_id and the process_id
                         channel_id = self._get_channel_id(consent_id)
                         process_id = self._get_process_id(channel_id)
-                    except requests.exceptions.ConnectionError:
+                    except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
                         logger.error('Cannot connect to HGW Frontend to get the channel and process id. Skipping')
                     else:
                         if channel_id and process_id:
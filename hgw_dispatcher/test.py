@@ -459,6 +459,31 @@ class TestDispatcher(TestCase):
                 d.run()
                 mocked_kafka_producer().send.assert_not_called()
 
+    @patch('hgw_common.messaging.sender.KafkaProducer')
+    @patch('dispatcher.HGW_BACKEND_URI', HGW_BACKEND_URI)
+    @patch('dispatcher.HGW_FRONTEND_URI', HGW_FRONTEND_URI)
+    @patch('dispatcher.CONSENT_MANAGER_URI', CONSENT_MANAGER_URI)
+    def test_timeout_on_message_dispatching(self, mocked_kafka_producer):
+        """
+        Tests that if the consent manager or the hgw frontend time out the message is skipped and the dispatcher
+        goes on with the next ones
+        """
+        with patch('hgw_common.messaging.receiver.KafkaConsumer', MockKafkaConsumer):
+            in_messages = [
+                b'first_message',
+                b'second_message'
+            ]
+            self.set_mock_kafka_consumer(MockKafkaConsumer, in_messages, SOURCES[0]['source_id'], ACTIVE_CONSENT_ID)
+            for session in ('consent_oauth_session', 'hgw_frontend_oauth_session'):
+                d = Dispatcher('kafka:9093', None, None, None, True)
+                mock_oauth2_session = MagicMock()
+                mock_oauth2_session.get.side_effect = requests.exceptions.ReadTimeout()
+
+                with patch.object(d, session, mock_oauth2_session):
+                    d.run()
+                    self.assertEqual(mock_oauth2_session.get.call_count, len(in_messages))
+                    mocked_kafka_producer().send.assert_not_called()
+
     @patch('hgw_common.messaging.sender.KafkaProducer')
     @patch('dispatcher.HGW_BACKEND_URI', HGW_BACKEND_URI)
     @patch('dispatcher.HGW_FRONTEND_URI', HGW_FRONTEND_URI)
@@ -15,12 +15,10 @@
 # DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 
-import json
 import logging
 from datetime import datetime
 
 from hgw_common.messaging.sender import create_sender
-from hgw_common.models import FailedMessages
 from hgw_common.utils import create_broker_parameters_from_settings
 from hgw_common.utils.management import ConsumerCommand
 from hgw_frontend.models import Channel, ConsentConfirmation, Destination
@@ -55,6 +53,7 @@ FAILED_MESSAGE_TYPE = 'CONSENT'
 
 class Command(ConsumerCommand):
     help = 'Launch Backend Notification Consumer'
+    failed_message_type = FAILED_MESSAGE_TYPE
 
     def __init__(self, *args, **kwargs):
         self.group_id = 'consent_manager_notification_consumer'
@@ -113,11 +112,27 @@ class Command(ConsumerCommand):
         else:
             logger.info('Channel operation notified')
 
+    def _renotify(self, consent, action):
+        """
+        Sends again a notification that failed. The channel has been already updated when the notification failed,
+        so it is only checked that it is still consistent with the action
+        """
+        channel = ConsentConfirmation.objects.get(consent_id=consent['consent_id']).channel
+        if action == ACTION.REVOKED:
+            consistent = channel.status == Channel.CONSENT_REVOKED
+        else:
+            consistent = channel.status in (Channel.ACTIVE, Channel.WAITING_SOURCE_NOTIFICATION)
+        if not consistent:
+            logger.debug('The channel changed after the failed notification. Not notifying')
+            return FAILED_REASON.INCONSISTENT_STATUS
+        return self._notify(consent, action)
+
     def handle_message(self, message):
         logger.info('Found message for queue %s', message['queue'])
 
         failure_reason = None
         retry = False
+        action = None
         if not message['success']:
             logger.error('Cannot handle message. JSON Error')
             failure_reason = FAILED_REASON.JSON_DECODING
@@ -125,7 +140,12 @@ class Command(ConsumerCommand):
             consent = message['data']
 
             failure_reason = self._validate_consent(consent)
-            if failure_reason is None:
+            if failure_reason is None and message.get('notification_action') is not None:
+                # replay of a message whose notification failed
+                action = message['notification_action']
+                failure_reason = self._renotify(consent, action)
+                retry = failure_reason == FAILED_REASON.FAILED_NOTIFICATION
+            elif failure_reason is None:
                 consent_confirmation = ConsentConfirmation.objects.get(consent_id=consent['consent_id'])
                 channel = consent_confirmation.channel
                 if consent['status'] == 'AC' and channel.status == Channel.CONSENT_REQUESTED:  # Consent confirmed
@@ -135,7 +155,8 @@ class Command(ConsumerCommand):
                     channel.status = Channel.WAITING_SOURCE_NOTIFICATION
                     channel.save()
 
-                    failure_reason = self._notify(consent, ACTION.CREATED)
+                    action = ACTION.CREATED
+                    failure_reason = self._notify(consent, action)
                     if failure_reason is not None:
                         retry = True
                 elif consent['status'] == 'AC' and channel.status in (Channel.ACTIVE, Channel.WAITING_SOURCE_NOTIFICATION):  # Consent changed
@@ -150,7 +171,8 @@ class Command(ConsumerCommand):
                         channel.expire_validity = consent['expire_validity']
                         channel.save()
                         
-                        failure_reason = self._notify(consent, ACTION.UPDATED)
+                        action = ACTION.UPDATED
+                        failure_reason = self._notify(consent, action)
                         if failure_reason is not None:
                             retry = True
                     else:
@@ -164,7 +186,8 @@ class Command(ConsumerCommand):
                     channel.status = Channel.CONSENT_REVOKED
                     channel.save()
 
-                    failure_reason = self._notify(consent, ACTION.REVOKED)
+                    action = ACTION.REVOKED
+                    failure_reason = self._notify(consent, action)
                     if failure_reason is not None:
                         retry = True
                 else:
@@ -172,7 +195,7 @@ class Command(ConsumerCommand):
                     retry = False
 
         if failure_reason is not None:
-            FailedMessages.objects.create(
-                message_type=FAILED_MESSAGE_TYPE, message=json.dumps(message),
-                reason=failure_reason, retry=retry
-            )
+            if retry:
+                # the channel has been already updated, so the replay only needs to send the notification again
+                message = dict(message, notification_action=action)
+            self.store_failure(message, failure_reason, retry)
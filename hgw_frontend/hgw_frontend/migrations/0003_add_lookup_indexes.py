@@ -0,0 +1,28 @@
+# Generated by Django 2.2.5 on 2026-10-19 18:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hgw_frontend', '0002_add_channel_fields'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='channel',
+            name='channel_id',
+            field=models.CharField(db_index=True, max_length=32),
+        ),
+        migrations.AlterField(
+            model_name='consentconfirmation',
+            name='confirmation_id',
+            field=models.CharField(db_index=True, max_length=32),
+        ),
+        migrations.AlterField(
+            model_name='flowrequest',
+            name='process_id',
+            field=models.CharField(db_index=True, max_length=32),
+        ),
+    ]
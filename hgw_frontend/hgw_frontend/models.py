@@ -49,7 +49,7 @@ class FlowRequest(models.Model):
     )
 
     flow_id = models.CharField(max_length=32, blank=False)
-    process_id = models.CharField(max_length=32, blank=False)
+    process_id = models.CharField(max_length=32, blank=False, db_index=True)
     status = models.CharField(max_length=2, choices=STATUS_CHOICES, blank=False, default=PENDING)
     person_id = models.CharField(max_length=20, blank=True, null=True)
     profile = models.ForeignKey('hgw_common.Profile', on_delete=models.CASCADE, null=True)
@@ -83,7 +83,7 @@ class Channel(models.Model):
         (CONSENT_REVOKED, 'CONSENT_REVOKED')
     )
 
-    channel_id = models.CharField(max_length=32, blank=False)
+    channel_id = models.CharField(max_length=32, blank=False, db_index=True)
     flow_request = models.ForeignKey(FlowRequest, null=False, on_delete=models.PROTECT)
     source = models.ForeignKey(Source, null=False, on_delete=models.PROTECT)
     status = models.CharField(max_length=2, choices=STATUS_CHOICES, blank=False)
@@ -126,7 +126,7 @@ class ConsentConfirmation(models.Model):
     flow_request = models.ForeignKey(FlowRequest, on_delete=models.CASCADE)
     channel = models.ForeignKey(Channel, on_delete=models.CASCADE)
     consent_id = models.CharField(max_length=32, blank=False, null=False, unique=True)
-    confirmation_id = models.CharField(max_length=32, blank=False, null=False)
+    confirmation_id = models.CharField(max_length=32, blank=False, null=False, db_index=True)
     destination_endpoint_callback_url = models.CharField(max_length=100, blank=False, null=False)
 
     def __unicode__(self):
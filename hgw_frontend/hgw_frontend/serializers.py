@@ -18,6 +18,7 @@
 
 import logging
 
+from django.db.models import Prefetch
 from rest_framework import serializers
 
 from hgw_common.models import Profile
@@ -48,6 +49,13 @@ class SourceSerializer(serializers.ModelSerializer):
         instance.save()
         return instance
 
+    @staticmethod
+    def setup_eager_loading(queryset):
+        """
+        Returns the :param:`queryset` with the related objects needed by the serializer, loaded in the same query
+        """
+        return queryset.select_related('profile')
+
     class Meta:
         model = Source
         fields = ('source_id', 'name', 'profile')
@@ -86,6 +94,15 @@ class FlowRequestSerializer(serializers.ModelSerializer):
 
         return flow_request
 
+    @staticmethod
+    def setup_eager_loading(queryset):
+        """
+        Returns the :param:`queryset` with the related objects needed by the serializer, loaded with two more queries
+        regardless of the number of flow requests
+        """
+        return queryset.select_related('profile').prefetch_related(
+            Prefetch('sources', queryset=SourceSerializer.setup_eager_loading(Source.objects.all())))
+
     class Meta:
         model = FlowRequest
         fields = ('flow_id', 'process_id', 'status', 'profile', 'destination', 'sources', 'start_validity', 'expire_validity')
@@ -100,6 +117,13 @@ class ChannelSerializer(serializers.ModelSerializer):
         model = Channel
         fields = ('channel_id', 'status', 'destination_id', 'source', 'profile', 'start_validity', 'expire_validity')
 
+    @staticmethod
+    def setup_eager_loading(queryset):
+        """
+        Returns the :param:`queryset` with the related objects needed by the serializer, loaded in the same query
+        """
+        return queryset.select_related('flow_request__destination', 'flow_request__profile', 'source__profile')
+
     @staticmethod
     def get_destination_id(obj):
         return obj.flow_request.destination.destination_id
@@ -338,3 +338,14 @@ if NOTIFICATION_TYPE == 'kafka':
     KAFKA_CA_CERT = get_path(BASE_CONF_DIR, cfg['kafka']['ca_cert'])
     KAFKA_CLIENT_CERT = get_path(BASE_CONF_DIR, cfg['kafka']['client_cert'])
     KAFKA_CLIENT_KEY = get_path(BASE_CONF_DIR, cfg['kafka']['client_key'])
+    # seconds after which the cached first and last ids of the destinations topics are refreshed
+    KAFKA_WATERMARKS_TTL = cfg['kafka'].get('watermarks_ttl', 2)
+
+# Maximum number of messages streams served at the same time by a process. Every stream holds a worker thread for up
+# to 30 seconds, so it must be lower than the number of threads of the process (see gunicorn_start.sh)
+MESSAGES_MAX_STREAMS = cfg.get('messages', {}).get('max_streams', 4)
+
+# Consumers that replay the failed messages of each type
+FAILED_MESSAGES_CONSUMERS = {
+    'CONSENT': 'hgw_frontend.management.commands.consent_manager_notification_consumer.Command'
+}
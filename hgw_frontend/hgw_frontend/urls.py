@@ -52,6 +52,9 @@ urlpatterns = [
     path(r'{}/channels/<str:channel_id>/'.format(VERSION_REGEX), ChannelView.as_view({'get': 'retrieve'})),
     path(r'{}/messages/'.format(VERSION_REGEX), Messages.as_view({'get': 'list'})),
     path(r'{}/messages/info/'.format(VERSION_REGEX), Messages.as_view({'get': 'info'})),
+    path(r'{}/messages/next/'.format(VERSION_REGEX), Messages.as_view({'get': 'next_batch'})),
+    path(r'{}/messages/ack/'.format(VERSION_REGEX), Messages.as_view({'post': 'ack'})),
+    path(r'{}/messages/stream/'.format(VERSION_REGEX), Messages.as_view({'get': 'stream'})),
     path(r'{}/messages/<int:message_id>/'.format(VERSION_REGEX), Messages.as_view({'get': 'retrieve'})),
     path(r'{}/sources/'.format(VERSION_REGEX), Sources.as_view({'get': 'list'})),
     path(r'{}/sources/<str:source_id>/'.format(VERSION_REGEX), Sources.as_view({'get': 'retrieve'})),
@@ -31,6 +31,7 @@ from django.utils.crypto import get_random_string
 from django.views.decorators.http import require_GET
 from oauthlib.oauth2 import InvalidClientError
 from rest_framework import status
+from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
 from rest_framework.viewsets import ViewSet
 
@@ -38,6 +39,7 @@ from hgw_common.models import OAuth2SessionProxy
 from hgw_common.serializers import ProfileSerializer
 from hgw_common.utils import ERRORS
 from hgw_common.utils.authorization import TokenHasResourceDetailedScope
+from hgw_common.utils.pagination import NDJSONRenderer, list_response
 from hgw_frontend import CONFIRM_ACTIONS, ERRORS_MESSAGE
 from hgw_frontend.models import (Channel, ConfirmationCode,
                                  ConsentConfirmation, FlowRequest, Source)
@@ -54,10 +56,6 @@ logger = logging.getLogger('hgw_frontend.flow_request')
 TIME_FORMAT = '%Y-%m-%dT%H:%M:%S'
 
 
-class UnknownConsentConfirmation(Exception):
-    pass
-
-
 class FlowRequestView(ViewSet):
     """
     Class with REST views for /flow_requests/ API
@@ -66,14 +64,19 @@ class FlowRequestView(ViewSet):
     required_scopes = ['flow_request']
     # for the search view we also want the token to have the query scope
     view_specific_scopes = {'search': {'read': ['query']}}
+    renderer_classes = (JSONRenderer, NDJSONRenderer)
 
     @staticmethod
-    def get_flow_request(request, process_id):
+    def get_flow_request(request, process_id, eager_loading=False):
         try:
             if request.auth.application.is_super_client():
-                return FlowRequest.objects.get(process_id=process_id)
+                flow_requests = FlowRequest.objects.filter(process_id=process_id)
             else:
-                return FlowRequest.objects.get(destination=request.auth.application.destination, process_id=process_id)
+                flow_requests = FlowRequest.objects.filter(destination=request.auth.application.destination,
+                                                           process_id=process_id)
+            if eager_loading:
+                flow_requests = FlowRequestSerializer.setup_eager_loading(flow_requests)
+            return flow_requests.get()
         except FlowRequest.DoesNotExist:
             logger.warning("Flow request not found")
             raise Http404
@@ -86,8 +89,8 @@ class FlowRequestView(ViewSet):
             flow_requests = FlowRequest.objects.all()
         else:
             flow_requests = FlowRequest.objects.filter(destination=request.auth.application.destination)
-        serializer = FlowRequestSerializer(flow_requests, many=True)
-        return Response(serializer.data, headers={'X-Total-Count': flow_requests.count()})
+        flow_requests = FlowRequestSerializer.setup_eager_loading(flow_requests)
+        return list_response(request, flow_requests, FlowRequestSerializer)
 
     def create(self, request):
         """
@@ -164,7 +167,7 @@ class FlowRequestView(ViewSet):
         """
         REST function to get one FlowRequest
         """
-        flow_request = self.get_flow_request(request, process_id)
+        flow_request = self.get_flow_request(request, process_id, eager_loading=True)
         serializer = FlowRequestSerializer(flow_request)
         res = {k: v for k, v in six.iteritems(serializer.data) if k != 'destination'}
         return Response(res)
@@ -181,11 +184,11 @@ class FlowRequestView(ViewSet):
             channels = Channel.objects.filter(flow_request=flow_request, status=request.GET['status'])
         else:
             channels = Channel.objects.filter(flow_request=flow_request)
-        count = channels.count()
-        if count == 0:
+        channels = list(ChannelSerializer.setup_eager_loading(channels))
+        if not channels:
             raise Http404
         serializer = ChannelSerializer(channels, many=True)
-        return Response(serializer.data, headers={'X-Total-Count': count})
+        return Response(serializer.data, headers={'X-Total-Count': len(channels)})
 
     def search(self, request):
         """
@@ -193,10 +196,11 @@ class FlowRequestView(ViewSet):
         """
         if 'channel_id' in request.GET:
             try:
-                channel = Channel.objects.get(channel_id=request.GET['channel_id'])
-                flow_request = channel.flow_request
+                channels = Channel.objects.filter(channel_id=request.GET['channel_id'])
+                flow_requests = FlowRequest.objects.filter(channel__in=channels)
+                flow_request = FlowRequestSerializer.setup_eager_loading(flow_requests).get()
                 serializer = FlowRequestSerializer(instance=flow_request)
-            except Channel.DoesNotExist:
+            except FlowRequest.DoesNotExist:
                 raise Http404
             return Response(serializer.data, headers={'X-Total-Count': '1'})
         else:
@@ -217,7 +221,7 @@ def _get_consent_session():
 
 def _create_consents(flow_request, destination_endpoint_callback_url, user):
     destination = flow_request.destination
-    sources = flow_request.sources.all()
+    sources = flow_request.sources.select_related('profile')
     try:
         oauth_consent_session = _get_consent_session()
     except InvalidClientError:
@@ -227,14 +231,13 @@ def _create_consents(flow_request, destination_endpoint_callback_url, user):
         logger.error("Consent Manager connection error while getting an oAuth2 tokern")
         return [], ERRORS_MESSAGE['INTERNAL_GATEWAY_ERROR']
 
-    confirm_ids = []
-    connection_errors = 0
+    channels = []
+    consents_data = []
     for source in sources:
         channel = Channel.objects.create(channel_id=get_random_string(32), flow_request=flow_request,
                                          source=source, status=Channel.CONSENT_REQUESTED)
-        channel.save()
-
-        consent_data = {
+        channels.append(channel)
+        consents_data.append({
             'source': {
                 'id': source.source_id,
                 'name': source.name
@@ -247,40 +250,52 @@ def _create_consents(flow_request, destination_endpoint_callback_url, user):
             'person_id': user.fiscalNumber,
             'start_validity': flow_request.start_validity.strftime(TIME_FORMAT),
             'expire_validity': flow_request.expire_validity.strftime(TIME_FORMAT)
-        }
-        logger.info("Creating consent with data %s", consent_data)
-        res = oauth_consent_session.post('{}/v1/consents/'.format(CONSENT_MANAGER_URI), json=consent_data)
-        if res is not None:
-            json_res = res.json()
-            if res.status_code == 201:
-                ConsentConfirmation.objects.create(flow_request=flow_request, consent_id=json_res['consent_id'],
-                                                   channel=channel, confirmation_id=json_res['confirm_id'],
-                                                   destination_endpoint_callback_url=destination_endpoint_callback_url)
-                confirm_ids.append(json_res['confirm_id'])
-            else:
-                logger.error('Consent not created. Response is: %s, %s', res.status_code, res.content)
+        })
+
+    # All the consents are created with one request. The results are in the same order of the consents' data
+    logger.info("Creating consents with data %s", consents_data)
+    res = oauth_consent_session.post('{}/v1/consents/bulk/'.format(CONSENT_MANAGER_URI), json=consents_data)
+    if res is None:
+        logger.error('Consents not created. Error occurred contacting the consent manager')
+        return [], ERRORS_MESSAGE['ALL_CONSENTS_ALREADY_CREATED']
+
+    json_res = res.json()
+    if not isinstance(json_res, list):
+        logger.error('Consents not created. Response is: %s, %s', res.status_code, res.content)
+        return [], ERRORS_MESSAGE['ALL_CONSENTS_ALREADY_CREATED']
+
+    confirm_ids = []
+    consent_confirmations = []
+    for channel, result in zip(channels, json_res):
+        if 'confirm_id' in result:
+            consent_confirmations.append(
+                ConsentConfirmation(flow_request=flow_request, consent_id=result['consent_id'],
+                                    channel=channel, confirmation_id=result['confirm_id'],
+                                    destination_endpoint_callback_url=destination_endpoint_callback_url))
+            confirm_ids.append(result['confirm_id'])
         else:
-            connection_errors += 1
-            logger.error('Consent not created. Error occurred contacting the consent manager')
+            logger.error('Consent for channel %s not created. Errors are: %s', channel.channel_id,
+                         result.get('errors'))
+    ConsentConfirmation.objects.bulk_create(consent_confirmations)
     if not confirm_ids:
         return confirm_ids, ERRORS_MESSAGE['ALL_CONSENTS_ALREADY_CREATED']
     return confirm_ids, ""
 
 
-def _get_consent(confirm_id):
+def _get_consents(consent_confirmations):
     """
-    Query the consent manager for the consent with confirmation_id equal to confirm_id
-    :param confirm_id: the confirmation_id of the consent to get
-    :return:
+    Query the consent manager for the consents of the :param:`consent_confirmations` with a single request
+    :param consent_confirmations: the ConsentConfirmation of the consents to get
+    :return: a dictionary with the consents by consent_id or None if it was not possible to contact the
+        consent manager
     """
-    try:
-        consent_confirmation = ConsentConfirmation.objects.get(confirmation_id=confirm_id)
-    except ConsentConfirmation.DoesNotExist:
-        raise UnknownConsentConfirmation()
-    consent_id = consent_confirmation.consent_id
     oauth_consent_session = _get_consent_session()
-    res = oauth_consent_session.get('{}/v1/consents/{}/'.format(CONSENT_MANAGER_URI, consent_id))
-    return consent_confirmation, res.json()
+    res = oauth_consent_session.get('{}/v1/consents/'.format(CONSENT_MANAGER_URI),
+                                    params={'consent_id': [cc.consent_id for cc in consent_confirmations]})
+    if res is None or res.status_code != 200:
+        logger.error('Error getting the consents from the Consent Manager')
+        return None
+    return {consent['consent_id']: consent for consent in res.json()}
 
 
 def _get_callback_url(request):
@@ -309,16 +324,21 @@ def _ask_consent(request, flow_request, destination_callback_url):
                                        consent_callback_url))
 
 
-def _confirm(request, consent_confirm_id):
-    try:
-        logger.debug("Getting consent from Consent Manager")
-        consent_confirmation, consent = _get_consent(consent_confirm_id)
-        logger.debug("Found consent")
-    except UnknownConsentConfirmation:
+def _confirm(flow_request, consent_confirm_ids):
+    """
+    Checks the status of the consents with a single request to the consent manager. If at least one of them
+    is active, the flow request is set to ACTIVE
+    :return: True if the flow request has been activated
+    """
+    consent_confirmations = ConsentConfirmation.objects.filter(flow_request=flow_request,
+                                                               confirmation_id__in=consent_confirm_ids)
+    logger.debug("Getting consents from Consent Manager")
+    consents = _get_consents(consent_confirmations)
+    if consents is None:
         return False
+    logger.debug("Found %s consents", len(consents))
 
-    if consent['status'] == 'AC':
-        flow_request = consent_confirmation.flow_request
+    if any(consent['status'] == 'AC' for consent in consents.values()):
         flow_request.status = FlowRequest.ACTIVE
         flow_request.save()
         return True
@@ -339,9 +359,8 @@ def consents_confirmed(request):
     callback = flow_request.consentconfirmation_set.all()[0].destination_endpoint_callback_url
     done = False
     if success:
-        for consent_confirm_id in consent_confirm_ids:
-            logger.debug("Checking consents")
-            done = _confirm(request, consent_confirm_id)
+        logger.debug("Checking consents")
+        done = _confirm(flow_request, consent_confirm_ids)
     return HttpResponseRedirect('{}?process_id={}&success={}'.format(
         callback, flow_request.process_id, json.dumps(done)))
 
@@ -16,25 +16,101 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 import base64
 import json
+import logging
 import sys
+import threading
 
+from django.conf import settings
+from django.http import StreamingHttpResponse
 from kafka import KafkaConsumer, TopicPartition
+from kafka.errors import KafkaError
 from rest_framework import status
+from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
+from rest_framework.utils.encoders import JSONEncoder
 from rest_framework.viewsets import ViewSet
 
+from hgw_common.messaging import NotInRangeError
 from hgw_common.messaging.deserializer import RawDeserializer
-from hgw_common.messaging.receiver import create_receiver
-from hgw_common.utils import create_broker_parameters_from_settings
+from hgw_common.messaging.frames import FRAME_CONTENT_TYPE, pack_frame
+from hgw_common.messaging.receiver import create_receiver, create_watermarks
+from hgw_common.utils import ERRORS, create_broker_parameters_from_settings
 from hgw_common.utils.authorization import TokenHasResourceDetailedScope
 from hgw_frontend.models import Destination
 from hgw_frontend.settings import (KAFKA_BROKER, KAFKA_CA_CERT,
                                    KAFKA_CLIENT_CERT, KAFKA_CLIENT_KEY,
-                                   KAFKA_SSL)
+                                   KAFKA_SSL, KAFKA_WATERMARKS_TTL)
 
 DEFAULT_LIMIT = 5
 MAX_LIMIT = 10
+# the stream holds a worker for all its duration, so it is kept short: the client resumes it with a new request
+DEFAULT_STREAM_TIMEOUT = 20
+MAX_STREAM_TIMEOUT = 30
+DEFAULT_MAX_BYTES = 1024 * 1024
+MAX_MAX_BYTES = 16 * 1024 * 1024
 RECEIVER_NAME = 'hgw_frontend_messages_api'
+CURSOR_RECEIVER_NAME = 'hgw_frontend_messages_api_{}'
+
+logger = logging.getLogger('hgw_frontend.messages')
+
+_watermarks = None
+_watermarks_lock = threading.Lock()
+_streams = 0
+_streams_lock = threading.Lock()
+
+
+def get_watermarks():
+    """
+    Returns the cache of the first and last ids of the destinations topics, shared by all the requests
+    """
+    global _watermarks
+    with _watermarks_lock:
+        if _watermarks is None:
+            _watermarks = create_watermarks(create_broker_parameters_from_settings(), ttl=KAFKA_WATERMARKS_TTL)
+        return _watermarks
+
+
+def _acquire_stream():
+    """
+    Reserves one of the streams that the process can serve at the same time. It returns False if they are all in use
+    """
+    global _streams
+    with _streams_lock:
+        if _streams >= settings.MESSAGES_MAX_STREAMS:
+            return False
+        _streams += 1
+        return True
+
+
+def _release_stream():
+    global _streams
+    with _streams_lock:
+        _streams -= 1
+
+
+class MessagesStream(object):
+    """
+    The lines sent by the stream view. When the stream ends or the response is closed (e.g., the client disconnects,
+    also before the stream starts) it closes the consumer and it releases the stream
+    """
+
+    def __init__(self, lines, receiver):
+        self.lines = lines
+        self.receiver = receiver
+        self.closed = False
+
+    def __iter__(self):
+        try:
+            yield from self.lines
+        finally:
+            self.close()
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.lines.close()
+            self.receiver.close()
+            _release_stream()
 
 
 def check_destination(f):
@@ -46,9 +122,82 @@ def check_destination(f):
     return wrapper
 
 
+class FramesRenderer(JSONRenderer):
+    """
+    Renderer used to negotiate the binary frames format of the messages list.
+    The frames are written directly by the view, so it renders only the errors, in json
+    """
+    media_type = FRAME_CONTENT_TYPE
+    format = 'frames'
+
+
 class Messages(ViewSet):
     permission_classes = (TokenHasResourceDetailedScope,)
     required_scopes = ['messages']
+    read_actions = ('ack',)
+    renderer_classes = (JSONRenderer, FramesRenderer)
+
+    def _construct_frame(self, msg):
+        header = {'message_id': msg['id']}
+        header.update(dict((k, v.decode('utf-8')) for (k, v) in msg['headers']))
+        return pack_frame(header, msg['data'])
+
+    def _list_frames(self, receiver, topic, start, last_id, max_bytes, headers):
+        """
+        Streams the messages as binary frames. The number of messages is limited by the size of the response:
+        the frames are sent until adding the next one would exceed :param:`max_bytes`. The first frame
+        is always sent, even if it is bigger, so that the client can always go on
+        """
+        def generate():
+            if start > last_id:
+                return
+            sent = 0
+            for msg in receiver.iter_range(start, last_id, topic):
+                frame = self._construct_frame(msg)
+                if sent > 0 and sent + len(frame) > max_bytes:
+                    return
+                sent += len(frame)
+                yield frame
+
+        response = StreamingHttpResponse(generate(), content_type=FRAME_CONTENT_TYPE)
+        for header, value in headers.items():
+            response[header] = value
+        return response
+
+    def _create_cursor_receiver(self, topic):
+        # the offsets are committed only when the destination acknowledges the messages. The receiver doesn't join
+        # the consumer group, which only stores the offsets, so the requests don't cause rebalances of the group
+        return create_receiver(topic, CURSOR_RECEIVER_NAME.format(topic), create_broker_parameters_from_settings(),
+                               blocking=False, deserializer=RawDeserializer, auto_commit=False,
+                               watermarks=get_watermarks(), subscribe=False)
+
+    def _create_receiver(self, topic):
+        return create_receiver(topic, RECEIVER_NAME, create_broker_parameters_from_settings(),
+                               blocking=False, deserializer=RawDeserializer, watermarks=get_watermarks())
+
+    def _get_ids(self, topic, message_id=None):
+        """
+        Returns the first and the last ids of the topic from the cache. If :param:`message_id` is out of the cached
+        range the ids are refreshed, since the cache can be some seconds old
+        """
+        watermarks = get_watermarks()
+        first_id, last_id = watermarks.get(topic)
+        if message_id is not None and not first_id <= message_id <= last_id:
+            first_id, last_id = watermarks.get(topic, refresh=True)
+        return first_id, last_id
+
+    def _list_response(self, request, receiver, topic, start, first_id, last_id):
+        limit = min(int(request.GET.get('limit', DEFAULT_LIMIT)), MAX_LIMIT)
+        headers = {
+            'X-Skipped': start - first_id,
+            'X-Total-Count': last_id - first_id + 1
+        }
+        if request.accepted_renderer.format == FramesRenderer.format:
+            max_bytes = min(int(request.GET.get('max_bytes', DEFAULT_MAX_BYTES)), MAX_MAX_BYTES)
+            return self._list_frames(receiver, topic, start, last_id, max_bytes, headers)
+
+        messages = [self._construct_correct_response(msg) for msg in receiver.get_range(start, start + limit - 1, topic)]
+        return Response(messages, content_type='application/json', headers=headers)
 
     def _construct_correct_response(self, msg):
         response = {
@@ -63,11 +212,9 @@ class Messages(ViewSet):
         message_id = int(message_id)
 
         topic = request.auth.application.destination.destination_id
-        receiver = create_receiver(topic, RECEIVER_NAME, create_broker_parameters_from_settings(), 
-                                   blocking=False, deserializer=RawDeserializer)
-        first_id = receiver.get_first_id(topic)
-        last_id = receiver.get_last_id(topic)
+        first_id, last_id = self._get_ids(topic, message_id)
         if first_id <= message_id <= last_id:
+            receiver = self._create_receiver(topic)
             msg = receiver.get_by_id(message_id, topic)
             return Response(self._construct_correct_response(msg), content_type='application/json')
         else:
@@ -82,17 +229,9 @@ class Messages(ViewSet):
     @check_destination
     def list(self, request):
         topic = request.auth.application.destination.destination_id
-        receiver = create_receiver(topic, RECEIVER_NAME, create_broker_parameters_from_settings(), 
-                                   blocking=False, deserializer=RawDeserializer)
-
-        first_id = receiver.get_first_id(topic)
-        last_id = receiver.get_last_id(topic)
+        first_id, last_id = self._get_ids(topic)
 
         start = int(request.GET.get('start', first_id))
-        limit = int(request.GET.get('limit', DEFAULT_LIMIT))
-
-        if limit > MAX_LIMIT:
-            limit = MAX_LIMIT
 
         if start < first_id:
             # If the start offset is less than the first offset available, we answer with not found
@@ -101,21 +240,122 @@ class Messages(ViewSet):
                             status.HTTP_404_NOT_FOUND,
                             content_type='application/json')
 
-        messages = [self._construct_correct_response(msg) for msg in receiver.get_range(start, start + limit - 1, topic)]
-        headers = {
-            'X-Skipped': start - first_id,
-            'X-Total-Count': last_id - first_id + 1
-        }
-        return Response(messages, content_type='application/json', headers=headers)
+        receiver = self._create_receiver(topic)
+        return self._list_response(request, receiver, topic, start, first_id, last_id)
 
     @check_destination
-    def info(self, request):
+    def next_batch(self, request):
+        """
+        Returns the messages following the last one acknowledged by the destination with :meth:`ack`.
+        The position is kept by the gateway in a consumer group dedicated to the destination, so the destination
+        doesn't need to store it. Until the messages are acknowledged, the same batch is returned
+        """
         topic = request.auth.application.destination.destination_id
-        receiver = create_receiver(topic, RECEIVER_NAME, create_broker_parameters_from_settings(), 
-                                   blocking=False, deserializer=RawDeserializer)
+        receiver = self._create_cursor_receiver(topic)
 
         first_id = receiver.get_first_id(topic)
         last_id = receiver.get_last_id(topic)
+        try:
+            committed_id = receiver.get_committed_id(topic)
+        except KafkaError:
+            logger.exception('Error getting the committed offset of topic %s', topic)
+            return Response({'errors': [ERRORS.BROKER_ERROR]}, status.HTTP_503_SERVICE_UNAVAILABLE)
+        # if nothing has been acknowledged yet or the acknowledged messages have been deleted
+        # by the retention policy, it starts from the first available message
+        start = first_id if committed_id is None else max(committed_id, first_id)
+        return self._list_response(request, receiver, topic, start, first_id, last_id)
+
+    @check_destination
+    def ack(self, request):
+        """
+        Acknowledges all the messages until the `message_id` in the body, included.
+        The following calls to :meth:`next_batch` will return the messages after it
+        """
+        message_id = request.data.get('message_id') if isinstance(request.data, dict) else None
+        if not isinstance(message_id, int) or isinstance(message_id, bool):
+            return Response({'errors': [ERRORS.MISSING_PARAMETERS]}, status.HTTP_400_BAD_REQUEST)
+
+        topic = request.auth.application.destination.destination_id
+        first_id, last_id = self._get_ids(topic, message_id)
+        if not first_id <= message_id <= last_id:
+            return Response({'first_id': first_id,
+                             'last_id': last_id},
+                            status.HTTP_404_NOT_FOUND,
+                            content_type='application/json')
+
+        receiver = self._create_cursor_receiver(topic)
+        try:
+            receiver.commit_id(message_id, topic)
+        except KafkaError:
+            logger.exception('Error committing the offset of topic %s', topic)
+            return Response({'errors': [ERRORS.BROKER_ERROR]}, status.HTTP_503_SERVICE_UNAVAILABLE)
+        return Response({'next_id': message_id + 1})
+
+    @check_destination
+    def stream(self, request):
+        """
+        Streams the messages in NDJSON format (one message per line) starting from the `start` query parameter
+        (by default the first available message). The connection is kept open and the messages are sent as
+        soon as they arrive. When no message arrives, an empty line is sent as keep-alive. The stream is closed
+        after `timeout` seconds: the client can resume it using as `start` the last received message_id + 1
+        """
+        try:
+            start = int(request.GET['start']) if 'start' in request.GET else None
+            timeout = min(int(request.GET.get('timeout', DEFAULT_STREAM_TIMEOUT)), MAX_STREAM_TIMEOUT)
+        except ValueError:
+            return Response({'errors': [ERRORS.INVALID_PARAMETERS]}, status.HTTP_400_BAD_REQUEST)
+        if timeout < 0:
+            return Response({'errors': [ERRORS.INVALID_PARAMETERS]}, status.HTTP_400_BAD_REQUEST)
+
+        # every stream holds a worker thread, so they are limited to leave threads to the other requests
+        if not _acquire_stream():
+            logger.warning('Too many messages streams. Rejecting the request')
+            return Response({'errors': [ERRORS.TOO_MANY_REQUESTS]}, status.HTTP_429_TOO_MANY_REQUESTS,
+                            headers={'Retry-After': str(DEFAULT_STREAM_TIMEOUT)})
+        receiver = None
+        try:
+            topic = request.auth.application.destination.destination_id
+            # the stream doesn't use the cached ids, since the client resumes it from the last id it received,
+            # that can be newer than the cached one
+            receiver = create_receiver(topic, RECEIVER_NAME, create_broker_parameters_from_settings(),
+                                       blocking=False, deserializer=RawDeserializer)
+
+            first_id = receiver.get_first_id(topic)
+            last_id = receiver.get_last_id(topic)
+            if start is None:
+                start = first_id
+
+            messages = receiver.stream(start, topic, timeout=timeout)
+            first_message = next(messages)
+        except NotInRangeError:
+            receiver.close()
+            _release_stream()
+            return Response({'first_id': first_id,
+                             'last_id': last_id},
+                            status.HTTP_404_NOT_FOUND,
+                            content_type='application/json')
+        except Exception:
+            if receiver is not None:
+                receiver.close()
+            _release_stream()
+            raise
+
+        def serialize(msg):
+            if msg is None:
+                return '\n'
+            return json.dumps(self._construct_correct_response(msg), cls=JSONEncoder) + '\n'
+
+        def generate():
+            yield serialize(first_message)
+            for msg in messages:
+                yield serialize(msg)
+
+        return StreamingHttpResponse(MessagesStream(generate(), receiver), content_type='application/x-ndjson')
+
+    @check_destination
+    def info(self, request):
+        topic = request.auth.application.destination.destination_id
+        first_id, last_id = self._get_ids(topic)
 
         count = last_id + 1 - first_id
         return Response({
@@ -20,7 +20,7 @@ class Sources(ViewSet):
     required_scopes = ['sources']
 
     def list(self, request):
-        sources = Source.objects.all()
+        sources = SourceSerializer.setup_eager_loading(Source.objects.all())
         serializer = SourceSerializer(sources, many=True)
         return Response(serializer.data, content_type='application/json')
 
@@ -38,13 +38,11 @@ class Profiles(ViewSet):
     required_scopes = ['sources']
 
     def list(self, request):
-        profiles = Profile.objects.all()
+        profiles = Profile.objects.prefetch_related('source_set')
         profiles_ser = ProfileSerializer(profiles, many=True)
         profiles_data = profiles_ser.data
         for i, p in enumerate(profiles):
-            sources = Source.objects.filter(profile=p)
-            source_serializer = SourceSerializer(sources, many=True)
-            profiles_data[i]['sources'] = [{'source_id': s['source_id'], 'name': s['name']}
-                                           for s in source_serializer.data]
+            profiles_data[i]['sources'] = [{'source_id': s.source_id, 'name': s.name}
+                                           for s in p.source_set.all()]
 
         return Response(profiles_data, content_type='application/json')
\ No newline at end of file
@@ -185,6 +185,53 @@ class TestChannelsAPI(TestCase):
         self.assertEqual(res.json(), expected)
         self.assertEqual(res['X-Total-Count'], str(len(expected)))
 
+    def test_get_paginated(self):
+        """
+        Tests getting channels with keyset pagination, following the X-Next-After header
+        """
+        headers = self._get_oauth_header(client_name=DISPATCHER_NAME)
+        expected = [self.channels[pk] for pk in sorted(self.channels)]
+        received = []
+        url = '/v1/channels/?limit=2'
+        while True:
+            res = self.client.get(url, **headers)
+            self.assertEqual(res.status_code, 200)
+            self.assertLessEqual(len(res.json()), 2)
+            self.assertNotIn('X-Total-Count', res)
+            received.extend(res.json())
+            if 'X-Next-After' not in res:
+                break
+            url = '/v1/channels/?limit=2&after={}'.format(res['X-Next-After'])
+        self.assertEqual(received, expected)
+
+    def test_get_paginated_wrong_parameters(self):
+        """
+        Tests that invalid pagination parameters are rejected
+        """
+        headers = self._get_oauth_header(client_name=DISPATCHER_NAME)
+        for query in ('limit=0', 'limit=wrong', 'after=wrong'):
+            res = self.client.get('/v1/channels/?{}'.format(query), **headers)
+            self.assertEqual(res.status_code, 400)
+            self.assertEqual(res.json(), {'errors': [ERRORS.INVALID_PARAMETERS]})
+
+    def test_get_ndjson(self):
+        """
+        Tests getting channels in NDJSON format
+        """
+        headers = self._get_oauth_header(client_name=DISPATCHER_NAME)
+        expected = [self.channels[pk] for pk in sorted(self.channels)]
+        with patch('hgw_common.utils.pagination.STREAM_CHUNK_SIZE', 2):
+            res = self.client.get('/v1/channels/', HTTP_ACCEPT='application/x-ndjson', **headers)
+            self.assertEqual(res.status_code, 200)
+            self.assertEqual(res['Content-Type'], 'application/x-ndjson')
+            lines = b''.join(res.streaming_content).decode('utf-8').splitlines()
+        self.assertEqual([json.loads(line) for line in lines], expected)
+
+        res = self.client.get('/v1/channels/?format=ndjson&limit=1&after={}'.format(sorted(self.channels)[0]),
+                              **headers)
+        lines = b''.join(res.streaming_content).decode('utf-8').splitlines()
+        self.assertEqual([json.loads(line) for line in lines], expected[1:2])
+
     def test_get_db_error_by_superuser(self):
         """
         Tests getting channels error response in case of db error
@@ -4,10 +4,12 @@ import json
 from django.core.exceptions import ObjectDoesNotExist
 from django.db import DatabaseError
 from django.test import TestCase
+from django.utils import timezone
 from mock.mock import Mock, NonCallableMock, patch
 
 from hgw_common.models import FailedMessages, Profile
 from hgw_common.utils.mocks import MockKafkaConsumer, MockMessage
+from hgw_common.utils.replay import FailedMessagesReplayer
 from hgw_frontend.management.commands.connector_notification_consumer import \
     Command as ConnectorNotificationCommand
 from hgw_frontend.management.commands.consent_manager_notification_consumer import (
@@ -729,3 +731,49 @@ class TestConsentConsumer(TestCase):
             self.assertEqual(message.reason, FAILED_REASON.FAILED_NOTIFICATION)
             self.assertEqual(message.retry, True)
             self.assertEqual(message.message_type, FAILED_MESSAGE_TYPE)
+
+    def test_replay_failed_notification(self):
+        """
+        Test that, when a failed notification is replayed, the notification is sent again and the message removed
+        """
+        self.set_mock_kafka_consumer(MockKafkaConsumer, [self.base_consent],
+                                     KAFKA_CHANNEL_NOTIFICATION_TOPIC, True)
+        self.out_message.update({'action': ACTION.CREATED})
+
+        with patch('hgw_common.messaging.receiver.KafkaConsumer', MockKafkaConsumer):
+            ConsentNotificationCommand().handle()
+        self.assertEqual(FailedMessages.objects.count(), 1)
+        FailedMessages.objects.update(next_attempt_at=timezone.now())
+
+        with patch('hgw_common.messaging.sender.KafkaProducer') as MockKafkaProducer:
+            metrics = FailedMessagesReplayer({FAILED_MESSAGE_TYPE: ConsentNotificationCommand()}).run(once=True)
+
+            self.assertEqual(metrics['succeeded'], 1)
+            self.assertEqual(MockKafkaProducer().send.call_count, 1)
+            self.assertDictEqual(json.loads(MockKafkaProducer().send.call_args_list[0][1]['value'].decode('utf-8')),
+                                 self.out_message)
+            self.assertEqual(FailedMessages.objects.count(), 0)
+            channel = ConsentConfirmation.objects.get(consent_id=self.base_consent['consent_id']).channel
+            self.assertEqual(channel.status, Channel.WAITING_SOURCE_NOTIFICATION)
+
+    def test_replay_failed_notification_inconsistent_status(self):
+        """
+        Test that, when the channel changed after the failed notification, the notification is not sent again
+        """
+        self.set_mock_kafka_consumer(MockKafkaConsumer, [self.base_consent],
+                                     KAFKA_CHANNEL_NOTIFICATION_TOPIC, True)
+        with patch('hgw_common.messaging.receiver.KafkaConsumer', MockKafkaConsumer):
+            ConsentNotificationCommand().handle()
+
+        channel = ConsentConfirmation.objects.get(consent_id=self.base_consent['consent_id']).channel
+        channel.status = Channel.CONSENT_REVOKED
+        channel.save()
+        FailedMessages.objects.update(next_attempt_at=timezone.now())
+
+        with patch('hgw_common.messaging.sender.KafkaProducer') as MockKafkaProducer:
+            FailedMessagesReplayer({FAILED_MESSAGE_TYPE: ConsentNotificationCommand()}).run(once=True)
+            MockKafkaProducer().send.assert_not_called()
+            message = FailedMessages.objects.get()
+            self.assertEqual(message.reason, FAILED_REASON.INCONSISTENT_STATUS)
+            self.assertEqual(message.retry, False)
+            self.assertEqual(message.attempts, 1)
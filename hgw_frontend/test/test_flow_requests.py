@@ -25,7 +25,7 @@ from django.test import TestCase, client
 from mock import patch
 
 from hgw_common.cipher import Cipher
-from hgw_common.models import Profile
+from hgw_common.models import OAuth2SessionProxy, Profile
 from hgw_common.utils import ERRORS
 from hgw_common.utils.mocks import (MockMessage, get_free_port,
                                     start_mock_server)
@@ -197,6 +197,36 @@ class TestFlowRequestAPI(TestCase):
         self.assertEqual(res.status_code, 200)
         self.assertEqual(res['X-Total-Count'], '3')
 
+    def test_get_flow_requests_paginated(self):
+        """
+        Tests get flow requests with keyset pagination
+        """
+        headers = self._get_oauth_header(client_name=DISPATCHER_NAME)
+        res = self.client.get('/v1/flow_requests/?limit=2', **headers)
+        self.assertEqual(res.status_code, 200)
+        first_page = [flow_request['process_id'] for flow_request in res.json()]
+        self.assertEqual(len(first_page), 2)
+        self.assertNotIn('X-Total-Count', res)
+
+        res = self.client.get('/v1/flow_requests/?limit=2&after={}'.format(res['X-Next-After']), **headers)
+        self.assertEqual(res.status_code, 200)
+        second_page = [flow_request['process_id'] for flow_request in res.json()]
+        self.assertEqual(len(second_page), 1)
+        self.assertNotIn('X-Next-After', res)
+
+        self.assertEqual(first_page + second_page,
+                         list(FlowRequest.objects.order_by('id').values_list('process_id', flat=True)))
+
+    def test_get_flow_requests_ndjson(self):
+        """
+        Tests get flow requests in NDJSON format. It returns only the ones belonging to the destination
+        """
+        headers = self._get_oauth_header()
+        res = self.client.get('/v1/flow_requests/', HTTP_ACCEPT='application/x-ndjson', **headers)
+        self.assertEqual(res.status_code, 200)
+        lines = b''.join(res.streaming_content).decode('utf-8').splitlines()
+        self.assertEqual([json.loads(line)['process_id'] for line in lines], ['p_11111'])
+
     def test_get_one_flow_requests_as_super_client(self):
         """
         Tests get all flow requests from from a client with super role. It returns all the flow requests
@@ -823,9 +853,12 @@ class TestFlowRequestAPI(TestCase):
             c.channel.status = Channel.CONSENT_REQUESTED
             c.channel.save()
 
-        res = self.client.get(
-            '/v1/flow_requests/consents_confirmed/?success=true&consent_confirm_id={}&consent_confirm_id={}'.format(
-                *confirms_id))
+        with patch('hgw_frontend.views.flow_requests.OAuth2SessionProxy', wraps=OAuth2SessionProxy) as proxy:
+            res = self.client.get(
+                '/v1/flow_requests/consents_confirmed/?success=true&consent_confirm_id={}&consent_confirm_id={}'.format(
+                    *confirms_id))
+            # the consents are retrieved with only one request to the consent manager
+            self.assertEqual(proxy.call_count, 1)
         self.assertEqual(res.status_code, 302)
 
         for confirm_id in confirms_id:
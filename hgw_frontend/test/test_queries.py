@@ -0,0 +1,174 @@
+# Copyright (c) 2017-2018 CRS4
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to use,
+# copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or
+# substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE
+# AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+import json
+import os
+
+from django.db import connection
+from django.test import TestCase, client
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from hgw_common.models import Profile
+from hgw_common.utils.test_db import analyze_db, get_used_indexes
+from hgw_frontend.models import (Channel, ConsentConfirmation, Destination,
+                                 FlowRequest, RESTClient, Source)
+
+from . import DEST_1_ID, DEST_1_NAME, DISPATCHER_NAME
+
+os.environ['OAUTHLIB_INSECURE_TRANSPORT'] = '1'
+
+ROWS_NUMBER = 20
+
+
+class TestQueriesNumber(TestCase):
+    """
+    Tests that the number of queries made by the endpoints doesn't depend on the number of objects returned
+    """
+    fixtures = ['test_data.json']
+
+    def setUp(self):
+        self.client = client.Client()
+        self.rows_created = 0
+
+    def _get_oauth_header(self, client_name=DEST_1_NAME):
+        app = RESTClient.objects.get(name=client_name)
+        params = {
+            'grant_type': 'client_credentials',
+            'client_id': app.client_id,
+            'client_secret': app.client_secret
+        }
+        res = self.client.post('/oauth2/token/', data=params)
+        return {"Authorization": "Bearer {}".format(res.json()['access_token'])}
+
+    def _create_rows(self, rows_number=ROWS_NUMBER):
+        """
+        Creates :param:`rows_number` flow requests for the destination, each with a different profile and a different
+        source with a channel
+        """
+        destination = Destination.objects.get(destination_id=DEST_1_ID)
+        now = timezone.now()
+        for index in range(self.rows_created, self.rows_created + rows_number):
+            profile = Profile.objects.create(code='PROF_Q{}'.format(index), version='v0', payload='[{}]')
+            source = Source.objects.create(source_id='source_q{}'.format(index), name='Source Q{}'.format(index),
+                                           profile=profile)
+            flow_request = FlowRequest.objects.create(flow_id='flow_q{}'.format(index),
+                                                      process_id='process_q{}'.format(index),
+                                                      profile=profile, destination=destination,
+                                                      start_validity=now, expire_validity=now)
+            flow_request.sources.add(source)
+            channel = Channel.objects.create(channel_id='channel_q{}'.format(index), flow_request=flow_request,
+                                             source=source, status=Channel.ACTIVE)
+            ConsentConfirmation.objects.create(flow_request=flow_request, channel=channel,
+                                               consent_id='consent_q{}'.format(index),
+                                               confirmation_id='confirmation_q{}'.format(index),
+                                               destination_endpoint_callback_url='http://localhost')
+        self.rows_created += rows_number
+
+    def _count_queries(self, url, headers):
+        with CaptureQueriesContext(connection) as context:
+            res = self.client.get(url, **headers)
+            self.assertEqual(res.status_code, 200)
+        return len(context)
+
+    def _assert_queries_number(self, url, expected, client_name=DEST_1_NAME):
+        """
+        Asserts that the :param:`url` makes :param:`expected` queries, before and after adding objects to the db
+        """
+        headers = self._get_oauth_header(client_name)
+        self.assertEqual(self._count_queries(url, headers), expected)
+        self._create_rows()
+        self.assertEqual(self._count_queries(url, headers), expected)
+
+    def test_channels_list(self):
+        self._assert_queries_number('/v1/channels/', 3)
+
+    def test_channels_list_paginated(self):
+        self._assert_queries_number('/v1/channels/?limit=1000', 3)
+
+    def test_channels_list_by_super_client(self):
+        self._assert_queries_number('/v1/channels/', 2, DISPATCHER_NAME)
+
+    def test_channel_retrieve(self):
+        self._assert_queries_number('/v1/channels/{}/'.format(Channel.objects.first().channel_id), 3)
+
+    def test_channel_search(self):
+        self._create_rows(1)
+        self._assert_queries_number('/v1/channels/search/?consent_id=consent_q0', 3)
+
+    def test_flow_requests_list(self):
+        self._assert_queries_number('/v1/flow_requests/', 4)
+
+    def test_flow_requests_list_by_super_client(self):
+        self._assert_queries_number('/v1/flow_requests/', 3, DISPATCHER_NAME)
+
+    def test_flow_request_retrieve(self):
+        self._assert_queries_number('/v1/flow_requests/{}/'.format(FlowRequest.objects.first().process_id), 4)
+
+    def test_flow_request_channels(self):
+        self._create_rows(1)
+        self._assert_queries_number('/v1/flow_requests/process_q0/channels/', 4)
+
+    def test_flow_request_search(self):
+        self._create_rows(1)
+        self._assert_queries_number('/v1/flow_requests/search/?channel_id=channel_q0', 3, DISPATCHER_NAME)
+
+    def test_sources_list(self):
+        self._assert_queries_number('/v1/sources/', 2)
+
+    def test_profiles_list(self):
+        self._assert_queries_number('/v1/profiles/', 3)
+
+
+class TestQueryPlans(TestCase):
+    """
+    Tests that the lookups made for every request use an index
+    """
+    fixtures = ['test_data.json']
+
+    @classmethod
+    def setUpTestData(cls):
+        destination = Destination.objects.get(destination_id=DEST_1_ID)
+        source = Source.objects.first()
+        now = timezone.now()
+        flow_requests = FlowRequest.objects.bulk_create([
+            FlowRequest(flow_id='flow_{}'.format(index), process_id='process_{}'.format(index),
+                        destination=destination, start_validity=now, expire_validity=now)
+            for index in range(2000)])
+        # bulk_create doesn't set the primary keys with every database, so the flow requests are read again
+        flow_requests = FlowRequest.objects.filter(flow_id__startswith='flow_')
+        channels = Channel.objects.bulk_create([
+            Channel(channel_id='channel_{}'.format(index), flow_request=flow_request, source=source,
+                    status=Channel.ACTIVE)
+            for index, flow_request in enumerate(flow_requests)])
+        channels = Channel.objects.filter(channel_id__startswith='channel_').select_related('flow_request')
+        ConsentConfirmation.objects.bulk_create([
+            ConsentConfirmation(flow_request=channel.flow_request, channel=channel,
+                                consent_id='consent_{}'.format(index),
+                                confirmation_id='confirmation_{}'.format(index),
+                                destination_endpoint_callback_url='http://localhost')
+            for index, channel in enumerate(channels)])
+        analyze_db()
+
+    def test_channel_by_channel_id(self):
+        self.assertTrue(get_used_indexes(Channel.objects.filter(channel_id='channel_1000'), 'channel_id'))
+
+    def test_flow_request_by_process_id(self):
+        self.assertTrue(get_used_indexes(FlowRequest.objects.filter(process_id='process_1000'), 'process_id'))
+
+    def test_consent_confirmation_by_confirmation_id(self):
+        queryset = ConsentConfirmation.objects.filter(confirmation_id__in=['confirmation_1000', 'confirmation_10'])
+        self.assertTrue(get_used_indexes(queryset, 'confirmation_id'))
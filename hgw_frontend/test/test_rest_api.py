@@ -15,20 +15,25 @@
 # DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 import base64
+import io
 import json
 import logging
 import os
 
 from Cryptodome.PublicKey import RSA
 from django.test import TestCase, client, tag
+from kafka.errors import CommitFailedError, KafkaError
 from mock import patch
 
 from hgw_common.cipher import Cipher
-from hgw_common.utils import ERRORS
+from hgw_common.messaging.frames import FRAME_CONTENT_TYPE, read_frames
+from hgw_common.messaging.receiver import KafkaReceiver, create_watermarks
+from hgw_common.utils import ERRORS, create_broker_parameters_from_settings
 from hgw_common.utils.mocks import (MockKafkaConsumer, MockMessage,
                                     get_free_port, start_mock_server)
 from hgw_frontend.models import (ConsentConfirmation, Destination, FlowRequest,
                                  RESTClient)
+from hgw_frontend.settings import KAFKA_WATERMARKS_TTL
 
 from . import CORRECT_CONFIRM_ID, SOURCES_DATA
 from .utils import (MockBackendRequestHandler,
@@ -232,6 +237,13 @@ class TestHGWFrontendAPI(TestCase):
             self.assertEqual(res.status_code, 403)
             res = self.client.get('/v1/messages/info/', **headers)
             self.assertEqual(res.status_code, 403)
+            res = self.client.get('/v1/messages/stream/', **headers)
+            self.assertEqual(res.status_code, 403)
+            res = self.client.get('/v1/messages/next/', **headers)
+            self.assertEqual(res.status_code, 403)
+            res = self.client.post('/v1/messages/ack/', data=json.dumps({'message_id': 3}),
+                                   content_type='application/json', **headers)
+            self.assertEqual(res.status_code, 403)
 
     def test_get_sources(self):
         """
@@ -354,6 +366,14 @@ class TestHGWFrontendAPI(TestCase):
     def set_mock_kafka_consumer(self, mock_kc_klass):
         mock_kc_klass.FIRST = 3
         mock_kc_klass.END = 33
+        mock_kc_klass.COMMITTED = {}
+        # the ids are cached without the background refresh and with a frozen clock, so the tests don't depend
+        # on the time
+        watermarks = create_watermarks(create_broker_parameters_from_settings(), ttl=KAFKA_WATERMARKS_TTL,
+                                       background_refresh=False, clock=lambda: 0)
+        patcher = patch('hgw_frontend.views.messages._watermarks', watermarks)
+        patcher.start()
+        self.addCleanup(patcher.stop)
         data = self.encrypter.encrypt(1000 * 'a')
         headers = [
             ('channel_id', b'channel'),
@@ -413,6 +433,156 @@ class TestHGWFrontendAPI(TestCase):
             for i in range(3, 13):
                 self.assertEqual(res.json()[i - 3]['message_id'], i)
 
+    def _get_frames(self, res):
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res['Content-Type'], FRAME_CONTENT_TYPE)
+        frames = list(read_frames(io.BytesIO(b''.join(res.streaming_content))))
+        for header, payload in frames:
+            # the payload is raw and the metadata is in the header of the frame
+            header['data'] = base64.b64encode(payload)
+            self._check_message(header, header['message_id'])
+        return [header['message_id'] for header, _ in frames]
+
+    @tag('message')
+    def test_get_messages_frames(self):
+        """
+        Tests that, when the binary frames format is requested, the messages are limited only by the size
+        """
+        with patch('hgw_common.messaging.receiver.KafkaConsumer', MockKafkaConsumer):
+            self.set_mock_kafka_consumer(MockKafkaConsumer)
+            headers = self._get_oauth_header(client_name=DEST_1_NAME)
+            headers['HTTP_ACCEPT'] = FRAME_CONTENT_TYPE
+
+            res = self.client.get('/v1/messages/', **headers)
+            self.assertEqual(res['X-Total-Count'], '30')
+            self.assertEqual(res['X-Skipped'], '0')
+            self.assertEqual(self._get_frames(res), list(range(3, 33)))
+
+            res = self.client.get('/v1/messages/?start=30', **headers)
+            self.assertEqual(res['X-Skipped'], '27')
+            self.assertEqual(self._get_frames(res), [30, 31, 32])
+
+            res = self.client.get('/v1/messages/?start=33', **headers)
+            self.assertEqual(self._get_frames(res), [])
+
+    @tag('message')
+    def test_get_messages_frames_max_bytes(self):
+        with patch('hgw_common.messaging.receiver.KafkaConsumer', MockKafkaConsumer):
+            self.set_mock_kafka_consumer(MockKafkaConsumer)
+            headers = self._get_oauth_header(client_name=DEST_1_NAME)
+            headers['HTTP_ACCEPT'] = FRAME_CONTENT_TYPE
+
+            res = self.client.get('/v1/messages/?start=10&max_bytes=1', **headers)
+            frame_size = len(b''.join(res.streaming_content))
+
+            res = self.client.get('/v1/messages/?start=10&max_bytes={}'.format(frame_size * 3 + 1), **headers)
+            self.assertEqual(self._get_frames(res), [10, 11, 12])
+
+            # the first message is always sent even if it is bigger than the limit
+            res = self.client.get('/v1/messages/?start=10&max_bytes=1', **headers)
+            self.assertEqual(self._get_frames(res), [10])
+
+    @tag('message')
+    def test_get_messages_frames_not_found(self):
+        with patch('hgw_common.messaging.receiver.KafkaConsumer', MockKafkaConsumer):
+            self.set_mock_kafka_consumer(MockKafkaConsumer)
+            headers = self._get_oauth_header(client_name=DEST_1_NAME)
+            headers['HTTP_ACCEPT'] = FRAME_CONTENT_TYPE
+            res = self.client.get('/v1/messages/?start=0', **headers)
+            self.assertEqual(res.status_code, 404)
+            self.assertDictEqual(res.json(), {'first_id': 3, 'last_id': 32})
+
+    def _ack(self, message_id, headers):
+        return self.client.post('/v1/messages/ack/', data=json.dumps({'message_id': message_id}),
+                                content_type='application/json', **headers)
+
+    @tag('message')
+    def test_get_next_batch(self):
+        """
+        Tests that the next batch starts after the last acknowledged message
+        """
+        with patch('hgw_common.messaging.receiver.KafkaConsumer', MockKafkaConsumer):
+            self.set_mock_kafka_consumer(MockKafkaConsumer)
+            headers = self._get_oauth_header(client_name=DEST_1_NAME)
+
+            for _ in range(2):
+                # until the messages are acknowledged the same batch is returned
+                res = self.client.get('/v1/messages/next/', **headers)
+                self.assertEqual(res.status_code, 200)
+                self.assertEqual(res['X-Skipped'], '0')
+                self.assertEqual([msg['message_id'] for msg in res.json()], list(range(3, 8)))
+
+            res = self._ack(7, headers)
+            self.assertEqual(res.status_code, 200)
+            self.assertEqual(res.json(), {'next_id': 8})
+
+            res = self.client.get('/v1/messages/next/?limit=10', **headers)
+            self.assertEqual(res['X-Skipped'], '5')
+            self.assertEqual([msg['message_id'] for msg in res.json()], list(range(8, 18)))
+            for msg in res.json():
+                self._check_message(msg, msg['message_id'])
+
+            res = self._ack(32, headers)
+            self.assertEqual(res.status_code, 200)
+            res = self.client.get('/v1/messages/next/', **headers)
+            self.assertEqual(res.status_code, 200)
+            self.assertEqual(res.json(), [])
+
+    @tag('message')
+    def test_get_next_batch_frames(self):
+        with patch('hgw_common.messaging.receiver.KafkaConsumer', MockKafkaConsumer):
+            self.set_mock_kafka_consumer(MockKafkaConsumer)
+            headers = self._get_oauth_header(client_name=DEST_1_NAME)
+            res = self._ack(29, headers)
+            self.assertEqual(res.status_code, 200)
+            self.assertEqual(res.json(), {'next_id': 30})
+            headers['HTTP_ACCEPT'] = FRAME_CONTENT_TYPE
+            res = self.client.get('/v1/messages/next/', **headers)
+            self.assertEqual(self._get_frames(res), [30, 31, 32])
+
+    @tag('message')
+    def test_next_batch_without_rebalance(self):
+        """
+        Tests that the cursor receivers don't join the consumer group of the destination and that the broker errors
+        are returned as 503
+        """
+        with patch('hgw_common.messaging.receiver.KafkaConsumer', MockKafkaConsumer):
+            self.set_mock_kafka_consumer(MockKafkaConsumer)
+            headers = self._get_oauth_header(client_name=DEST_1_NAME)
+            with patch.object(MockKafkaConsumer, 'subscribe') as subscribe:
+                res = self.client.get('/v1/messages/next/', **headers)
+                self.assertEqual(res.status_code, 200)
+                res = self._ack(7, headers)
+                self.assertEqual(res.status_code, 200)
+                subscribe.assert_not_called()
+
+            with patch.object(MockKafkaConsumer, 'commit', side_effect=CommitFailedError):
+                res = self._ack(8, headers)
+                self.assertEqual(res.status_code, 503)
+                self.assertEqual(res.json(), {'errors': [ERRORS.BROKER_ERROR]})
+            with patch.object(MockKafkaConsumer, 'committed', side_effect=KafkaError):
+                res = self.client.get('/v1/messages/next/', **headers)
+                self.assertEqual(res.status_code, 503)
+            res = self.client.get('/v1/messages/next/', **headers)
+            self.assertEqual([msg['message_id'] for msg in res.json()], list(range(8, 13)))
+
+    @tag('message')
+    def test_ack_errors(self):
+        with patch('hgw_common.messaging.receiver.KafkaConsumer', MockKafkaConsumer):
+            self.set_mock_kafka_consumer(MockKafkaConsumer)
+            headers = self._get_oauth_header(client_name=DEST_1_NAME)
+            for message_id in (2, 33):
+                res = self._ack(message_id, headers)
+                self.assertEqual(res.status_code, 404)
+                self.assertDictEqual(res.json(), {'first_id': 3, 'last_id': 32})
+
+            for data in ({}, {'message_id': '5'}, {'message_id': True}, [5]):
+                res = self.client.post('/v1/messages/ack/', data=json.dumps(data),
+                                       content_type='application/json', **headers)
+                self.assertEqual(res.status_code, 400)
+                self.assertEqual(res.json(), {'errors': [ERRORS.MISSING_PARAMETERS]})
+            self.assertEqual(MockKafkaConsumer.COMMITTED, {})
+
     @tag('message')
     def test_get_message_not_found(self):
         with patch('hgw_common.messaging.receiver.KafkaConsumer', MockKafkaConsumer):
@@ -441,6 +611,101 @@ class TestHGWFrontendAPI(TestCase):
             self.assertEqual(res.status_code, 404)
             self.assertDictEqual(res.json(), {'first_id': 3, 'last_id': 32})
 
+    @tag('message')
+    def test_stream_messages(self):
+        with patch('hgw_common.messaging.receiver.KafkaConsumer', MockKafkaConsumer):
+            self.set_mock_kafka_consumer(MockKafkaConsumer)
+            headers = self._get_oauth_header(client_name=DEST_1_NAME)
+            res = self.client.get('/v1/messages/stream/?start=30&timeout=0', **headers)
+            self.assertEqual(res.status_code, 200)
+            self.assertEqual(res['Content-Type'], 'application/x-ndjson')
+            lines = b''.join(res.streaming_content).decode('utf-8').splitlines()
+            self.assertEqual(len(lines), 3)
+            for index, line in enumerate(lines):
+                self._check_message(json.loads(line), index + 30)
+
+    @tag('message')
+    def test_stream_messages_wrong_parameters(self):
+        with patch('hgw_common.messaging.receiver.KafkaConsumer', MockKafkaConsumer):
+            self.set_mock_kafka_consumer(MockKafkaConsumer)
+            headers = self._get_oauth_header(client_name=DEST_1_NAME)
+            for query in ('start=first', 'timeout=long', 'start=30&timeout=-1'):
+                res = self.client.get('/v1/messages/stream/?{}'.format(query), **headers)
+                self.assertEqual(res.status_code, 400)
+                self.assertEqual(res.json(), {'errors': [ERRORS.INVALID_PARAMETERS]})
+
+    @tag('message')
+    def test_stream_messages_closes_consumer(self):
+        """
+        Tests that the consumer is closed when the stream ends, when the client disconnects and when the start
+        is out of range
+        """
+        with patch('hgw_common.messaging.receiver.KafkaConsumer', MockKafkaConsumer):
+            self.set_mock_kafka_consumer(MockKafkaConsumer)
+            headers = self._get_oauth_header(client_name=DEST_1_NAME)
+            with patch.object(KafkaReceiver, 'close') as close:
+                res = self.client.get('/v1/messages/stream/?start=30&timeout=0', **headers)
+                close.assert_not_called()
+                b''.join(res.streaming_content)
+                self.assertEqual(close.call_count, 1)
+
+                res = self.client.get('/v1/messages/stream/?start=30&timeout=0', **headers)
+                next(iter(res.streaming_content))
+                res.close()
+                self.assertEqual(close.call_count, 2)
+
+                self.client.get('/v1/messages/stream/?start=0&timeout=0', **headers)
+                self.assertEqual(close.call_count, 3)
+
+    @tag('message')
+    def test_stream_messages_too_many_streams(self):
+        """
+        Tests that, when the process is serving the maximum number of streams, the new ones are rejected with 429
+        until one of them is closed
+        """
+        with patch('hgw_common.messaging.receiver.KafkaConsumer', MockKafkaConsumer), \
+                self.settings(MESSAGES_MAX_STREAMS=2):
+            self.set_mock_kafka_consumer(MockKafkaConsumer)
+            headers = self._get_oauth_header(client_name=DEST_1_NAME)
+            streams = [self.client.get('/v1/messages/stream/?start=30&timeout=0', **headers) for _ in range(2)]
+            self.assertEqual([res.status_code for res in streams], [200, 200])
+
+            res = self.client.get('/v1/messages/stream/?start=30&timeout=0', **headers)
+            self.assertEqual(res.status_code, 429)
+            self.assertEqual(res.json(), {'errors': [ERRORS.TOO_MANY_REQUESTS]})
+            self.assertEqual(res['Retry-After'], '20')
+
+            # the streams are released when they end or when they are closed, and also when the start is not valid
+            b''.join(streams[0].streaming_content)
+            streams[1].close()
+            for start in (0, 0, 30, 30):
+                res = self.client.get('/v1/messages/stream/?start={}&timeout=0'.format(start), **headers)
+                self.assertEqual(res.status_code, 404 if start == 0 else 200)
+            res = self.client.get('/v1/messages/stream/?start=30&timeout=0', **headers)
+            self.assertEqual(res.status_code, 429)
+
+    @tag('message')
+    def test_stream_messages_keep_alive(self):
+        """
+        Tests that, when the start is the next message to be produced, the stream sends only a keep-alive
+        """
+        with patch('hgw_common.messaging.receiver.KafkaConsumer', MockKafkaConsumer):
+            self.set_mock_kafka_consumer(MockKafkaConsumer)
+            headers = self._get_oauth_header(client_name=DEST_1_NAME)
+            res = self.client.get('/v1/messages/stream/?start=33&timeout=0', **headers)
+            self.assertEqual(res.status_code, 200)
+            self.assertEqual(b''.join(res.streaming_content), b'\n')
+
+    @tag('message')
+    def test_stream_messages_not_found(self):
+        with patch('hgw_common.messaging.receiver.KafkaConsumer', MockKafkaConsumer):
+            self.set_mock_kafka_consumer(MockKafkaConsumer)
+            headers = self._get_oauth_header(client_name=DEST_1_NAME)
+            for start in (0, 34):
+                res = self.client.get('/v1/messages/stream/?start={}&timeout=0'.format(start), **headers)
+                self.assertEqual(res.status_code, 404)
+                self.assertDictEqual(res.json(), {'first_id': 3, 'last_id': 32})
+
     @tag('message')
     def test_get_messages_info(self):
         with patch('hgw_common.messaging.receiver.KafkaConsumer', MockKafkaConsumer):
@@ -453,3 +718,32 @@ class TestHGWFrontendAPI(TestCase):
                 'last_id': 32,
                 'count': 30
             })
+
+    @tag('message')
+    def test_get_messages_info_cached(self):
+        """
+        Tests that the first and last ids are cached and that they are refreshed when a client asks for an id
+        not in the cached range
+        """
+        with patch('hgw_common.messaging.receiver.KafkaConsumer', MockKafkaConsumer):
+            self.set_mock_kafka_consumer(MockKafkaConsumer)
+            headers = self._get_oauth_header(client_name=DEST_1_NAME)
+            res = self.client.get('/v1/messages/info/', **headers)
+            self.assertEqual(res.json()['last_id'], 32)
+
+            last_message = MockKafkaConsumer.MESSAGES[32]
+            MockKafkaConsumer.MESSAGES[33] = MockMessage(offset=33, topic=last_message.topic,
+                                                         headers=last_message.headers, value=last_message.value)
+            MockKafkaConsumer.END = 34
+            with patch.object(MockKafkaConsumer, 'end_offsets') as end_offsets:
+                res = self.client.get('/v1/messages/info/', **headers)
+                self.assertEqual(res.json()['last_id'], 32)
+                res = self.client.get('/v1/messages/?start=30', **headers)
+                self.assertEqual(len(res.json()), 3)
+                end_offsets.assert_not_called()
+
+            res = self.client.get('/v1/messages/33/', **headers)
+            self.assertEqual(res.status_code, 200)
+            self._check_message(res.json(), 33)
+            res = self.client.get('/v1/messages/info/', **headers)
+            self.assertEqual(res.json()['last_id'], 33)
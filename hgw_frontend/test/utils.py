@@ -18,6 +18,7 @@
 
 import json
 import re
+from urllib.parse import parse_qs, urlparse
 
 from django.core.exceptions import ObjectDoesNotExist
 from django.db import DatabaseError
@@ -43,18 +44,31 @@ class MockConsentManagerRequestHandler(MockRequestHandler):
     CONSENT_PATTERN = re.compile(r'/v1/consents/({}|{})/'.format(CORRECT_CONSENT_ID_AC, CORRECT_CONSENT_ID_CR))
     WRONG_CONSENT_PATTERN = re.compile(r'/v1/consents/({}|{})/'.format(WRONG_CONSENT_ID, WRONG_CONSENT_ID2))
     CONSENTS_PATTERN = re.compile(r'/v1/consents/')
+    CONSENTS_BULK_PATTERN = re.compile(r'/v1/consents/bulk/')
+    CONSENTS_LIST_PATTERN = re.compile(r'/v1/consents/(\?.*)?$')
     OAUTH2_PATTERN = re.compile(r'/oauth2/token/')
 
+    @staticmethod
+    def _create_consent(consent_data):
+        if PERSON_ID == consent_data['person_id']:
+            return {"consent_id": get_random_string(32),
+                    "confirm_id": get_random_string(32),
+                    "status": "PE"}
+        return None
+
     def do_POST(self):
-        if self._path_match(self.CONSENTS_PATTERN):
+        if self._path_match(self.CONSENTS_BULK_PATTERN):
+            # Mock the bulk consent creation with the same behaviour of the single consent creation
+            payload = []
+            for consent_data in self._json_data():
+                result = self._create_consent(consent_data)
+                payload.append(result if result is not None else {'errors': {'person_id': ['wrong_person']}})
+            status_code = 201 if any('confirm_id' in item for item in payload) else 400
+        elif self._path_match(self.CONSENTS_PATTERN):
             # Mock the consent creation. The behaviour is: if the person is PERSON_ID the consent is created.
             # Otherwise the consent is not created and a 400 status code is returned
-            consent_data = self._json_data()
-
-            if PERSON_ID == consent_data['person_id']:
-                payload = {"consent_id": get_random_string(32),
-                           "confirm_id": get_random_string(32),
-                           "status": "PE"}
+            payload = self._create_consent(self._json_data())
+            if payload is not None:
                 status_code = 201
             else:
                 payload = []
@@ -79,9 +93,9 @@ class MockConsentManagerRequestHandler(MockRequestHandler):
             status_code = 200
         return self._send_response(payload, status_code)
 
-    def do_GET(self):
-        consent_search = re.search(self.CONSENT_PATTERN, self.path)
-        if consent_search:
+    @staticmethod
+    def _get_consent(consent_id):
+        if consent_id in (CORRECT_CONSENT_ID_AC, CORRECT_CONSENT_ID_CR):
             profile_payload = [{'clinical_domain': 'Laboratory',
                                 'filters': [{'includes': 'immunochemistry', 'excludes': 'HDL'}]},
                                {'clinical_domain': 'Radiology',
@@ -96,11 +110,9 @@ class MockConsentManagerRequestHandler(MockRequestHandler):
                 'payload': json.dumps(profile_payload)
             }
 
-            consent_id = consent_search.groups()[0]
-            confirm_id = CORRECT_CONFIRM_ID if consent_search.groups()[0] == CORRECT_CONSENT_ID_AC \
-                else CORRECT_CONFIRM_ID2
+            confirm_id = CORRECT_CONFIRM_ID if consent_id == CORRECT_CONSENT_ID_AC else CORRECT_CONFIRM_ID2
 
-            payload = {
+            return {
                 'source': {
                     'id': 'iWWjKVje7Ss3M45oTNUpRV59ovVpl3xT',
                     'name': 'Source 1'
@@ -117,19 +129,25 @@ class MockConsentManagerRequestHandler(MockRequestHandler):
                 'start_validity': '2017-10-23T10:00:54.123000+02:00',
                 'expire_validity': '2018-10-23T10:00:00+02:00',
             }
+        if consent_id in (WRONG_CONSENT_ID, WRONG_CONSENT_ID2):
+            confirm_id = WRONG_CONFIRM_ID if consent_id == WRONG_CONSENT_ID else WRONG_CONFIRM_ID2
+            return {
+                "consent_id": consent_id,
+                "confirm_id": confirm_id,
+                "status": "PE"
+            }
+        return None
+
+    def do_GET(self):
+        consent_search = re.search(self.CONSENT_PATTERN, self.path) or \
+            re.search(self.WRONG_CONSENT_PATTERN, self.path)
+        if consent_search:
+            payload = self._get_consent(consent_search.groups()[0])
+        elif self._path_match(self.CONSENTS_LIST_PATTERN):
+            consent_ids = parse_qs(urlparse(self.path).query).get('consent_id', [])
+            payload = [consent for consent in map(self._get_consent, consent_ids) if consent is not None]
         else:
-            consent_search = re.search(self.WRONG_CONSENT_PATTERN, self.path)
-            if consent_search:
-                consent_id = consent_search.groups()[0]
-                confirm_id = WRONG_CONFIRM_ID if consent_search.groups()[0] == WRONG_CONSENT_ID else \
-                    WRONG_CONFIRM_ID2
-                payload = {
-                    "consent_id": consent_id,
-                    "confirm_id": confirm_id,
-                    "status": "PE"
-                }
-            else:
-                payload = {}
+            payload = {}
         return self._send_response(payload)
 
 
@@ -0,0 +1,253 @@
+# Copyright (c) 2017-2018 CRS4
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to use,
+# copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or
+# substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE
+# AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+"""
+Micro-benchmark of :mod:`hgw_common.cipher`.
+
+It sweeps the payload sizes and measures:
+
+    - the steady state encrypt and decrypt throughput (MB/s), i.e. when the RSA encrypted AES key is cached
+    - the cost of the first message (ms), that includes the RSA encryption/decryption of the AES key
+    - the encrypt throughput of a pool of processes, for increasing number of workers
+
+Results are written in JSON. If a baseline file is specified, the results are compared with it and the
+script exits with status 1 when a metric regresses more than the configured threshold.
+
+Example:
+
+.. code::
+
+    PYTHONPATH=../../hgw_common python cipher_benchmark.py -o results.json
+    PYTHONPATH=../../hgw_common python cipher_benchmark.py -b results.json -t 0.1
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from Cryptodome.PublicKey import RSA
+
+from hgw_common.cipher import COMPRESSION_CODES, Cipher
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+PRI_RSA_KEY_PATH = os.path.join(BASE_DIR, 'certs/kafka/payload_encryption/rsa_privatekey_2048')
+PUB_RSA_KEY_PATH = os.path.join(BASE_DIR, 'certs/kafka/payload_encryption/rsa_publickey_2048')
+SAMPLE_DOCUMENT_PATH = os.path.join(BASE_DIR, '../../examples/source_endpoint/data/obs.json')
+
+DEFAULT_SIZES = [1024, 10 * 1024, 100 * 1024, 1024 * 1024]
+MB = 1024 * 1024
+
+# Metrics where a lower value is better. For all the others an higher value is better
+LOWER_IS_BETTER = ('first_encrypt_ms', 'first_decrypt_ms')
+
+
+def _load_key(path):
+    with open(path, 'rb') as f:
+        return RSA.importKey(f.read())
+
+
+def make_payload(size):
+    """
+    Creates a payload of :param:`size` bytes repeating the sample FHIR document,
+    so that the payload has a realistic compression ratio
+    """
+    with open(SAMPLE_DOCUMENT_PATH, 'rb') as f:
+        document = f.read()
+    return (document * (size // len(document) + 1))[:size]
+
+
+def _timeit(function, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        function()
+    return time.perf_counter() - start
+
+
+def _iterations(size, total_bytes):
+    return max(total_bytes // size, 1)
+
+
+def bench_first_message(public_key, private_key, payload, compression, repeat):
+    """
+    Returns the average time in ms for encrypting and decrypting the first message of a channel
+    """
+    encrypt_time = 0
+    decrypt_time = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        message = Cipher(public_key=public_key, compression=compression).encrypt(payload)
+        encrypt_time += time.perf_counter() - start
+
+        start = time.perf_counter()
+        Cipher(private_key=private_key).decrypt(message)
+        decrypt_time += time.perf_counter() - start
+    return encrypt_time * 1000 / repeat, decrypt_time * 1000 / repeat
+
+
+def bench_steady_state(public_key, private_key, payload, compression, iterations):
+    """
+    Returns the encrypt and decrypt throughput in MB/s excluding the first message
+    """
+    encrypter = Cipher(public_key=public_key, compression=compression)
+    decrypter = Cipher(private_key=private_key)
+    # the first message pays the RSA cost
+    decrypter.decrypt(encrypter.encrypt(payload))
+
+    messages = []
+    encrypt_time = _timeit(lambda: messages.append(encrypter.encrypt(payload)), iterations)
+    # messages are decrypted in the same order they have been encrypted since the cipher is in CBC mode
+    messages_iter = iter(messages)
+    decrypt_time = _timeit(lambda: decrypter.decrypt(next(messages_iter)), iterations)
+
+    processed = len(payload) * iterations / MB
+    return processed / encrypt_time, processed / decrypt_time
+
+
+def _encrypt_worker(size, iterations, compression):
+    public_key = _load_key(PUB_RSA_KEY_PATH)
+    payload = make_payload(size)
+    cipher = Cipher(public_key=public_key, compression=compression)
+    for _ in range(iterations):
+        cipher.encrypt(payload)
+    return size * iterations
+
+
+def bench_parallel(size, iterations, compression, workers):
+    """
+    Returns the aggregated encrypt throughput in MB/s of a pool of :param:`workers` processes.
+    Each worker encrypts :param:`iterations` payloads
+    """
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        # warm up the pool so that the process creation is not measured
+        list(executor.map(_encrypt_worker, [size] * workers, [1] * workers, [compression] * workers))
+        start = time.perf_counter()
+        processed = sum(executor.map(_encrypt_worker, [size] * workers, [iterations] * workers,
+                                     [compression] * workers))
+        elapsed = time.perf_counter() - start
+    return processed / MB / elapsed
+
+
+def run(sizes, total_bytes, repeat, workers, compression):
+    public_key = _load_key(PUB_RSA_KEY_PATH)
+    private_key = _load_key(PRI_RSA_KEY_PATH)
+
+    results = {
+        'encrypt_mbs': {},
+        'decrypt_mbs': {},
+        'first_encrypt_ms': {},
+        'first_decrypt_ms': {},
+        'parallel_encrypt_mbs': {},
+    }
+    for size in sizes:
+        payload = make_payload(size)
+        iterations = _iterations(size, total_bytes)
+
+        first_encrypt, first_decrypt = bench_first_message(public_key, private_key, payload, compression, repeat)
+        encrypt, decrypt = bench_steady_state(public_key, private_key, payload, compression, iterations)
+
+        results['first_encrypt_ms'][str(size)] = first_encrypt
+        results['first_decrypt_ms'][str(size)] = first_decrypt
+        results['encrypt_mbs'][str(size)] = encrypt
+        results['decrypt_mbs'][str(size)] = decrypt
+        print('size: {:>8} B - encrypt: {:8.2f} MB/s - decrypt: {:8.2f} MB/s - '
+              'first encrypt: {:6.2f} ms - first decrypt: {:6.2f} ms'.format(
+                  size, encrypt, decrypt, first_encrypt, first_decrypt))
+
+    parallel_size = max(sizes)
+    for workers_num in workers:
+        throughput = bench_parallel(parallel_size, _iterations(parallel_size, total_bytes), compression, workers_num)
+        results['parallel_encrypt_mbs'][str(workers_num)] = throughput
+        print('workers: {:>3} - size: {:>8} B - encrypt: {:8.2f} MB/s'.format(workers_num, parallel_size, throughput))
+
+    return results
+
+
+def find_regressions(results, baseline, threshold):
+    """
+    Compares :param:`results` with :param:`baseline`. It returns a list of tuples (metric, key, baseline, current)
+    for the values that are worse than the baseline by more than :param:`threshold` (i.e., 0.1 means 10%).
+    Metrics or keys missing in one of the two are ignored
+    """
+    regressions = []
+    for metric, values in results.items():
+        for key, current in values.items():
+            try:
+                reference = baseline[metric][key]
+            except KeyError:
+                continue
+            if metric in LOWER_IS_BETTER:
+                regressed = current > reference * (1 + threshold)
+            else:
+                regressed = current < reference * (1 - threshold)
+            if regressed:
+                regressions.append((metric, key, reference, current))
+    return regressions
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(description='Micro-benchmark of hgw_common.cipher')
+    parser.add_argument('-s', '--sizes', dest='sizes', type=int, nargs='+', default=DEFAULT_SIZES,
+                        help='The payload sizes in bytes to benchmark')
+    parser.add_argument('--total_bytes', dest='total_bytes', type=int, default=20 * MB,
+                        help='The amount of bytes to process for every size')
+    parser.add_argument('-r', '--repeat', dest='repeat', type=int, default=10,
+                        help='The number of repetitions for the first message measurement')
+    parser.add_argument('-w', '--workers', dest='workers', type=int, nargs='+',
+                        default=sorted({1, 2, multiprocessing.cpu_count()}),
+                        help='The number of processes to use for the parallel scaling measurements')
+    parser.add_argument('-z', '--compression', dest='compression', choices=list(COMPRESSION_CODES), default=None,
+                        help='Compress the payloads before encrypting')
+    parser.add_argument('-o', '--output', dest='output', type=str, default=None,
+                        help='JSON file where to store the results')
+    parser.add_argument('-b', '--baseline', dest='baseline', type=str, default=None,
+                        help='JSON file with previous results to compare with')
+    parser.add_argument('-t', '--threshold', dest='threshold', type=float, default=0.1,
+                        help='Maximum allowed regression with respect to the baseline (0.1 means 10%%)')
+    return parser
+
+
+if __name__ == '__main__':
+    args = get_parser().parse_args()
+
+    results = run(args.sizes, args.total_bytes, args.repeat, args.workers, args.compression)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({
+                'config': {
+                    'sizes': args.sizes,
+                    'total_bytes': args.total_bytes,
+                    'repeat': args.repeat,
+                    'workers': args.workers,
+                    'compression': args.compression,
+                },
+                'results': results
+            }, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)['results']
+        regressions = find_regressions(results, baseline, args.threshold)
+        for metric, key, reference, current in regressions:
+            print('REGRESSION {} [{}]: baseline {:.2f} - current {:.2f}'.format(metric, key, reference, current))
+        if regressions:
+            sys.exit(1)
+        print('No regressions found')